@@ -0,0 +1,453 @@
+"""
+Load test the app offline with a fake OpenAI compatible provider.
+
+`ollama-client bench` writes a config.py to a temporary directory. It is the config of the current
+directory, except that the only model is served by a fake provider and the database is a new
+database in the temporary directory. This module is then run in that directory. The fake provider,
+the app and the simulated users run in one process. The provider and the app are served by
+uvicorn on localhost in their own threads, and the users are driven from the main thread.
+
+Each user logs in and then posts messages to /chat, like the chat page does. A new dialog is created
+every `turns` messages. Only the dialog_id and the new message are posted. The server reads the
+history from the database and saves the user message and the reply with the write-behind queue, so
+each following turn reads back what the queue wrote. With `legacy` the full history is posted to
+/chat and the messages are saved with /chat/create-message, like older clients do. When the app has
+stopped, the saved messages are counted, and a missing message counts as an error.
+
+The report holds percentiles of the time to first token and the latency between content frames
+(several tokens may share a frame in the compact stream format), requests per second, and the
+CPU time of the app thread (the worker).
+
+`ollama-client bench-crud` is a micro-benchmark of the CRUD layer on a temporary database. It
+compares the row by row paths with the bulk paths (executemany, upsert) and the SQL cache.
+"""
+
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+
+BENCH_MODEL = "bench-model"
+BENCH_PASSWORD = "bench-password"
+
+CONFIG_OVERRIDES = """
+
+# Overrides for ollama-client bench
+DATA_DIR = "data"
+DATABASE = "data/database.db"
+LOG_LEVEL = 30
+PROVIDERS = {{"bench": {{"base_url": "http://127.0.0.1:{provider_port}/v1", "api_key": "bench"}}}}
+MODELS = {{"{model}": "bench"}}
+DEFAULT_MODEL = "{model}"
+WARM_MODELS = []
+
+
+def bench_tool() -> str:
+    return "Tool result"
+
+
+TOOL_REGISTRY = {{"bench_tool": bench_tool}}
+TOOL_MODELS = ["{model}"]
+TOOLS = [
+    {{
+        "type": "function",
+        "function": {{"name": "bench_tool", "description": "Bench tool", "parameters": {{"type": "object", "properties": {{}}}}}},
+    }}
+]
+"""
+
+
+def _get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run(options: dict) -> int:
+    """
+    Run the bench in a temporary directory with a config pointing at the fake provider.
+    Returns the exit code of the bench process.
+    """
+    import config
+
+    options = {**options, "provider_port": _get_free_port(), "app_port": _get_free_port()}
+    config_content = Path(config.__file__).read_text()
+    config_content += CONFIG_OVERRIDES.format(provider_port=options["provider_port"], model=BENCH_MODEL)
+
+    # The package must be importable from the temporary directory
+    package_parent = str(Path(__file__).resolve().parent.parent)
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([package_parent, os.environ.get("PYTHONPATH", "")])}
+
+    with tempfile.TemporaryDirectory(prefix="ollama-client-bench-") as bench_dir:
+        Path(bench_dir, "config.py").write_text(config_content)
+        cmd = [sys.executable, "-m", "ollama_client.bench", json.dumps(options)]
+        return subprocess.run(cmd, cwd=bench_dir, env=env).returncode
+
+
+def create_fake_provider(token_rate: float, latency: float, num_tokens: int, tool_calls: float) -> Starlette:
+    """
+    Create an OpenAI compatible provider streaming num_tokens tokens at token_rate tokens per second
+    after latency seconds. A fraction (tool_calls) of the requests offering tools get a tool call first.
+    """
+
+    def chunk(delta: dict, finish_reason=None) -> str:
+        data = {
+            "id": "bench",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": BENCH_MODEL,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(data)}\n\n"
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        has_tool_result = any(message.get("role") == "tool" for message in body["messages"])
+        call_tool = "tools" in body and not has_tool_result and random.random() < tool_calls
+
+        async def stream():
+            await asyncio.sleep(latency)
+            if call_tool:
+                tool_call = {"index": 0, "id": "call_0", "type": "function", "function": {"name": "bench_tool", "arguments": "{}"}}
+                yield chunk({"role": "assistant", "tool_calls": [tool_call]})
+                yield chunk({}, "tool_calls")
+            else:
+                for index in range(num_tokens):
+                    if index:
+                        await asyncio.sleep(1 / token_rate)
+                    yield chunk({"role": "assistant", "content": f"token{index} "})
+                yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    async def models(request: Request):
+        return JSONResponse({"object": "list", "data": [{"id": BENCH_MODEL, "object": "model", "created": 0, "owned_by": "bench"}]})
+
+    return Starlette(
+        routes=[
+            Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+            Route("/v1/models", models),
+        ]
+    )
+
+
+class _ServerThread:
+    """
+    Serve an ASGI app with uvicorn in a thread with its own event loop
+    """
+
+    def __init__(self, app, port: int):
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("Server failed to start")
+            time.sleep(0.05)
+
+    def cpu_time(self) -> float:
+        """
+        CPU time of the thread. Falls back to the CPU time of the process.
+        """
+        try:
+            return time.clock_gettime(time.pthread_getcpuclockid(self.thread.ident))  # type: ignore[arg-type]
+        except (AttributeError, OSError):
+            return time.process_time()
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+async def _create_users(num_users: int) -> list:
+    import secrets
+    from config import DATABASE
+    from ollama_client.database.crud import CRUD
+    from ollama_client.database.database_utils import DatabaseConnection
+    from ollama_client.models.user_model import _password_hash
+
+    # A low cost, so logging in does not dominate the bench
+    password_hash = _password_hash(BENCH_PASSWORD, cost=4)
+    emails = [f"bench-{index}@example.com" for index in range(num_users)]
+    async with DatabaseConnection(DATABASE).async_transaction_scope() as connection:
+        crud = CRUD(connection)
+        for email in emails:
+            insert_values = {"email": email, "password_hash": password_hash, "verified": 1, "random": secrets.token_urlsafe(32)}
+            await crud.insert("users", insert_values)
+
+    return emails
+
+
+async def _login(client: httpx.AsyncClient, email: str) -> dict:
+    response = await client.post("/user/login", json={"email": email, "password": BENCH_PASSWORD})
+    if response.json().get("error"):
+        raise RuntimeError(f"Login failed: {response.text}")
+
+    # The session cookie is https only, so it is sent by hand
+    cookie = response.headers["set-cookie"].split(";")[0]
+    return {"Cookie": cookie}
+
+
+async def _stream_chat(client: httpx.AsyncClient, headers: dict, body: dict, results: dict) -> str:
+    """
+    Post a chat request and record the latencies. Returns the streamed content.
+    """
+    started = time.monotonic()
+    last_frame = 0.0
+    content_parts = []
+    async with client.stream("POST", "/chat", json=body, headers=headers) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"Chat failed with status {response.status_code}")
+
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+
+            data = json.loads(line[len("data: ") :])
+            if "error" in data:
+                raise RuntimeError(data["error"])
+
+            if data.get("c"):
+                now = time.monotonic()
+                if last_frame:
+                    results["itl"].append(now - last_frame)
+                else:
+                    results["ttft"].append(now - started)
+                last_frame = now
+                content_parts.append(data["c"])
+
+    results["duration"].append(time.monotonic() - started)
+    return "".join(content_parts)
+
+
+async def _run_user(client: httpx.AsyncClient, email: str, options: dict, results: dict) -> None:
+    try:
+        headers = await _login(client, email)
+    except Exception as e:
+        results["errors"].append(repr(e))
+        return
+
+    dialog_id = None
+    history: list = []
+    for index in range(options["requests"]):
+        try:
+            if dialog_id is None or index % options["turns"] == 0:
+                response = await client.post("/chat/create-dialog", json={"title": f"Bench {index}"}, headers=headers)
+                dialog_id = response.json()["dialog_id"]
+                history = []
+
+            user_message = {"role": "user", "content": f"Bench message {index}"}
+
+            if not options["legacy"]:
+                body = {"model": BENCH_MODEL, "dialog_id": dialog_id, "message": user_message, "stream_format": "compact"}
+                await _stream_chat(client, headers, body, results)
+                results["messages"] += 2
+                continue
+
+            body = {"model": BENCH_MODEL, "messages": history + [user_message], "stream_format": "compact"}
+            content = await _stream_chat(client, headers, body, results)
+            for message in [user_message, {"role": "assistant", "content": content}]:
+                response = await client.post(f"/chat/create-message/{dialog_id}", json=message, headers=headers)
+                if response.json().get("error"):
+                    raise RuntimeError(f"Saving a message failed: {response.text}")
+                history.append(message)
+                results["messages"] += 1
+
+        except Exception as e:
+            # A new dialog is created, as the history of this one is not known
+            dialog_id = None
+            results["errors"].append(repr(e))
+
+
+def _percentile(values: list, percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def _format_percentiles(name: str, values: list, scale: float = 1000, unit: str = "ms") -> str:
+    p50, p95, p99 = [_percentile(values, percent) * scale for percent in (50, 95, 99)]
+    return f"{name:<28} p50 {p50:9.1f} {unit}   p95 {p95:9.1f} {unit}   p99 {p99:9.1f} {unit}"
+
+
+async def _drive(options: dict, app_server: _ServerThread) -> dict:
+    emails = await _create_users(options["users"])
+    results: dict = {"ttft": [], "itl": [], "duration": [], "errors": [], "messages": 0}
+
+    limits = httpx.Limits(max_connections=options["users"] * 2, max_keepalive_connections=options["users"] * 2)
+    base_url = f"http://127.0.0.1:{options['app_port']}"
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=600) as client:
+        started = time.monotonic()
+        cpu_started = app_server.cpu_time()
+        await asyncio.gather(*[_run_user(client, email, options, results) for email in emails])
+        results["elapsed"] = time.monotonic() - started
+        results["cpu"] = app_server.cpu_time() - cpu_started
+
+    return results
+
+
+def _report(options: dict, results: dict) -> None:
+    num_requests = len(results["duration"])
+    elapsed = results["elapsed"]
+    mode = "legacy" if options["legacy"] else "dialog"
+    print(
+        f"Users: {options['users']}  Requests: {num_requests}  Turns per dialog: {options['turns']}  "
+        f"Errors: {len(results['errors'])}  Mode: {mode}  Elapsed: {elapsed:.2f}s"
+    )
+    print(
+        f"Fake provider: {options['tokens']} tokens at {options['token_rate']} tokens/s, "
+        f"latency {options['latency']}s, tool calls {options['tool_calls']:.0%}"
+    )
+    print(f"{'Requests per second':<28} {num_requests / elapsed:.2f}")
+    print(_format_percentiles("Time to first token", results["ttft"]))
+    print(_format_percentiles("Inter-token latency", results["itl"]))
+    print(_format_percentiles("Request duration", results["duration"], scale=1, unit="s "))
+    print(f"{'Worker CPU':<28} {results['cpu']:.2f}s ({results['cpu'] / elapsed:.0%} of one core)")
+    print(f"{'Messages saved':<28} {results['saved']} of {results['messages']}")
+
+    for error in sorted(set(results["errors"]))[:5]:
+        print(f"Error: {error}")
+
+
+def _count_saved_messages() -> int:
+    """
+    Count the messages in the database. Run it after the app has stopped, so the
+    write-behind queue has written all messages.
+    """
+    import sqlite3
+    from config import DATABASE
+
+    connection = sqlite3.connect(DATABASE)
+    try:
+        return connection.execute("SELECT COUNT(*) FROM message").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def main(options: dict) -> int:
+    from ollama_client.database.migration import Migration
+    from ollama_client.migrations import migrations
+    from config import DATA_DIR, DATABASE
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    migration_manager = Migration(DATABASE, migrations)
+    migration_manager.run_migrations()
+    migration_manager.close()
+
+    random.seed(0)
+    provider = create_fake_provider(options["token_rate"], options["latency"], options["tokens"], options["tool_calls"])
+    provider_server = _ServerThread(provider, options["provider_port"])
+    provider_server.start()
+
+    from ollama_client.main import app
+
+    app_server = _ServerThread(app, options["app_port"])
+    app_server.start()
+
+    try:
+        results = asyncio.run(_drive(options, app_server))
+    finally:
+        app_server.stop()
+        provider_server.stop()
+
+    results["saved"] = _count_saved_messages()
+    if results["saved"] != results["messages"]:
+        results["errors"].append(f"Saved {results['saved']} messages, expected {results['messages']}")
+
+    _report(options, results)
+    return 1 if results["errors"] else 0
+
+
+async def _time_ops(name: str, num_ops: int, func) -> float:
+    started = time.perf_counter()
+    await func()
+    ops_per_second = num_ops / (time.perf_counter() - started)
+    print(f"{name:<44} {ops_per_second:12,.0f} ops/s")
+    return ops_per_second
+
+
+async def _crud_benchmark(database_url: str, num_rows: int) -> None:
+    from ollama_client.database.crud import CRUD
+    from ollama_client.database.connection_pool import ConnectionPool, DATABASE_PRAGMAS
+    from ollama_client.database.sql_builder import _insert_sql
+
+    pool = ConnectionPool(database_url, 1, DATABASE_PRAGMAS)
+    async with pool.transaction() as connection:
+        await connection.execute("CREATE TABLE bench (bench_id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, value TEXT)")
+
+    rows = [{"key": f"key-{index}", "value": "value"} for index in range(num_rows)]
+
+    def build_uncached():
+        for row in rows:
+            _insert_sql.__wrapped__("bench", tuple(row))
+
+    def build_cached():
+        for row in rows:
+            _insert_sql("bench", tuple(row))
+
+    async def insert_one_by_one():
+        async with pool.transaction() as connection:
+            crud = CRUD(connection)
+            for row in rows:
+                await crud.insert("bench", row)
+            await connection.execute("DELETE FROM bench")
+
+    async def insert_many():
+        async with pool.transaction() as connection:
+            await CRUD(connection).insert_many("bench", rows)
+
+    async def replace_select_then_write():
+        async with pool.transaction() as connection:
+            crud = CRUD(connection)
+            for row in rows:
+                filters = {"key": row["key"]}
+                if await crud.exists("bench", filters):
+                    await crud.update("bench", {"value": "replaced"}, filters)
+                else:
+                    await crud.insert("bench", {**filters, "value": "replaced"})
+
+    async def replace_upsert():
+        async with pool.transaction() as connection:
+            crud = CRUD(connection)
+            for row in rows:
+                await crud.replace("bench", {"value": "upserted"}, {"key": row["key"]})
+
+    async def build(func):
+        func()
+
+    print(f"Rows: {num_rows}")
+    await _time_ops("Build insert SQL, uncached", num_rows, lambda: build(build_uncached))
+    await _time_ops("Build insert SQL, cached", num_rows, lambda: build(build_cached))
+    await _time_ops("Insert, one statement per row", num_rows, insert_one_by_one)
+    await _time_ops("Insert, executemany", num_rows, insert_many)
+    await _time_ops("Replace, select then update", num_rows, replace_select_then_write)
+    await _time_ops("Replace, upsert", num_rows, replace_upsert)
+    await pool.close()
+
+
+def crud_benchmark(num_rows: int) -> None:
+    with tempfile.TemporaryDirectory(prefix="ollama-client-bench-") as bench_dir:
+        asyncio.run(_crud_benchmark(str(Path(bench_dir, "bench.db")), num_rows))
+
+
+if __name__ == "__main__":
+    sys.exit(main(json.loads(sys.argv[1])))
@@ -5,6 +5,7 @@ import subprocess
 import logging
 import asyncio
 import secrets
+import time
 import ollama_client.core.set_system_path  # noqa
 from ollama_client.database.crud import CRUD
 from ollama_client.database.database_utils import DatabaseConnection
@@ -14,6 +15,7 @@ from ollama_client.migrations import migrations
 from config import DATA_DIR, LOG_LEVEL, DATABASE
 from ollama_client import __version__, __program__
 from ollama_client.core.logging import setup_logging
+from ollama_client.core import metrics
 
 
 setup_logging(LOG_LEVEL)
@@ -44,6 +46,9 @@ def _before_server_start():
     migration_manager.run_migrations()
     migration_manager.close()
 
+    # Metrics of earlier runs
+    metrics.clear()
+
 
 @cli.command(help="Start the running Uvicorn dev-server. Notice: By default it watches for changes in current dir.")
 @click.option("--port", default=8000, help="Server port.")
@@ -149,3 +154,148 @@ def init_system():
     logger.info(user_message)
 
     exit(0)
+
+
+@cli.command(help="Load test the app offline with a fake provider and a temporary database.")
+@click.option("--users", default=10, help="Number of concurrent users.")
+@click.option("--requests", default=5, help="Chat requests per user.")
+@click.option("--turns", default=3, help="Chat requests per dialog. A new dialog is created after this many.")
+@click.option("--tokens", default=100, help="Tokens in each reply of the fake provider.")
+@click.option("--token-rate", default=50.0, help="Tokens per second streamed by the fake provider.")
+@click.option("--latency", default=0.2, help="Seconds before the fake provider sends the first token.")
+@click.option("--tool-calls", default=0.0, help="Fraction of replies that start with a tool call (0-1).")
+@click.option("--legacy", is_flag=True, help="Post the full history and save messages with create-message.")
+def bench(users: int, requests: int, turns: int, tokens: int, token_rate: float, latency: float, tool_calls: float, legacy: bool):
+    from ollama_client import bench as bench_module
+
+    options = {
+        "users": users,
+        "requests": requests,
+        "turns": max(turns, 1),
+        "tokens": tokens,
+        "token_rate": token_rate,
+        "latency": latency,
+        "tool_calls": tool_calls,
+        "legacy": legacy,
+    }
+    exit(bench_module.run(options))
+
+
+@cli.command(help="Micro-benchmark of the CRUD layer on a temporary database.")
+@click.option("--rows", default=10000, help="Number of rows.")
+def bench_crud(rows: int):
+    from ollama_client import bench as bench_module
+
+    bench_module.crud_benchmark(rows)
+
+
+@cli.command(help="Add existing dialogs and messages to the search index.")
+@click.option("--batch-size", default=1000, help="Rows indexed per transaction.")
+@click.option("--rebuild", is_flag=True, help="Empty the message index first. Removes messages deleted outside the app.")
+def search_index(batch_size: int, rebuild: bool):
+    from ollama_client.models import search_model
+
+    num_dialogs, num_messages = asyncio.run(search_model.index_existing(batch_size, rebuild))
+    logger.info(f"Indexed {num_dialogs} dialogs and {num_messages} messages")
+
+
+async def _get_user_id(email: str) -> int:
+    database_connection = DatabaseConnection(DATABASE)
+    async with database_connection.async_read_scope() as connection:
+        crud = CRUD(connection)
+        user = await crud.select_one("users", columns=["user_id"], filters={"email": email})
+
+    if not user:
+        raise click.ClickException(f"User {email} does not exist")
+    return user["user_id"]
+
+
+@cli.command(help="Export the dialogs and messages of a user as NDJSON.")
+@click.option("--email", required=True, help="Email of the user.")
+@click.option("--output", type=click.File("w", encoding="utf-8"), default="-", help="Output file. Default is stdout.")
+def export_dialogs(email: str, output):
+    from ollama_client.models import export_model
+
+    async def run():
+        user_id = await _get_user_id(email)
+        async for chunk in export_model.export_dialogs(user_id):
+            output.write(chunk)
+
+    asyncio.run(run())
+
+
+@cli.command(help="Import dialogs and messages from NDJSON made with export-dialogs. Existing dialogs are skipped.")
+@click.option("--email", required=True, help="Email of the user the dialogs are imported to.")
+@click.option("--input", "input_file", type=click.File("r", encoding="utf-8"), default="-", help="Input file. Default is stdin.")
+@click.option("--batch-size", default=1000, help="Rows inserted per transaction.")
+def import_dialogs(email: str, input_file, batch_size: int):
+    from ollama_client.models import export_model
+
+    async def run():
+        user_id = await _get_user_id(email)
+        try:
+            result = await export_model.import_dialogs(user_id, input_file, batch_size)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        logger.info(f"Imported {result['dialogs']} dialogs and {result['messages']} messages")
+        if result["skipped_dialogs"]:
+            logger.info(f"Skipped {result['skipped_dialogs']} dialogs that already exist")
+
+    asyncio.run(run())
+
+
+@cli.command(help="Compress or decompress the stored messages with the current MESSAGE_COMPRESSION_THRESHOLD.")
+@click.option("--batch-size", default=1000, help="Messages rewritten per transaction.")
+def compress_messages(batch_size: int):
+    from ollama_client.models import chat_model
+
+    result = asyncio.run(chat_model.recompress_messages(batch_size))
+    saved = result["size_before"] - result["size_after"]
+    logger.info(f"Rewrote {result['messages']} messages")
+    logger.info(f"Database in use: {result['size_before']} bytes before, {result['size_after']} bytes after. Saved {saved} bytes")
+    logger.info("Free pages are reused by new rows, and returned to the file system by VACUUM or the vacuum maintenance job")
+
+
+@cli.command(help="Back up the database while the server is running.")
+@click.option("--output", default="", help="Backup file. Default is DATA_DIR/backups/database-<time>.db")
+@click.option("--compress", is_flag=True, help="Compress the backup with gzip.")
+@click.option("--pages", default=256, help="Pages copied per step.")
+@click.option("--sleep", default=0.005, help="Seconds between steps, so writers are not starved.")
+@click.option("--no-check", is_flag=True, help="Skip the integrity check of the backup.")
+def backup(output: str, compress: bool, pages: int, sleep: float, no_check: bool):
+    from ollama_client.database import backup as backup_module
+
+    if not output:
+        output = os.path.join(DATA_DIR, "backups", time.strftime("database-%Y%m%d-%H%M%S.db"))
+    if compress and not output.endswith(".gz"):
+        output += ".gz"
+
+    try:
+        result = backup_module.backup(DATABASE, output, pages, sleep, compress, not no_check)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    logger.info(f"Backup written to {output} ({result['size'] / 1024 / 1024:.1f} MB)")
+    logger.info(
+        f"Copied {result['pages']} pages in {result['seconds']}s ({result['pages_per_second']} pages/s), "
+        f"restarts: {result['restarts']}, integrity check: {result['integrity_check']}"
+    )
+
+
+@cli.command(help="Run database maintenance jobs now. Runs all jobs by default.")
+@click.option("--job", "jobs", multiple=True, type=click.Choice(["purge", "checkpoint", "optimize", "vacuum"]), help="Job to run.")
+@click.option(
+    "--enable-incremental-vacuum",
+    is_flag=True,
+    help="Set auto_vacuum to INCREMENTAL first. Rebuilds the database, so stop the server before.",
+)
+def maintenance(jobs: tuple, enable_incremental_vacuum: bool):
+    from ollama_client.database import maintenance as maintenance_module
+
+    async def run():
+        if enable_incremental_vacuum:
+            await maintenance_module.enable_incremental_vacuum()
+            logger.info("auto_vacuum is INCREMENTAL")
+        await maintenance_module.run_jobs(list(jobs or maintenance_module.JOBS))
+
+    asyncio.run(run())
@@ -35,6 +35,70 @@ SECRET_KEY = "SECRET_KEY"
 # Use mathjax for rendering math
 USE_KATEX = False
 
+# Number of dialog histories cached in each worker process. The chat page only
+# posts the new message and the history is read from the database
+# DIALOG_HISTORY_CACHE_SIZE = 256
+
+# Number of parsed values of the database cache (e.g. user profiles) kept in each worker process
+# DATABASE_CACHE_MEMORY_SIZE = 1024
+
+# Message contents longer than this number of characters are stored compressed. 0 is off.
+# Existing messages are rewritten with `ollama-client compress-messages`
+# MESSAGE_COMPRESSION_THRESHOLD = 0
+
+# Database maintenance jobs run in the background. Seconds between the runs of each job, 0 is off.
+# Only one worker runs each job. The jobs can also be run with `ollama-client maintenance`.
+# MAINTENANCE_INTERVALS = {"purge": 3600, "checkpoint": 300, "optimize": 86400, "vacuum": 86400}
+# MAINTENANCE_CHECK_INTERVAL = 60
+# MAINTENANCE_BATCH_SIZE = 1000
+# Pages freed by each run of the vacuum job. Needs auto_vacuum = INCREMENTAL, which is set with
+# `ollama-client maintenance --enable-incremental-vacuum` while the server is stopped
+# MAINTENANCE_VACUUM_PAGES = 0
+
+# Database connections are pooled per worker. The pragmas are applied when a connection is opened.
+# Reads use up to DATABASE_POOL_SIZE read-only connections in parallel
+# DATABASE_POOL_SIZE = 4
+# DATABASE_PRAGMAS = {
+#     "journal_mode": "WAL",
+#     "busy_timeout": 5000,
+#     "synchronous": "NORMAL",
+#     "cache_size": -16000,
+#     "mmap_size": 128 * 1024 * 1024,
+#     "foreign_keys": "ON",
+# }
+
+# Messages of a dialog are loaded in pages of MESSAGES_PER_PAGE, newest first
+# MESSAGES_PER_PAGE = 50
+
+# Chat messages are saved by a background writer. Messages queued within WRITE_BEHIND_DELAY
+# seconds are written in one commit of at most WRITE_BEHIND_MAX_BATCH rows
+# WRITE_BEHIND_DELAY = 0.01
+# WRITE_BEHIND_MAX_BATCH = 500
+
+# Chat streams are buffered, so a client can reconnect and resume a stream. A stream without a
+# client for STREAM_RESUME_GRACE seconds is cancelled. Finished streams are kept for
+# STREAM_BUFFER_TTL seconds, and the oldest are evicted above STREAM_BUFFERS_MAX_BYTES
+# STREAM_RESUME_GRACE = 10
+# STREAM_BUFFER_TTL = 120
+# STREAM_BUFFERS_MAX_BYTES = 64 * 1024 * 1024
+
+# Each stream keeps at most STREAM_BUFFER_MAX_BYTES of frames for resuming, and a user can have
+# at most STREAM_MAX_RUNNING_PER_USER running streams per worker (0 is no limit)
+# STREAM_BUFFER_MAX_BYTES = 4 * 1024 * 1024
+# STREAM_MAX_RUNNING_PER_USER = 4
+
+# Metrics in the Prometheus text format are served on /metrics. Each worker writes its metrics to
+# METRICS_DIR every METRICS_FLUSH_INTERVAL seconds. /metrics requires METRICS_TOKEN as a bearer
+# token, and is not served if METRICS_TOKEN is not set
+# METRICS_DIR = Path(DATA_DIR) / "metrics"
+# METRICS_FLUSH_INTERVAL = 5
+# METRICS_TOKEN = ""
+
+# The chat page uses a compact stream format where consecutive tokens are sent in one frame
+# until this many seconds have passed or this many characters are buffered. 0 sends every token
+# STREAM_COALESCE_INTERVAL = 0.03
+# STREAM_COALESCE_MAX_CHARS = 1024
+
 # Tools that can be called from the frontend
 #
 # Only available tool is python execution.
@@ -68,10 +132,40 @@ PROVIDERS = {
     "ollama": {
         "base_url": "http://localhost:11434/v1",
         "api_key": "ollama",
+        # Optional connection pool settings. One pool is shared by all requests in a worker
+        # "max_connections": 100,
+        # "max_keepalive_connections": 20,
+        # "keepalive_expiry": 30,
+        # "timeout": 600,
+        # Optional context window in tokens. Older messages are left out to fit it.
+        # "context_window": 8192,
+        # Optional max number of requests generating at the same time per model in each worker,
+        # and max number of requests waiting. Waiting requests are served round-robin between users
+        # "max_in_flight": 4,
+        # "max_queue": 32,
+        # Optional. List the models of the provider from its /v1/models endpoint
+        # in addition to the models in MODELS
+        # "discover_models": True,
+        # Optional. Load models at startup and ping idle models, so they are not unloaded by Ollama.
+        # "keep_alive" is the seconds Ollama keeps a model loaded after a request
+        # "keep_warm": True,
+        # "keep_alive": 300,
     },
+    # A provider may have several endpoints serving the same models. Requests go to the endpoint
+    # with the fewest requests in flight and fail over to another endpoint before the first token
+    # "ollama-cluster": {
+    #     "base_url": ["http://gpu-1:11434/v1", "http://gpu-2:11434/v1"],
+    #     "api_key": "ollama",
+    #     "max_failures": 2,
+    #     "failure_cooldown": 30,
+    #     "health_check_interval": 15,
+    # },
 }
 
 
+# A model maps to a provider, or to a dict with the provider and options overriding the provider options, e.g.
+# "deepseek-r1:14b": {"provider": "ollama", "context_window": 16384, "reserve_tokens": 2048},
+# "reserve_tokens" is the part of the context window kept free for the reply (default a quarter)
 MODELS = {
     # "gpt-4o-mini": "openai",
     "deepseek-r1:14b": "ollama", 
@@ -79,6 +173,16 @@ MODELS = {
 
 TOOL_MODELS = ["gpt-40-mini"]
 
+# Seconds between refreshes of the models of providers with "discover_models" set
+# MODEL_DISCOVERY_TTL = 60
+
+# Models loaded at startup on providers with "keep_warm" set (default is DEFAULT_MODEL).
+# Models used within KEEP_WARM_AFTER_USE seconds are also kept warm.
+# A model is pinged when it has been idle for KEEP_WARM_INTERVAL seconds
+# WARM_MODELS = ["deepseek-r1:14b"]
+# KEEP_WARM_INTERVAL = 240
+# KEEP_WARM_AFTER_USE = 1800
+
 
 # # Model tools configuration
 
@@ -102,6 +206,14 @@ TOOL_MODELS = ["gpt-40-mini"]
 # # Tool registry
 # TOOL_REGISTRY = {"get_current_time": get_current_time}
 
+# # Tool calls in a response run concurrently in a thread pool. Each call has a timeout in seconds
+# TOOL_TIMEOUT = 30
+# TOOL_TIMEOUTS = {"get_current_time": 5}
+# TOOL_MAX_WORKERS = 8
+
+# # Max rounds of tool calls before the model must answer
+# MAX_TOOL_ROUNDS = 5
+
 # # Tools
 # TOOLS = [
 #     {
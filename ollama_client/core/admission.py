@@ -0,0 +1,176 @@
+"""
+Admission control for chat requests.
+
+Each model has a controller that allows at most `max_in_flight` requests to be generating at
+the same time in this worker. Further requests wait in a queue of at most `max_queue` requests.
+Waiting requests are admitted round-robin between users, so one user with many requests can not
+starve the others. The limits are set on the provider or the model in config (0 means no limit):
+
+```
+PROVIDERS = {
+    "ollama": {
+        ...
+        "max_in_flight": 4,
+        "max_queue": 32,
+    },
+}
+```
+
+Usage:
+
+```
+ticket = admission.get_controller(model).enqueue(user_id)  # raises QueueFull
+try:
+    while not await ticket.wait(1.0):
+        print(f"Position in queue: {ticket.position()}")
+    ...
+finally:
+    ticket.release()
+```
+"""
+
+import asyncio
+from collections import OrderedDict, deque
+from ollama_client.core import providers
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Ticket:
+    def __init__(self, controller: "AdmissionController", user_id: int):
+        self.controller = controller
+        self.user_id = user_id
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.released = False
+
+    @property
+    def admitted(self) -> bool:
+        return self.future.done() and not self.future.cancelled()
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Wait up to timeout seconds to be admitted. Return True when admitted.
+        """
+        if self.admitted:
+            return True
+
+        try:
+            await asyncio.wait_for(asyncio.shield(self.future), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def position(self) -> int:
+        """
+        Get the position in the queue (1 is next). Return 0 when admitted.
+        """
+        return self.controller.position(self)
+
+    def release(self) -> None:
+        self.controller.release(self)
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight: int = 0, max_queue: int = 0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.num_waiting = 0
+
+        # Waiting tickets per user in round-robin order
+        self._queues: OrderedDict = OrderedDict()
+
+    def enqueue(self, user_id: int) -> Ticket:
+        """
+        Get a ticket for a request. The ticket is admitted at once if there is a free slot.
+        Raise QueueFull if the queue is full.
+        """
+        ticket = Ticket(self, user_id)
+        if not self.max_in_flight or (self.in_flight < self.max_in_flight and not self._queues):
+            self.in_flight += 1
+            ticket.future.set_result(True)
+            return ticket
+
+        if self.max_queue and self.num_waiting >= self.max_queue:
+            raise QueueFull("Too many requests are waiting for this model. Please try again later.")
+
+        self._queues.setdefault(user_id, deque()).append(ticket)
+        self.num_waiting += 1
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        """
+        Release a ticket. A waiting ticket is removed from the queue. Releasing twice is a no-op.
+        """
+        if ticket.released:
+            return
+
+        ticket.released = True
+        if ticket.admitted:
+            self.in_flight -= 1
+            self._admit_next()
+            return
+
+        user_queue = self._queues.get(ticket.user_id)
+        if user_queue and ticket in user_queue:
+            user_queue.remove(ticket)
+            self.num_waiting -= 1
+            if not user_queue:
+                del self._queues[ticket.user_id]
+
+        ticket.future.cancel()
+
+    def _admit_next(self) -> None:
+        while self._queues and self.in_flight < self.max_in_flight:
+            user_id, user_queue = self._queues.popitem(last=False)
+            ticket = user_queue.popleft()
+            self.num_waiting -= 1
+
+            # The user goes to the back of the rotation
+            if user_queue:
+                self._queues[user_id] = user_queue
+
+            self.in_flight += 1
+            ticket.future.set_result(True)
+
+    def position(self, ticket: Ticket) -> int:
+        """
+        Get the position of a ticket in the round-robin order of the queue
+        """
+        if ticket.admitted or ticket.user_id not in self._queues:
+            return 0
+
+        user_ids = list(self._queues.keys())
+        user_index = user_ids.index(ticket.user_id)
+        index = self._queues[ticket.user_id].index(ticket)
+
+        ahead = index
+        for other_index, other_user_id in enumerate(user_ids):
+            if other_user_id == ticket.user_id:
+                continue
+
+            # Users before this user in the rotation get one more turn
+            turns = index + 1 if other_index < user_index else index
+            ahead += min(len(self._queues[other_user_id]), turns)
+
+        return ahead + 1
+
+
+_controllers: dict[str, AdmissionController] = {}
+
+
+def get_controller(model: str) -> AdmissionController:
+    """
+    Get the admission controller of a model
+    """
+    controller = _controllers.get(model)
+    if controller is None:
+        controller = AdmissionController(
+            max_in_flight=providers.get_model_option(model, "max_in_flight", 0),
+            max_queue=providers.get_model_option(model, "max_queue", 0),
+        )
+        _controllers[model] = controller
+
+    return controller
@@ -0,0 +1,53 @@
+"""
+A small bounded in-process LRU cache.
+
+Each worker process has its own cache, so values should either be immutable
+or validated against the database before they are trusted.
+"""
+
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    def __init__(self, max_size: int = 128):
+        """
+        Initialize the LRUCache. The least recently used entry is evicted when max_size is reached.
+        """
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get a value and mark it as recently used. Return default if the key does not exist.
+        """
+        if key not in self._entries:
+            return default
+
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Set a value and evict the least recently used entry if the cache is full.
+        """
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        """
+        Delete a value if it exists.
+        """
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
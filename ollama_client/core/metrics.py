@@ -0,0 +1,292 @@
+"""
+Counters, gauges and histograms exposed in the Prometheus text format on /metrics.
+
+Each gunicorn worker keeps its metrics in memory and writes them to a file named after its pid
+in METRICS_DIR (default DATA_DIR/metrics) every METRICS_FLUSH_INTERVAL seconds. /metrics sums the
+files of all workers, so it does not matter which worker serves the scrape. Counters and
+histograms of workers that have exited are kept. Gauges only count workers that are running.
+The files are removed when the server is started from the cli.
+
+Usage:
+
+```
+requests_total = metrics.Counter("requests_total", "Number of requests", ["model"])
+requests_total.inc(model="llama3.2")
+
+duration = metrics.Histogram("duration_seconds", "Duration of requests", ["model"])
+duration.observe(0.42, model="llama3.2")
+```
+
+/metrics requires the header `Authorization: Bearer <METRICS_TOKEN>`. It is not served (404)
+until METRICS_TOKEN is set.
+
+Label values come from a fixed set. Models that are not configured or discovered are counted
+as "other" (see model_label()), so clients can not add label values.
+"""
+
+import asyncio
+import json
+import os
+import logging
+from pathlib import Path
+import config
+from ollama_client.core import providers
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+METRICS_DIR = Path(getattr(config, "METRICS_DIR", Path(config.DATA_DIR) / "metrics"))
+METRICS_FLUSH_INTERVAL = getattr(config, "METRICS_FLUSH_INTERVAL", 5)
+METRICS_TOKEN = getattr(config, "METRICS_TOKEN", "")
+
+PREFIX = "ollama_client_"
+
+# HTTP methods counted by name. Other methods are counted as "other"
+HTTP_METHODS = ("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS")
+
+# Buckets in seconds for latencies
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry: dict[str, "Metric"] = {}
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: list | tuple = ()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: dict[tuple, object] = {}
+        _registry[self.name] = self
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(labelname, "")) for labelname in self.labelnames)
+
+    def dump(self) -> dict:
+        return {
+            "type": self.type,
+            "help": self.help,
+            "labelnames": list(self.labelnames),
+            "values": [[list(key), value] for key, value in self.values.items()],
+        }
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount  # type: ignore[operator]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount  # type: ignore[operator]
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: list | tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+
+        # Count per bucket (not cumulative), then the sum and the count of all observations
+        observations = self.values.get(key)
+        if observations is None:
+            observations = [0] * len(self.buckets) + [0.0, 0]
+            self.values[key] = observations
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                observations[index] += 1  # type: ignore[index]
+                break
+
+        observations[-2] += value  # type: ignore[index]
+        observations[-1] += 1  # type: ignore[index]
+
+    def dump(self) -> dict:
+        dumped = super().dump()
+        dumped["buckets"] = list(self.buckets)
+        return dumped
+
+
+def model_label(model: str) -> str:
+    """
+    Get the label value of a model. Models that are not configured or discovered are "other".
+    """
+    return model if model in providers.get_model_names() else "other"
+
+
+def method_label(method: str) -> str:
+    return method if method in HTTP_METHODS else "other"
+
+
+def _dump_all() -> dict:
+    return {name: metric.dump() for name, metric in _registry.items()}
+
+
+def _get_file(pid: int) -> Path:
+    return METRICS_DIR / f"{pid}.json"
+
+
+def flush() -> None:
+    """
+    Write the metrics of this worker to its file
+    """
+    try:
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        path = _get_file(os.getpid())
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(_dump_all()))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write metrics: {e!r}")
+
+
+def clear() -> None:
+    """
+    Remove the metric files of all workers
+    """
+    if not METRICS_DIR.exists():
+        return
+
+    for path in METRICS_DIR.glob("*.json"):
+        path.unlink(missing_ok=True)
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_all() -> list:
+    """
+    Read the metrics of all workers. The metrics of this worker are read from memory.
+    """
+    workers = [(os.getpid(), _dump_all())]
+    for path in METRICS_DIR.glob("*.json") if METRICS_DIR.exists() else []:
+        try:
+            pid = int(path.stem)
+            if pid == os.getpid():
+                continue
+            workers.append((pid, json.loads(path.read_text())))
+        except (ValueError, OSError):
+            logger.warning(f"Could not read metrics file: {path}")
+
+    return workers
+
+
+def _aggregate() -> dict:
+    aggregated: dict[str, dict] = {}
+    for pid, dumped in _read_all():
+        running = _is_running(pid)
+        for name, metric in dumped.items():
+            if metric["type"] == "gauge" and not running:
+                continue
+
+            entry = aggregated.setdefault(name, {**metric, "values": {}})
+            for key, value in metric["values"]:
+                key = tuple(key)
+                if metric["type"] == "histogram":
+                    current = entry["values"].get(key, [0] * len(value))
+                    entry["values"][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    entry["values"][key] = entry["values"].get(key, 0) + value
+
+    return aggregated
+
+
+def _format_labels(labelnames: list, key: tuple, extra: str = "") -> str:
+    labels = [f'{labelname}="{_escape(value)}"' for labelname, value in zip(labelnames, key)]
+    if extra:
+        labels.append(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render() -> str:
+    """
+    Render the metrics of all workers in the Prometheus text format
+    """
+    lines = []
+    for name, metric in sorted(_aggregate().items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labelnames = metric["labelnames"]
+        for key, value in sorted(metric["values"].items()):
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labelnames, key)} {value}")
+                continue
+
+            cumulative = 0
+            for bound, bucket_count in zip(metric["buckets"], value):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_format_labels(labelnames, key, le)} {cumulative}")
+
+            le = 'le="+Inf"'
+            lines.append(f"{name}_bucket{_format_labels(labelnames, key, le)} {value[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, key)} {value[-2]}")
+            lines.append(f"{name}_count{_format_labels(labelnames, key)} {value[-1]}")
+
+    return "\n".join(lines) + "\n"
+
+
+async def run_flush() -> None:
+    """
+    Write the metrics of this worker every METRICS_FLUSH_INTERVAL seconds. Runs until cancelled.
+    """
+    try:
+        while True:
+            await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+            flush()
+    finally:
+        flush()
+
+
+# Chat
+chat_requests_total = Counter("chat_requests_total", "Chat requests by result (ok, error, cancelled)", ["model", "provider", "status"])
+chat_queue_wait_seconds = Histogram("chat_queue_wait_seconds", "Time waiting for admission to a model", ["model"])
+chat_ttft_seconds = Histogram("chat_ttft_seconds", "Time to first token from the provider", ["model", "provider"])
+chat_duration_seconds = Histogram("chat_duration_seconds", "Duration of chat generations", ["model", "provider"])
+chat_output_tokens_total = Counter("chat_output_tokens_total", "Streamed content deltas (about one token each)", ["model", "provider"])
+chat_tokens_per_second = Histogram(
+    "chat_tokens_per_second",
+    "Content deltas per second after the first token",
+    ["model", "provider"],
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500),
+)
+chat_streams_in_flight = Gauge("chat_streams_in_flight", "Chat generations in progress", ["model"])
+
+# Database
+db_transactions_total = Counter("db_transactions_total", "Database transaction scopes by mode (read, write) and result", ["mode", "status"])
+db_begin_seconds = Histogram("db_begin_seconds", "Time to begin a write transaction, i.e. waiting for the write lock")
+db_transaction_seconds = Histogram("db_transaction_seconds", "Duration of transaction scopes", ["mode"])
+cache_requests_total = Counter("cache_requests_total", "Cache lookups by result (memory_hit, database_hit, miss)", ["result"])
+
+# HTTP
+http_requests_total = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds", "Duration of HTTP requests until the response is sent", ["method", "route"]
+)
@@ -10,7 +10,9 @@ from starlette.middleware.sessions import SessionMiddleware
 from starlette.responses import JSONResponse
 from starlette.requests import Request
 import config
+import time
 import logging
+from ollama_client.core import metrics, session
 
 logger: logging.Logger = logging.getLogger(__name__)
 
@@ -51,11 +53,50 @@ class LimitRequestSizeMiddleware(BaseHTTPMiddleware):
         return await call_next(request)
 
 
+class MetricsMiddleware:
+    """
+    Count HTTP requests and measure the time until the response is sent, including streamed bodies.
+    The route label is the name of the endpoint, so the number of label values is bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            endpoint = scope.get("endpoint")
+            if endpoint is not None:
+                route = getattr(endpoint, "__name__", "other")
+            elif scope["path"].startswith("/static"):
+                route = "static"
+            else:
+                route = "other"
+
+            method = metrics.method_label(scope["method"])
+            metrics.http_requests_total.inc(method=method, route=route, status=status_code)
+            metrics.http_request_duration_seconds.observe(time.monotonic() - started, method=method, route=route)
+
+
 session_middleware = Middleware(
     SessionMiddleware,
     secret_key=config.SECRET_KEY,
     https_only=True,
-    max_age=14 * 24 * 60 * 60,  # 14 days
+    max_age=session.SESSION_MAX_AGE,
     same_site="lax",
 )
 
@@ -64,6 +105,7 @@ no_cache_middlewares = Middleware(NoCacheMiddleware)
 limit_request_size_middlewares = Middleware(LimitRequestSizeMiddleware, max_size=100 * 1024)  # 50 KB
 
 middleware = []
+middleware.append(Middleware(MetricsMiddleware))
 middleware.append(no_cache_middlewares)
 middleware.append(session_middleware)
 middleware.append(limit_request_size_middlewares)
@@ -0,0 +1,96 @@
+"""
+Discover models from the model list endpoint (/v1/models) of providers.
+
+Providers with `discover_models` set are queried in the background, and the models found are
+served from memory together with the models in config.MODELS. A provider that fails or is slow
+to answer only drops its own discovered models, so page loads never wait for a provider:
+
+```
+PROVIDERS = {
+    "ollama": {
+        "base_url": "http://localhost:11434/v1",
+        "api_key": "ollama",
+        "discover_models": True,
+    },
+}
+
+# Seconds before the discovered models are refreshed
+MODEL_DISCOVERY_TTL = 60
+```
+"""
+
+import asyncio
+import time
+import logging
+import config
+from ollama_client.core import providers
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+PROVIDERS = getattr(config, "PROVIDERS", {})
+MODEL_DISCOVERY_TTL = getattr(config, "MODEL_DISCOVERY_TTL", 60)
+
+# Seconds to wait for a provider to list its models
+DISCOVERY_TIMEOUT = 5.0
+
+_last_refresh = 0.0
+_refresh_task = None
+
+
+def _get_discovery_providers() -> list:
+    return [provider for provider, provider_info in PROVIDERS.items() if provider_info.get("discover_models")]
+
+
+async def _refresh_provider(provider: str) -> None:
+    try:
+        client = providers.get_client(provider)
+        page = await client.models.list(timeout=DISCOVERY_TIMEOUT)
+        model_names = [model.id for model in page.data]
+        providers.set_discovered_models(provider, model_names)
+        logger.debug(f"Discovered {len(model_names)} models from provider: {provider}")
+    except Exception as e:
+        logger.warning(f"Model discovery failed for provider: {provider}: {e!r}")
+        providers.set_discovered_models(provider, [])
+
+
+async def refresh_models() -> None:
+    """
+    Query all discovery providers concurrently and update the discovered models
+    """
+    global _last_refresh
+
+    _last_refresh = time.monotonic()
+    await asyncio.gather(*[_refresh_provider(provider) for provider in _get_discovery_providers()])
+
+
+def _refresh_in_background() -> None:
+    global _refresh_task
+
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.get_running_loop().create_task(refresh_models())
+
+
+def get_model_names() -> list:
+    """
+    Get the names of all models from memory. If the discovered models are older than
+    MODEL_DISCOVERY_TTL a refresh is started in the background.
+    """
+    if _get_discovery_providers() and time.monotonic() - _last_refresh > MODEL_DISCOVERY_TTL:
+        _refresh_in_background()
+
+    return providers.get_model_names()
+
+
+async def run_model_discovery() -> None:
+    """
+    Refresh the discovered models every MODEL_DISCOVERY_TTL seconds. Runs until cancelled.
+    """
+    if not _get_discovery_providers():
+        return
+
+    while True:
+        if time.monotonic() - _last_refresh >= MODEL_DISCOVERY_TTL:
+            await refresh_models()
+
+        await asyncio.sleep(max(MODEL_DISCOVERY_TTL - (time.monotonic() - _last_refresh), 1))
@@ -0,0 +1,179 @@
+"""
+Keep models loaded in Ollama to avoid cold starts.
+
+Ollama unloads a model when it has been idle for its keep-alive duration (default 5 minutes),
+and the next request waits until the model is loaded from disk again. For providers with
+`keep_warm` set, the models in WARM_MODELS are loaded at startup. These models, and models used
+within the last KEEP_WARM_AFTER_USE seconds, are pinged when they have been idle for
+KEEP_WARM_INTERVAL seconds. A ping is a request to the Ollama API (/api/generate) without a
+prompt, which loads the model without generating any tokens:
+
+```
+PROVIDERS = {
+    "ollama": {
+        ...
+        "keep_warm": True,
+        # Seconds Ollama keeps a model loaded after a request
+        "keep_alive": 300,
+    },
+}
+
+WARM_MODELS = ["deepseek-r1:14b"]  # Default is [DEFAULT_MODEL]
+KEEP_WARM_INTERVAL = 240
+KEEP_WARM_AFTER_USE = 1800
+```
+
+The time to first token of chat requests is recorded per model as cold or warm. A request is
+warm if the model was used or pinged within its keep-alive duration. The scheduler and the
+stats are per worker.
+"""
+
+import asyncio
+import time
+import httpx
+import logging
+import statistics
+from collections import deque
+import config
+from ollama_client.core import providers
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = getattr(config, "DEFAULT_MODEL", "")
+WARM_MODELS = getattr(config, "WARM_MODELS", [DEFAULT_MODEL] if DEFAULT_MODEL else [])
+KEEP_WARM_INTERVAL = getattr(config, "KEEP_WARM_INTERVAL", 240)
+KEEP_WARM_AFTER_USE = getattr(config, "KEEP_WARM_AFTER_USE", 1800)
+
+# Ollama default keep-alive in seconds
+KEEP_ALIVE = 300
+
+# Number of recent requests the TTFT stats are computed from
+STATS_SIZE = 200
+
+# Seconds between checks for models that should be pinged
+CHECK_INTERVAL = 10
+
+# Last request or ping per model
+_last_active: dict[str, float] = {}
+
+# Last chat request per model
+_last_used: dict[str, float] = {}
+
+# Last ping per model, also failed pings
+_last_ping: dict[str, float] = {}
+
+# Recent TTFT in seconds per model
+_ttft: dict[str, dict[str, deque]] = {}
+
+
+def _keeps_warm(model: str) -> bool:
+    return bool(providers.get_model_option(model, "keep_warm", False))
+
+
+def is_warm(model: str) -> bool:
+    """
+    Check if a model is expected to be loaded, i.e. it was used or pinged within its keep-alive
+    """
+    keep_alive = providers.get_model_option(model, "keep_alive", KEEP_ALIVE)
+    return time.monotonic() - _last_active.get(model, float("-inf")) < keep_alive
+
+
+def mark_used(model: str) -> None:
+    """
+    Mark a model as used by a chat request
+    """
+    now = time.monotonic()
+    _last_active[model] = now
+    _last_used[model] = now
+
+
+def record_ttft(model: str, ttft: float, warm: bool) -> None:
+    """
+    Record the time to first token of a chat request
+    """
+    model_ttft = _ttft.setdefault(model, {"cold": deque(maxlen=STATS_SIZE), "warm": deque(maxlen=STATS_SIZE)})
+    model_ttft["warm" if warm else "cold"].append(ttft)
+
+
+def _summarize(values: deque) -> dict:
+    if not values:
+        return {"count": 0}
+
+    return {
+        "count": len(values),
+        "mean": round(statistics.fmean(values), 3),
+        "median": round(statistics.median(values), 3),
+        "max": round(max(values), 3),
+    }
+
+
+def get_stats() -> dict:
+    """
+    Get the cold and warm TTFT stats (seconds) of the recent requests per model
+    """
+    stats = {}
+    for model, model_ttft in _ttft.items():
+        stats[model] = {
+            "keep_warm": _keeps_warm(model),
+            "warm_now": is_warm(model),
+            "cold": _summarize(model_ttft["cold"]),
+            "warm": _summarize(model_ttft["warm"]),
+        }
+
+    return stats
+
+
+def _get_ollama_url(base_url: str) -> str:
+    base_url = base_url.rstrip("/")
+    if base_url.endswith("/v1"):
+        base_url = base_url[: -len("/v1")]
+    return f"{base_url}/api/generate"
+
+
+async def _ping_endpoint(model: str, endpoint: providers.Endpoint) -> None:
+    body = {"model": model, "keep_alive": providers.get_model_option(model, "keep_alive", KEEP_ALIVE)}
+    await endpoint.client.post(_get_ollama_url(endpoint.base_url), cast_to=httpx.Response, body=body)
+
+
+async def ping_model(model: str) -> None:
+    """
+    Load a model on all endpoints of its provider
+    """
+    started = time.monotonic()
+    _last_ping[model] = started
+    try:
+        endpoints = providers.get_endpoints(providers.get_model_provider(model))
+        await asyncio.gather(*[_ping_endpoint(model, endpoint) for endpoint in endpoints])
+        _last_active[model] = time.monotonic()
+        logger.debug(f"Pinged model: {model} ({time.monotonic() - started:.2f}s)")
+    except Exception as e:
+        logger.warning(f"Keep warm ping failed for model: {model}: {e!r}")
+
+
+def _get_due_models() -> list:
+    now = time.monotonic()
+    recently_used = [model for model, last_used in _last_used.items() if now - last_used < KEEP_WARM_AFTER_USE]
+
+    due_models = []
+    for model in dict.fromkeys(WARM_MODELS + recently_used):
+        if not _keeps_warm(model):
+            continue
+
+        last_activity = max(_last_active.get(model, float("-inf")), _last_ping.get(model, float("-inf")))
+        if now - last_activity >= KEEP_WARM_INTERVAL:
+            due_models.append(model)
+
+    return due_models
+
+
+async def run_keep_warm() -> None:
+    """
+    Load the warm models at startup and ping idle models. Runs until cancelled.
+    """
+    while True:
+        due_models = _get_due_models()
+        if due_models:
+            await asyncio.gather(*[ping_model(model) for model in due_models])
+
+        await asyncio.sleep(CHECK_INTERVAL)
@@ -0,0 +1,401 @@
+"""
+Process wide registry of async OpenAI compatible clients.
+
+A provider in config.PROVIDERS has one or more endpoints (replicas). One AsyncOpenAI client
+(and one httpx connection pool) is created per endpoint. The clients are created lazily on
+first use, so every gunicorn worker gets its own pools after forking, and they are closed in
+the lifespan of the app.
+
+Each provider may set the connection pool options:
+
+```
+PROVIDERS = {
+    "ollama": {
+        "base_url": "http://localhost:11434/v1",
+        "api_key": "ollama",
+        "max_connections": 100,
+        "max_keepalive_connections": 20,
+        "keepalive_expiry": 30,
+        "timeout": 600,
+        "context_window": 8192,
+    },
+}
+```
+
+`base_url` may also be a list of endpoints serving the same models. A chat request is sent to the
+healthy endpoint with the fewest outstanding requests in this worker. If an endpoint fails before
+the first chunk is received, the request fails over to the next endpoint. An endpoint is marked
+down after `max_failures` consecutive failures and tried again after `failure_cooldown` seconds.
+Endpoints of providers with more than one endpoint are also checked actively every
+`health_check_interval` seconds:
+
+```
+PROVIDERS = {
+    "ollama": {
+        "base_url": ["http://gpu-1:11434/v1", "http://gpu-2:11434/v1"],
+        "api_key": "ollama",
+        "max_failures": 2,
+        "failure_cooldown": 30,
+        "health_check_interval": 15,
+    },
+}
+```
+
+A model in config.MODELS maps to a provider name, or to a dict with the provider name
+and options that override the provider options for that model:
+
+```
+MODELS = {
+    "llama3.2": "ollama",
+    "deepseek-r1:14b": {"provider": "ollama", "context_window": 16384, "reserve_tokens": 2048},
+}
+```
+
+Models of providers with `discover_models` set are added by core.model_discovery.
+"""
+
+import asyncio
+import time
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+import logging
+import config
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+PROVIDERS = getattr(config, "PROVIDERS", {})
+MODELS = getattr(config, "MODELS", {})
+
+# Default connection pool settings per endpoint
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 30.0
+
+# Generation can be slow, but the connect phase should fail fast
+TIMEOUT = 600.0
+CONNECT_TIMEOUT = 10.0
+
+# Default health settings per endpoint
+MAX_FAILURES = 2
+FAILURE_COOLDOWN = 30.0
+HEALTH_CHECK_INTERVAL = 15.0
+HEALTH_CHECK_TIMEOUT = 5.0
+
+# Errors that make a request fail over to another endpoint
+FAILOVER_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError, httpx.TransportError)
+
+
+class NoEndpointAvailable(Exception):
+    pass
+
+
+class Endpoint:
+    def __init__(self, provider: str, base_url: str, client: AsyncOpenAI, provider_info: dict):
+        self.provider = provider
+        self.base_url = base_url
+        self.client = client
+        self.max_failures = provider_info.get("max_failures", MAX_FAILURES)
+        self.failure_cooldown = provider_info.get("failure_cooldown", FAILURE_COOLDOWN)
+
+        # Requests in flight from this worker
+        self.outstanding = 0
+        self.failures = 0
+        self.down_until = 0.0
+
+    def is_available(self) -> bool:
+        """
+        An endpoint is available if it is healthy or its cooldown has passed
+        """
+        return self.down_until <= time.monotonic()
+
+    def record_success(self) -> None:
+        if self.down_until:
+            logger.info(f"Endpoint is up: {self.base_url}")
+
+        self.failures = 0
+        self.down_until = 0.0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            if self.is_available():
+                logger.warning(f"Endpoint is down: {self.base_url}")
+            self.down_until = time.monotonic() + self.failure_cooldown
+
+
+class ChatStream:
+    """
+    A streaming chat completion from an endpoint. The first chunk has already been read,
+    so iterating yields the first chunk and then the rest of the stream.
+    """
+
+    def __init__(self, endpoint: Endpoint, response, iterator, first_chunk):
+        self.endpoint = endpoint
+        self.response = response
+        self.iterator = iterator
+        self.first_chunk = first_chunk
+        self.closed = False
+
+    async def __aiter__(self):
+        if self.first_chunk is not None:
+            first_chunk = self.first_chunk
+            self.first_chunk = None
+            yield first_chunk
+
+        async for chunk in self.iterator:
+            yield chunk
+
+    async def close(self) -> None:
+        """
+        Close the response and release the endpoint. Closing more than once is a no-op.
+        """
+        if self.closed:
+            return
+
+        self.closed = True
+        self.endpoint.outstanding -= 1
+        await self.response.close()
+
+
+_endpoints: dict[str, list[Endpoint]] = {}
+
+# Model names discovered per provider
+_discovered_models: dict[str, list] = {}
+
+
+def _get_base_urls(provider_info: dict) -> list:
+    base_url = provider_info["base_url"]
+    if isinstance(base_url, str):
+        return [base_url]
+    return list(base_url)
+
+
+def _create_client(provider_info: dict, base_url: str, max_retries: int) -> AsyncOpenAI:
+    """
+    Create an AsyncOpenAI client with its own pooled httpx client
+    """
+    limits = httpx.Limits(
+        max_connections=provider_info.get("max_connections", MAX_CONNECTIONS),
+        max_keepalive_connections=provider_info.get("max_keepalive_connections", MAX_KEEPALIVE_CONNECTIONS),
+        keepalive_expiry=provider_info.get("keepalive_expiry", KEEPALIVE_EXPIRY),
+    )
+    timeout = httpx.Timeout(provider_info.get("timeout", TIMEOUT), connect=CONNECT_TIMEOUT)
+    http_client = DefaultAsyncHttpxClient(limits=limits, timeout=timeout)
+
+    return AsyncOpenAI(
+        api_key=provider_info["api_key"],
+        base_url=base_url,
+        http_client=http_client,
+        max_retries=max_retries,
+    )
+
+
+def get_model_provider(model: str) -> str:
+    """
+    Get the provider name of a model. Return an empty string for unknown models.
+    """
+    model_info = MODELS.get(model, "")
+    if isinstance(model_info, dict):
+        return model_info.get("provider", "")
+
+    if model_info:
+        return model_info
+
+    for provider, model_names in _discovered_models.items():
+        if model in model_names:
+            return provider
+
+    return ""
+
+
+def set_discovered_models(provider: str, model_names: list) -> None:
+    """
+    Set the models discovered for a provider. An empty list removes the models of the provider.
+    """
+    _discovered_models[provider] = list(model_names)
+
+
+def get_model_names() -> list:
+    """
+    Get the configured models followed by the discovered models
+    """
+    model_names = list(MODELS.keys())
+    for provider in PROVIDERS:
+        for model_name in sorted(_discovered_models.get(provider, [])):
+            if model_name not in model_names:
+                model_names.append(model_name)
+
+    return model_names
+
+
+def get_model_option(model: str, key: str, default=None):
+    """
+    Get an option for a model. Options set on the model override options set on the provider.
+    """
+    model_info = MODELS.get(model, "")
+    if isinstance(model_info, dict) and key in model_info:
+        return model_info[key]
+
+    provider_info = PROVIDERS.get(get_model_provider(model), {})
+    return provider_info.get(key, default)
+
+
+def get_context_budget(model: str) -> int:
+    """
+    Get the number of tokens that may be sent to a model. This is the context window
+    minus the tokens reserved for the reply (default a quarter of the window).
+    Return 0 if no context window is configured.
+    """
+    context_window = get_model_option(model, "context_window", 0)
+    if not context_window:
+        return 0
+
+    reserve_tokens = get_model_option(model, "reserve_tokens", context_window // 4)
+    return max(context_window - reserve_tokens, 0)
+
+
+def get_endpoints(provider: str) -> list[Endpoint]:
+    """
+    Get the endpoints of a provider. The clients are created on first use.
+    """
+    endpoints = _endpoints.get(provider)
+    if endpoints is None:
+        provider_info = PROVIDERS.get(provider)
+        if not provider_info:
+            raise ValueError(f"Unknown provider: {provider}")
+
+        base_urls = _get_base_urls(provider_info)
+
+        # With more than one endpoint it is faster to fail over than to retry the same endpoint
+        max_retries = provider_info.get("max_retries", 2 if len(base_urls) == 1 else 0)
+
+        endpoints = []
+        for base_url in base_urls:
+            client = _create_client(provider_info, base_url, max_retries)
+            endpoints.append(Endpoint(provider, base_url, client, provider_info))
+
+        _endpoints[provider] = endpoints
+        logger.debug(f"Created clients for provider: {provider} ({len(endpoints)} endpoints)")
+
+    return endpoints
+
+
+def get_client(provider: str) -> AsyncOpenAI:
+    """
+    Get the client of the least busy available endpoint of a provider
+    """
+    endpoint = _pick_endpoint(get_endpoints(provider), [])
+    if endpoint is None:
+        raise NoEndpointAvailable(f"No endpoint available for provider: {provider}")
+    return endpoint.client
+
+
+def _pick_endpoint(endpoints: list[Endpoint], tried: list[Endpoint]):
+    """
+    Pick the available endpoint with the fewest outstanding requests. If all endpoints are
+    down, the least busy endpoint is tried anyway.
+    """
+    candidates = [endpoint for endpoint in endpoints if endpoint not in tried]
+    available = [endpoint for endpoint in candidates if endpoint.is_available()]
+    if available:
+        candidates = available
+
+    if not candidates:
+        return None
+
+    return min(candidates, key=lambda endpoint: endpoint.outstanding)
+
+
+async def stream_chat_completion(provider: str, chat_args: dict) -> ChatStream:
+    """
+    Start a streaming chat completion on the least busy endpoint of a provider.
+    If an endpoint fails before the first chunk is received, the next endpoint is tried.
+    """
+    endpoints = get_endpoints(provider)
+    tried: list[Endpoint] = []
+    last_error: Exception = NoEndpointAvailable(f"No endpoint available for provider: {provider}")
+
+    while True:
+        endpoint = _pick_endpoint(endpoints, tried)
+        if endpoint is None:
+            raise last_error
+
+        tried.append(endpoint)
+        endpoint.outstanding += 1
+        response = None
+        try:
+            response = await endpoint.client.chat.completions.create(**chat_args)
+            iterator = response.__aiter__()
+            try:
+                first_chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                first_chunk = None
+
+        except FAILOVER_ERRORS as e:
+            endpoint.outstanding -= 1
+            endpoint.record_failure()
+            if response is not None:
+                await response.close()
+
+            logger.warning(f"Endpoint failed before first chunk: {endpoint.base_url}: {e!r}")
+            last_error = e
+            continue
+
+        except BaseException:
+            endpoint.outstanding -= 1
+            if response is not None:
+                await response.close()
+            raise
+
+        endpoint.record_success()
+        return ChatStream(endpoint, response, iterator, first_chunk)
+
+
+async def _check_endpoint(endpoint: Endpoint) -> None:
+    try:
+        await endpoint.client.models.list(timeout=HEALTH_CHECK_TIMEOUT)
+        endpoint.record_success()
+    except Exception as e:
+        logger.debug(f"Health check failed: {endpoint.base_url}: {e!r}")
+
+        # A failed health check marks the endpoint down at once
+        endpoint.failures = endpoint.max_failures - 1
+        endpoint.record_failure()
+
+
+async def run_health_checks() -> None:
+    """
+    Check the endpoints of providers with more than one endpoint at their health_check_interval.
+    Runs until cancelled.
+    """
+    last_checks: dict[str, float] = {}
+    while True:
+        for provider, provider_info in PROVIDERS.items():
+            interval = provider_info.get("health_check_interval", HEALTH_CHECK_INTERVAL)
+            if len(_get_base_urls(provider_info)) < 2 or not interval:
+                continue
+
+            if time.monotonic() - last_checks.get(provider, 0.0) < interval:
+                continue
+
+            last_checks[provider] = time.monotonic()
+            endpoints = get_endpoints(provider)
+            await asyncio.gather(*[_check_endpoint(endpoint) for endpoint in endpoints])
+
+        await asyncio.sleep(1)
+
+
+async def close_clients() -> None:
+    """
+    Close all clients and their connection pools
+    """
+    for provider, endpoints in list(_endpoints.items()):
+        for endpoint in endpoints:
+            try:
+                await endpoint.client.close()
+            except Exception:
+                logger.exception(f"Error closing client for endpoint: {endpoint.base_url}")
+
+    _endpoints.clear()
@@ -9,6 +9,11 @@ from config import DATABASE
 
 logger: logging.Logger = logging.getLogger(__name__)
 
+# Max age in seconds of the session cookie. Login tokens expire with the session.
+SESSION_MAX_AGE = 14 * 24 * 60 * 60
+
+_VALID_TOKEN_SQL = "SELECT 1 FROM user_token WHERE user_id = :user_id AND token = :token AND expires > :now"
+
 
 def set_session_variable(request: Request, key: str, value: Any, ttl: int = 0) -> None:
     """
@@ -70,14 +75,13 @@ async def is_logged_in(request: Request) -> int:
         return 0
 
     database_connection = DatabaseConnection(DATABASE)
-    async with database_connection.async_transaction_scope() as connection:
+    async with database_connection.async_read_scope() as connection:
         crud = CRUD(connection)
-        token_valid = await crud.exists(
-            "user_token",
-            filters={
-                "user_id": user_id,
-                "token": token,
-            },
+
+        # Expired tokens are only deleted by the purge maintenance job, so the expiry is checked here
+        token_valid = await crud.query_one(
+            _VALID_TOKEN_SQL,
+            {"user_id": user_id, "token": token, "now": int(time.time())},
         )
         if not token_valid:
             return 0
@@ -0,0 +1,180 @@
+"""
+Encode chat stream chunks as server-sent events.
+
+There are two stream formats:
+
+verbose: Every upstream chunk is sent as the full OpenAI chat completion chunk.
+This is the default, kept for compatibility.
+
+compact: Only the content delta and the finish reason are sent, e.g.
+
+```
+data: {"c":"Hello wor"}
+data: {"c":"ld","f":"stop"}
+data: {"error":"Streaming failed"}
+```
+
+While a request waits for the model, status frames with the position in the queue are sent.
+In the compact format this is `data: {"q":3}`. In the verbose format it is a named `status` event,
+`event: status` and `data: {"queue_position":3}`.
+
+Consecutive content deltas are coalesced into one frame until `interval` seconds have passed
+since the last frame or `max_chars` characters are buffered. Iterate the upstream chunks with
+with_flushes(), so buffered content is also sent when the model pauses:
+
+```
+async for chunk in sse.with_flushes(response, encoder):
+    frame = encoder.flush() if chunk is None else encoder.encode_chunk(chunk)
+```
+"""
+
+import asyncio
+import json
+import time
+from typing import AsyncIterator
+
+
+# Compact separators and no ascii escaping gives the smallest frames
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+STREAM_FORMATS = ["verbose", "compact"]
+
+
+def encode_frame(data: dict) -> str:
+    return f"data: {_json_encoder.encode(data)}\n\n"
+
+
+class VerboseEncoder:
+    def encode_chunk(self, chunk) -> str:
+        """
+        Encode an upstream chunk. Returns an empty string if nothing should be sent.
+        """
+        return f"data: {chunk.model_dump_json()}\n\n"
+
+    def flush(self) -> str:
+        return ""
+
+    def flush_timeout(self) -> float | None:
+        return None
+
+    def encode_status(self, queue_position: int) -> str:
+        return f"event: status\n{encode_frame({'queue_position': queue_position})}"
+
+    def encode_error(self, message: str) -> str:
+        return json.dumps({"error": message})
+
+
+class CompactEncoder:
+    def __init__(self, interval: float = 0.0, max_chars: int = 0):
+        """
+        Initialize the CompactEncoder. An interval of 0 sends a frame for every content delta.
+        """
+        self.interval = interval
+        self.max_chars = max_chars
+        self.parts: list = []
+        self.num_chars = 0
+        self.last_frame = time.monotonic()
+
+    def encode_chunk(self, chunk) -> str:
+        """
+        Encode an upstream chunk. Returns an empty string while content is being coalesced.
+        """
+        if not chunk.choices:
+            return ""
+
+        choice = chunk.choices[0]
+        content = choice.delta.content
+        if content:
+            self.parts.append(content)
+            self.num_chars += len(content)
+
+        if choice.finish_reason:
+            return self.flush(choice.finish_reason)
+
+        if time.monotonic() - self.last_frame >= self.interval:
+            return self.flush()
+
+        if self.max_chars and self.num_chars >= self.max_chars:
+            return self.flush()
+
+        return ""
+
+    def flush(self, finish_reason: str = "") -> str:
+        """
+        Encode buffered content (and the finish reason) as a frame
+        """
+        data = {}
+        if self.parts:
+            data["c"] = "".join(self.parts)
+            self.parts = []
+            self.num_chars = 0
+
+        if finish_reason:
+            data["f"] = finish_reason
+
+        if not data:
+            return ""
+
+        self.last_frame = time.monotonic()
+        return encode_frame(data)
+
+    def flush_timeout(self) -> float | None:
+        """
+        Get the seconds until buffered content should be flushed. None if nothing is buffered.
+        """
+        if not self.parts:
+            return None
+        return max(self.last_frame + self.interval - time.monotonic(), 0.0)
+
+    def encode_status(self, queue_position: int) -> str:
+        return encode_frame({"q": queue_position})
+
+    def encode_error(self, message: str) -> str:
+        return self.flush() + encode_frame({"error": message})
+
+
+def get_encoder(stream_format: str, interval: float = 0.0, max_chars: int = 0):
+    """
+    Get an encoder for a stream format. Unknown formats get the verbose encoder.
+    """
+    if stream_format == "compact":
+        return CompactEncoder(interval, max_chars)
+    return VerboseEncoder()
+
+
+async def with_flushes(chunks, encoder) -> AsyncIterator:
+    """
+    Iterate over upstream chunks. Yields None when buffered content of the encoder is due while
+    waiting for the next chunk. The read of the next chunk is not cancelled by the timeout, so the
+    upstream stream is left intact.
+    """
+    iterator = chunks.__aiter__()
+    next_chunk = None
+    try:
+        while True:
+            timeout = encoder.flush_timeout()
+            if next_chunk is None and timeout is None:
+                try:
+                    chunk = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                yield chunk
+                continue
+
+            if next_chunk is None:
+                next_chunk = asyncio.ensure_future(iterator.__anext__())
+
+            done, _ = await asyncio.wait({next_chunk}, timeout=timeout)
+            if not done:
+                yield None
+                continue
+
+            task, next_chunk = next_chunk, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        if next_chunk is not None:
+            next_chunk.cancel()
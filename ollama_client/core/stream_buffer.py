@@ -0,0 +1,254 @@
+"""
+Buffers of chat streams, so a client can reconnect and resume a stream.
+
+A chat response is generated by a task that appends the SSE frames to a buffer. The response to
+the client tails the buffer, and every frame is sent with an `id:` field holding its number in the
+stream. A client that loses the connection requests /chat/stream/{stream_id} with the
+`Last-Event-ID` header, gets the frames it missed and then the live tail.
+
+The generation is cancelled when no client has been attached for STREAM_RESUME_GRACE seconds,
+or when the stream is cancelled explicitly. Finished buffers are kept for STREAM_BUFFER_TTL
+seconds. If the buffers hold more than STREAM_BUFFERS_MAX_BYTES, the oldest finished buffers
+are evicted first. Running streams are never evicted.
+
+A buffer keeps at most STREAM_BUFFER_MAX_BYTES of frames. Above that the oldest frames are
+dropped, and a client can only resume from a frame that is still kept. A tail that falls behind
+the kept frames ends, so the client does not get a stream with a gap. A user can have at most
+STREAM_MAX_RUNNING_PER_USER running streams in each worker.
+
+Buffers are kept in each worker. With more than one worker, a reconnect may reach a worker
+without the buffer and get a 404. The partial reply is saved to the dialog in that case.
+
+Usage:
+
+```
+buffer = stream_buffer.create(user_id)
+buffer.start(frames)  # an async iterator of SSE frames
+return StreamingResponse(buffer.tail(last_event_id), media_type="text/event-stream")
+```
+"""
+
+import asyncio
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from typing import AsyncIterator, Callable
+import config
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+STREAM_RESUME_GRACE = getattr(config, "STREAM_RESUME_GRACE", 10)
+STREAM_BUFFER_TTL = getattr(config, "STREAM_BUFFER_TTL", 120)
+STREAM_BUFFERS_MAX_BYTES = getattr(config, "STREAM_BUFFERS_MAX_BYTES", 64 * 1024 * 1024)
+STREAM_BUFFER_MAX_BYTES = getattr(config, "STREAM_BUFFER_MAX_BYTES", 4 * 1024 * 1024)
+STREAM_MAX_RUNNING_PER_USER = getattr(config, "STREAM_MAX_RUNNING_PER_USER", 4)
+
+
+class TooManyStreams(Exception):
+    pass
+
+
+def _format_frame(event_id: int, frame: str) -> str:
+    # Frames that are not server-sent events (the legacy error frame) are sent as is
+    if frame.startswith("data:") or frame.startswith("event:"):
+        return f"id: {event_id}\n{frame}"
+    return frame
+
+
+class StreamBuffer:
+    def __init__(self, stream_id: str, user_id: int, grace: float, max_bytes: int = 0):
+        """
+        Initialize the StreamBuffer. If max_bytes is 0 all frames are kept.
+        """
+        self.stream_id = stream_id
+        self.user_id = user_id
+        self.grace = grace
+        self.max_bytes = max_bytes
+        self.frames: list[str] = []
+        self.num_bytes = 0
+
+        # Number of frames dropped from the start of frames
+        self.dropped = 0
+        self.finished_at = 0.0
+        self.consumers = 0
+        self.task: asyncio.Task | None = None
+
+        # Set and replaced when frames are appended or the stream finishes
+        self._changed = asyncio.Event()
+        self._abandon_handle: asyncio.TimerHandle | None = None
+
+    @property
+    def finished(self) -> bool:
+        return bool(self.finished_at)
+
+    @property
+    def num_frames(self) -> int:
+        return self.dropped + len(self.frames)
+
+    def start(self, frames: AsyncIterator[str], on_finish: Callable[[], None] | None = None) -> None:
+        """
+        Start a task that appends the frames to the buffer. on_finish is called when the task is done,
+        also if it is cancelled before the frames are started.
+        """
+        self.task = asyncio.get_running_loop().create_task(self._produce(frames))
+        self.task.add_done_callback(lambda task: self._finish(on_finish))
+
+        # Also cancelled if no client ever attaches
+        self._abandon_handle = asyncio.get_running_loop().call_later(self.grace, self._cancel_if_abandoned)
+
+    async def _produce(self, frames: AsyncIterator[str]) -> None:
+        async for frame in frames:
+            self._append(frame)
+
+    def _append(self, frame: str) -> None:
+        if not frame:
+            return
+
+        self.frames.append(frame)
+        self.num_bytes += len(frame)
+        if self.max_bytes and self.num_bytes > self.max_bytes:
+            self._drop_oldest()
+        self._notify()
+
+    def _drop_oldest(self) -> None:
+        """
+        Drop the oldest frames down to three quarters of max_bytes, so frames are not dropped on every append.
+        The newest frame is always kept.
+        """
+        num_drop = 0
+        while self.num_bytes > self.max_bytes * 3 // 4 and num_drop < len(self.frames) - 1:
+            self.num_bytes -= len(self.frames[num_drop])
+            num_drop += 1
+
+        del self.frames[:num_drop]
+        self.dropped += num_drop
+
+    def _finish(self, on_finish: Callable[[], None] | None) -> None:
+        self.finished_at = time.monotonic()
+        if self._abandon_handle:
+            self._abandon_handle.cancel()
+        self._notify()
+
+        if on_finish:
+            on_finish()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def tail(self, last_event_id: int = 0):
+        """
+        Yield the frames after last_event_id and then the new frames until the stream finishes
+        """
+        self._attach()
+        try:
+            event_id = last_event_id
+            while True:
+                changed = self._changed
+                while event_id < self.num_frames:
+                    if event_id < self.dropped:
+                        logger.debug(f"Client fell behind the frames kept for stream: {self.stream_id}")
+                        return
+
+                    event_id += 1
+                    yield _format_frame(event_id, self.frames[event_id - 1 - self.dropped])
+
+                if self.finished:
+                    return
+
+                await changed.wait()
+        finally:
+            self._detach()
+
+    def _attach(self) -> None:
+        self.consumers += 1
+        if self._abandon_handle:
+            self._abandon_handle.cancel()
+            self._abandon_handle = None
+
+    def _detach(self) -> None:
+        self.consumers -= 1
+        if self.consumers == 0 and not self.finished:
+            self._abandon_handle = asyncio.get_running_loop().call_later(self.grace, self._cancel_if_abandoned)
+
+    def _cancel_if_abandoned(self) -> None:
+        self._abandon_handle = None
+        if self.consumers == 0:
+            logger.debug(f"No client attached to stream: {self.stream_id}")
+            self.cancel()
+
+    def cancel(self) -> None:
+        """
+        Cancel the generation of the stream
+        """
+        if self.task and not self.finished:
+            self.task.cancel()
+
+
+_buffers: OrderedDict[str, StreamBuffer] = OrderedDict()
+
+
+def _evict() -> None:
+    now = time.monotonic()
+    for stream_id, stream_buffer in list(_buffers.items()):
+        if stream_buffer.finished and now - stream_buffer.finished_at > STREAM_BUFFER_TTL:
+            del _buffers[stream_id]
+
+    num_bytes = sum(stream_buffer.num_bytes for stream_buffer in _buffers.values())
+    if num_bytes <= STREAM_BUFFERS_MAX_BYTES:
+        return
+
+    finished = [stream_buffer for stream_buffer in _buffers.values() if stream_buffer.finished]
+    for stream_buffer in sorted(finished, key=lambda stream_buffer: stream_buffer.finished_at):
+        if num_bytes <= STREAM_BUFFERS_MAX_BYTES:
+            break
+
+        del _buffers[stream_buffer.stream_id]
+        num_bytes -= stream_buffer.num_bytes
+
+
+def check_running(user_id: int) -> None:
+    """
+    Raise TooManyStreams if the user has STREAM_MAX_RUNNING_PER_USER running streams
+    """
+    if not STREAM_MAX_RUNNING_PER_USER:
+        return
+
+    num_running = sum(1 for stream_buffer in _buffers.values() if stream_buffer.user_id == user_id and not stream_buffer.finished)
+    if num_running >= STREAM_MAX_RUNNING_PER_USER:
+        raise TooManyStreams("Too many chat streams are running. Please wait for a stream to finish.")
+
+
+def create(user_id: int) -> StreamBuffer:
+    """
+    Create a buffer for a new stream of a user. Raise TooManyStreams if the user has too many running streams.
+    """
+    _evict()
+    check_running(user_id)
+    stream_buffer = StreamBuffer(uuid.uuid4().hex, user_id, STREAM_RESUME_GRACE, STREAM_BUFFER_MAX_BYTES)
+    _buffers[stream_buffer.stream_id] = stream_buffer
+    return stream_buffer
+
+
+def get(stream_id: str, user_id: int) -> StreamBuffer | None:
+    """
+    Get the buffer of a stream. Return None if the stream is unknown, evicted or owned by another user.
+    """
+    _evict()
+    stream_buffer = _buffers.get(stream_id)
+    if stream_buffer is None or stream_buffer.user_id != user_id:
+        return None
+    return stream_buffer
+
+
+async def cancel_all() -> None:
+    """
+    Cancel all running streams and wait for them to finish
+    """
+    tasks = [stream_buffer.task for stream_buffer in _buffers.values() if stream_buffer.task and not stream_buffer.finished]
+    for task in tasks:
+        task.cancel()
+
+    await asyncio.gather(*tasks, return_exceptions=True)
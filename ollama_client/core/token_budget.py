@@ -0,0 +1,187 @@
+"""
+Estimate token counts and shape a list of chat messages to fit a context window.
+
+The estimate does not use a real tokenizer. It counts words and punctuation and
+uses roughly 4 characters per token for long words, which slightly overestimates
+most texts. Counts are cached by a hash of the message content, so a long dialog is
+only counted once per worker, and the cache does not keep the contents in memory.
+"""
+
+import hashlib
+import json
+import re
+from ollama_client.core.lru_cache import LRUCache
+
+
+# Tokens added by the chat template for each message (role, separators)
+MESSAGE_OVERHEAD = 4
+
+# Marker inserted where an oversized message is cut
+TRUNCATION_MARKER = "\n[...]\n"
+
+# Note telling the model that earlier messages were left out
+LEFT_OUT_NOTE = "[{} earlier messages were left out to fit the context window]"
+
+_token_pattern = re.compile(r"\w+|[^\w\s]")
+_note_pattern = re.compile(r"\[(\d+) earlier messages were left out to fit the context window\]")
+_token_counts = LRUCache(4096)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in a text
+    """
+    if not text:
+        return 0
+
+    key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    num_tokens = _token_counts.get(key)
+    if num_tokens is None:
+        num_pieces = len(_token_pattern.findall(text))
+        num_tokens = max(num_pieces, (len(text) + 3) // 4)
+        _token_counts.set(key, num_tokens)
+
+    return num_tokens
+
+
+def _message_text(message: dict) -> str:
+    content = message.get("content") or ""
+    if not isinstance(content, str):
+        content = json.dumps(content)
+
+    if message.get("tool_calls"):
+        content += json.dumps(message["tool_calls"])
+
+    return content
+
+
+def estimate_message_tokens(message: dict) -> int:
+    """
+    Estimate the number of tokens used by a single chat message
+    """
+    return estimate_tokens(_message_text(message)) + MESSAGE_OVERHEAD
+
+
+def estimate_messages_tokens(messages: list) -> int:
+    """
+    Estimate the number of tokens used by a list of chat messages
+    """
+    return sum(estimate_message_tokens(message) for message in messages)
+
+
+def _truncate_message(message: dict, max_tokens: int) -> dict:
+    """
+    Cut the middle out of a message so it fits max_tokens. The start and end are kept.
+    """
+    content = _message_text(message)
+    num_tokens = estimate_tokens(content)
+    if num_tokens <= max_tokens:
+        return message
+
+    keep_chars = max(int(len(content) * max_tokens / num_tokens) - len(TRUNCATION_MARKER), 0)
+    head = content[: keep_chars // 2]
+    tail = content[len(content) - keep_chars // 2 :] if keep_chars // 2 else ""
+    return {**message, "content": f"{head}{TRUNCATION_MARKER}{tail}"}
+
+
+def _truncate_messages(messages: list, max_tokens: int) -> list:
+    """
+    Cut the middle out of messages so they fit max_tokens together. Each message gets an equal
+    share. Assistant messages with tool calls are kept whole, as the calls can not be cut.
+    """
+    num_cut = sum(1 for message in messages if not message.get("tool_calls"))
+    if not num_cut:
+        return messages
+
+    whole_tokens = estimate_messages_tokens([message for message in messages if message.get("tool_calls")])
+    share = max((max_tokens - whole_tokens) // num_cut - MESSAGE_OVERHEAD, 0)
+    return [message if message.get("tool_calls") else _truncate_message(message, share) for message in messages]
+
+
+def _num_newest(turns: list) -> int:
+    """
+    Number of messages in the newest turn. After a tool round that is the assistant message
+    with the tool calls and all the tool results, as results can not be sent without the call.
+    """
+    num_newest = 1
+    while num_newest < len(turns) and turns[-num_newest].get("role") == "tool":
+        num_newest += 1
+
+    return num_newest
+
+
+def shape_messages(messages: list, max_tokens: int) -> tuple[list, int]:
+    """
+    Fit a list of chat messages into max_tokens.
+
+    Leading system messages and the newest turn are always kept. Older turns are
+    left out, newest first kept, and replaced by a short note telling the model that
+    earlier messages were left out. If the newest turn alone is too large its
+    middle is cut out. Leading system messages are cut if they leave the newest
+    turn less than half of max_tokens. A note from an earlier shaping of the same
+    messages is replaced, so a growing list of messages can be shaped again.
+
+    Returns the shaped messages and the estimated number of tokens.
+    """
+    num_pinned = 0
+    while num_pinned < len(messages) and messages[num_pinned].get("role") == "system":
+        num_pinned += 1
+
+    pinned = messages[:num_pinned]
+    turns = messages[num_pinned:]
+
+    total_tokens = estimate_messages_tokens(messages)
+    if total_tokens <= max_tokens or not turns:
+        return messages, total_tokens
+
+    # The note of an earlier shaping is the last pinned message
+    num_noted = 0
+    content = pinned[-1].get("content") if pinned else None
+    match = _note_pattern.fullmatch(content) if isinstance(content, str) else None
+    if match:
+        num_noted = int(match.group(1))
+        pinned = pinned[:-1]
+
+    # Reserve room for the note about left out messages
+    note_tokens = estimate_tokens(LEFT_OUT_NOTE.format(999999)) + MESSAGE_OVERHEAD
+
+    newest = turns[-_num_newest(turns) :]
+    older = turns[: len(turns) - len(newest)]
+    newest_tokens = estimate_messages_tokens(newest)
+
+    pinned_budget = max_tokens - note_tokens - min(newest_tokens, max_tokens // 2)
+    if estimate_messages_tokens(pinned) > pinned_budget:
+        pinned = _truncate_messages(pinned, pinned_budget)
+
+    budget = max_tokens - estimate_messages_tokens(pinned) - note_tokens
+    if newest_tokens > budget:
+        newest = _truncate_messages(newest, budget)
+
+    budget -= newest_tokens
+    kept: list = []
+    for message in reversed(older):
+        message_tokens = estimate_message_tokens(message)
+        if message_tokens > budget:
+            break
+
+        kept.append(message)
+        budget -= message_tokens
+
+    kept.reverse()
+
+    # Tool results can not be sent without the assistant message that called the tool
+    while kept and kept[0].get("role") == "tool":
+        kept.pop(0)
+
+    kept += newest
+    num_left_out = len(turns) - len(kept) + num_noted
+    if not num_left_out:
+        return pinned + kept, estimate_messages_tokens(pinned + kept)
+
+    note = {
+        "role": "system",
+        "content": LEFT_OUT_NOTE.format(num_left_out),
+    }
+
+    shaped = pinned + [note] + kept
+    return shaped, estimate_messages_tokens(shaped)
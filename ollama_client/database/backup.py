@@ -0,0 +1,143 @@
+"""
+Online backup of the database with the SQLite backup API.
+
+The database is copied a number of pages per step with a sleep between the steps, so writers
+are not starved while the backup runs. The copy is written to a .partial file and renamed when
+it is complete, so a backup file is never a partial copy.
+
+When another connection writes to the database during the backup, SQLite starts the copy again.
+After max_restarts restarts, the database is copied again in one step. With WAL the single step
+reads a snapshot of the database and does not block writers.
+
+Usage:
+
+```
+result = backup.backup("data/database.db", "data/backups/database.db.gz", compress=True)
+```
+"""
+
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Seconds between progress logs
+PROGRESS_INTERVAL = 5
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+class _Progress:
+    def __init__(self, sleep: float, max_restarts: int):
+        self.sleep = sleep
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        self.remaining = -1
+        self.total = 0
+        self.logged = time.monotonic()
+
+    def __call__(self, status: int, remaining: int, total: int) -> None:
+        # More pages remaining than after the last step means that the copy was started again
+        if remaining > self.remaining >= 0:
+            self.restarts += 1
+            if self.restarts > self.max_restarts:
+                raise _TooManyRestarts()
+
+        self.remaining = remaining
+        self.total = total
+        if time.monotonic() - self.logged > PROGRESS_INTERVAL:
+            self.logged = time.monotonic()
+            logger.info(f"Backup: {total - remaining} of {total} pages copied")
+
+        if remaining and self.sleep:
+            time.sleep(self.sleep)
+
+
+def _copy(source: sqlite3.Connection, target_path: str, pages: int, progress: _Progress) -> None:
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=pages, progress=progress)
+    finally:
+        target.close()
+
+
+def _integrity_check(path: str) -> str:
+    connection = sqlite3.connect(path)
+    try:
+        rows = connection.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        connection.close()
+    return "\n".join(row[0] for row in rows)
+
+
+def _compress(path: str, output: str) -> None:
+    with open(path, "rb") as file, gzip.open(output, "wb", compresslevel=6) as gzip_file:
+        shutil.copyfileobj(file, gzip_file, 1024 * 1024)
+
+
+def backup(
+    database_url,
+    output,
+    pages: int = 256,
+    sleep: float = 0.005,
+    compress: bool = False,
+    check: bool = True,
+    max_restarts: int = 3,
+) -> dict:
+    """
+    Copy the database to output, compressed with gzip if compress is set. Returns the number of
+    pages, the pages per second of the copy, the result of the integrity check and the size of
+    the backup file. Raises ValueError if the integrity check fails.
+    """
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    copy_path = f"{output.with_suffix('') if compress else output}.partial"
+    compress_path = f"{output}.partial"
+
+    source = sqlite3.connect(database_url)
+    source.execute("PRAGMA busy_timeout = 5000")
+    progress = _Progress(sleep, max_restarts)
+    started = time.monotonic()
+    try:
+        try:
+            _copy(source, copy_path, pages, progress)
+        except _TooManyRestarts:
+            logger.info(f"Backup: started again {max_restarts} times by writes. Copying in one step")
+            _copy(source, copy_path, -1, progress)
+        source.close()
+
+        seconds = time.monotonic() - started
+        result = {
+            "pages": progress.total,
+            "seconds": round(seconds, 3),
+            "pages_per_second": round(progress.total / seconds) if seconds else progress.total,
+            "restarts": progress.restarts,
+            "integrity_check": "skipped",
+        }
+
+        if check:
+            result["integrity_check"] = _integrity_check(copy_path)
+            if result["integrity_check"] != "ok":
+                raise ValueError(f"Integrity check of the backup failed: {result['integrity_check']}")
+
+        if compress:
+            _compress(copy_path, compress_path)
+            os.replace(compress_path, output)
+        else:
+            os.replace(copy_path, output)
+    finally:
+        source.close()
+        for path in (copy_path, compress_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    result["size"] = output.stat().st_size
+    return result
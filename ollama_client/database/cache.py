@@ -1,51 +1,118 @@
-import sqlite3
+"""
+Key-value cache stored in the cache table with an in-process LRU in front of it.
+
+Values are stored as JSON. Each key has one row (a unique index on key), and set() is an atomic
+upsert that gives the row a new version (the time of the set in ns, so a row that is deleted and
+set again does not get an old version back). A row expires at its expires time, or never if
+expires is 0. Expired rows are not deleted by get(), which may run on a read-only connection.
+They are removed with sweep().
+
+Each worker keeps the parsed values it has read in an LRU. An LRU entry is validated
+against the version of the row before it is used, so a value set by another worker is never
+served stale, and the JSON is only parsed when the row has changed. Values returned by get()
+are shared between callers and must not be changed.
+
+Lookups are counted in the metric cache_requests_total by result: memory_hit, database_hit or miss.
+"""
+
 import json
+import sqlite3
 import time
 from typing import Any
+from ollama_client.database.connection_pool import AsyncConnection
+from ollama_client.core.lru_cache import LRUCache
+from ollama_client.core import metrics
+import config
+
+# Max number of parsed values kept in memory per worker
+DATABASE_CACHE_MEMORY_SIZE = getattr(config, "DATABASE_CACHE_MEMORY_SIZE", 1024)
+
+_memory_cache = LRUCache(DATABASE_CACHE_MEMORY_SIZE)
+
+_SET_SQL = """
+INSERT INTO cache (key, value, unix_timestamp, expires, version)
+VALUES (:key, :value, :timestamp, :expires, :version)
+ON CONFLICT (key) DO UPDATE SET
+  value = excluded.value,
+  unix_timestamp = excluded.unix_timestamp,
+  expires = excluded.expires,
+  version = excluded.version
+"""
+
+
+def _is_expired(row: sqlite3.Row, expire_in: int, now: int) -> bool:
+    if row["expires"] and row["expires"] <= now:
+        return True
+    return bool(expire_in) and now - row["unix_timestamp"] >= expire_in
 
 
 class DatabaseCache:
-    def __init__(self, connection: sqlite3.Connection):
+    def __init__(self, connection: AsyncConnection):
         """
         Initialize the DatabaseCache with a connection.
         The connection is expected to be managed externally (e.g., with async with).
         """
         self.connection = connection
 
-    async def set(self, key: str, data: Any) -> bool:
+    async def set(self, key: str, data: Any, ttl: int = 0) -> bool:
         """
-        Set a cache value. This will always delete the old value and insert a new one.
+        Set a cache value. The value expires after ttl seconds. If ttl is 0, it never expires.
         """
-        json_data = json.dumps(data)
-        self.connection.execute("DELETE FROM cache WHERE key = :key", {"key": key})
-        self.connection.execute(
-            "INSERT INTO cache (key, value, unix_timestamp) VALUES (:key, :value, :timestamp)",
-            {"key": key, "value": json_data, "timestamp": int(time.time())},
-        )
+        now = int(time.time())
+        values = {
+            "key": key,
+            "value": json.dumps(data),
+            "timestamp": now,
+            "expires": now + ttl if ttl else 0,
+            "version": time.time_ns(),
+        }
+
+        # The transaction may still be rolled back, so the value is read back on the next get()
+        _memory_cache.delete(key)
+        await self.connection.execute(_SET_SQL, values)
         return True
 
     async def get(self, key: str, expire_in: int = 0) -> Any:
         """
         Will return the value if the key exists and is not expired.
         Will return None if the key does not exist or if the key is expired.
-        If expire_in is 0, the value will never expire.
+        If expire_in is not 0, values set more than expire_in seconds ago are also expired.
         """
-        result = self.connection.execute("SELECT * FROM cache WHERE key = :key", {"key": key}).fetchone()
+        now = int(time.time())
+        entry = _memory_cache.get(key)
+        if entry:
+            row = await self.connection.fetchone("SELECT version, unix_timestamp, expires FROM cache WHERE key = :key", {"key": key})
+            if row and row["version"] == entry["version"]:
+                if _is_expired(row, expire_in, now):
+                    metrics.cache_requests_total.inc(result="miss")
+                    return None
 
-        if result:
-            if expire_in == 0:
-                return json.loads(result["value"])
+                metrics.cache_requests_total.inc(result="memory_hit")
+                return entry["value"]
 
-            current_time = int(time.time())
-            if current_time - result["unix_timestamp"] < expire_in:
-                return json.loads(result["value"])
-            else:
-                self.connection.execute("DELETE FROM cache WHERE id = :id", {"id": result["id"]})
-        return None
+        row = await self.connection.fetchone("SELECT value, version, unix_timestamp, expires FROM cache WHERE key = :key", {"key": key})
+        if not row or _is_expired(row, expire_in, now):
+            metrics.cache_requests_total.inc(result="miss")
+            return None
 
-    async def delete(self, id: int) -> None:
+        value = json.loads(row["value"])
+        _memory_cache.set(key, {"version": row["version"], "value": value})
+        metrics.cache_requests_total.inc(result="database_hit")
+        return value
+
+    async def delete(self, key: str) -> None:
         """
-        Delete a cache value by id
+        Delete a cache value by key
         """
-        self.connection.execute("DELETE FROM cache WHERE id = :id", {"id": id})
+        _memory_cache.delete(key)
+        await self.connection.execute("DELETE FROM cache WHERE key = :key", {"key": key})
         return None
+
+    async def sweep(self, limit: int = -1) -> int:
+        """
+        Delete the expired rows, at most limit rows if limit is not -1. Returns the number of deleted rows.
+        """
+        return await self.connection.execute(
+            "DELETE FROM cache WHERE cache_id IN " "(SELECT cache_id FROM cache WHERE expires > 0 AND expires <= :now LIMIT :limit)",
+            {"now": int(time.time()), "limit": limit},
+        )
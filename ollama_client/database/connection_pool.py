@@ -0,0 +1,275 @@
+"""
+Pool of SQLite connections used by the async transaction scopes.
+
+Connections are opened once and reused, so the pragmas are only applied when a connection is
+opened. Statements run in executor threads, so queries do not block the event loop.
+
+Write transactions run in one executor thread per pool, and only one write transaction runs at
+a time in a process: the write lock is an asyncio lock, so waiting for it does not block the
+executor thread. Transactions of other processes (gunicorn workers) are waited for with the
+busy timeout of SQLite.
+
+Read transactions run on read-only connections (query_only) in their own executor threads. They
+do not take the write lock. With WAL a read transaction sees a snapshot of the database, so
+reads run in parallel with each other and with the writer.
+
+A pool belongs to the event loop it is created in. `get_pool(database_url)` returns the pool of
+the running loop and creates it on first use.
+
+Usage:
+
+```
+pool = connection_pool.get_pool("data/database.db")
+async with pool.transaction() as connection:
+    await connection.execute("DELETE FROM cache WHERE key = :key", {"key": key})
+
+async with pool.read() as connection:
+    rows = await connection.fetchall("SELECT * FROM users WHERE email = :email", {"email": email})
+```
+"""
+
+import asyncio
+import sqlite3
+import logging
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable
+import config
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Max number of read connections (and read threads) per pool
+DATABASE_POOL_SIZE = getattr(config, "DATABASE_POOL_SIZE", 4)
+
+# Pragmas applied when a connection is opened
+DATABASE_PRAGMAS = getattr(
+    config,
+    "DATABASE_PRAGMAS",
+    {
+        "journal_mode": "WAL",
+        "busy_timeout": 5000,
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 128 * 1024 * 1024,
+        "foreign_keys": "ON",
+    },
+)
+
+
+class AsyncConnection:
+    """
+    A pooled connection. Statements run in the executor thread of the pool.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, executor: ThreadPoolExecutor):
+        self.connection = connection
+        self.executor = executor
+
+    async def run(self, func: Callable, *args):
+        """
+        Call func(connection, *args) in the executor thread
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, self.connection, *args)
+
+    async def execute(self, query: str, values: dict | tuple = ()) -> int:
+        """
+        Execute a statement. Returns the number of changed rows.
+        """
+        return await self.run(_execute, query, values)
+
+    async def executemany(self, query: str, values_many: list) -> int:
+        """
+        Execute a statement once for each values. Returns the number of changed rows.
+        """
+        return await self.run(_executemany, query, values_many)
+
+    async def fetchall(self, query: str, values: dict | tuple = ()) -> list:
+        return await self.run(_fetchall, query, values)
+
+    async def fetchone(self, query: str, values: dict | tuple = ()):
+        return await self.run(_fetchone, query, values)
+
+
+def _execute(connection: sqlite3.Connection, query: str, values: dict | tuple) -> int:
+    return connection.execute(query, values).rowcount
+
+
+def _executemany(connection: sqlite3.Connection, query: str, values_many: list) -> int:
+    return connection.executemany(query, values_many).rowcount
+
+
+def _fetchall(connection: sqlite3.Connection, query: str, values: dict | tuple) -> list:
+    return connection.execute(query, values).fetchall()
+
+
+def _fetchone(connection: sqlite3.Connection, query: str, values: dict | tuple):
+    return connection.execute(query, values).fetchone()
+
+
+def _rollback(connection: sqlite3.Connection) -> None:
+    # Some errors roll back the transaction themselves
+    if connection.in_transaction:
+        connection.execute("ROLLBACK")
+
+
+def _optimize(connection: sqlite3.Connection, read_only: bool) -> None:
+    # ANALYZE writes to the database, so query_only is turned off while it runs
+    if read_only:
+        connection.execute("PRAGMA query_only = OFF")
+    try:
+        connection.execute("PRAGMA analysis_limit = 400")
+        connection.execute("PRAGMA optimize")
+    finally:
+        if read_only:
+            connection.execute("PRAGMA query_only = ON")
+
+
+def _open(database_url, pragmas: dict, read_only: bool) -> sqlite3.Connection:
+    # Transactions are started and ended explicitly
+    connection = sqlite3.connect(database_url, isolation_level=None, check_same_thread=False)
+    connection.row_factory = sqlite3.Row
+    for name, value in pragmas.items():
+        connection.execute(f"PRAGMA {name} = {value}")
+    if read_only:
+        connection.execute("PRAGMA query_only = ON")
+    return connection
+
+
+class ConnectionPool:
+    def __init__(self, database_url, size: int = 4, pragmas: dict = {}):
+        self.database_url = database_url
+        self.pragmas = pragmas
+        self.write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-write")
+        self.read_executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="sqlite-read")
+
+        # Idle connections
+        self.write_connections: list[sqlite3.Connection] = []
+        self.read_connections: list[sqlite3.Connection] = []
+
+        self.read_slots = asyncio.Semaphore(size)
+        self.write_lock = asyncio.Lock()
+        self.write_task: asyncio.Task | None = None
+
+    @asynccontextmanager
+    async def _connection(self, read_only: bool):
+        """
+        Get an idle connection. Opens a connection if none is idle.
+        """
+        idle = self.read_connections if read_only else self.write_connections
+        executor = self.read_executor if read_only else self.write_executor
+        loop = asyncio.get_running_loop()
+        if idle:
+            connection = idle.pop()
+        else:
+            connection = await loop.run_in_executor(executor, _open, self.database_url, self.pragmas, read_only)
+
+        try:
+            yield AsyncConnection(connection, executor)
+        finally:
+            # A connection left in a transaction is not reused
+            if connection.in_transaction:
+                await loop.run_in_executor(executor, connection.close)
+            else:
+                idle.append(connection)
+
+    @asynccontextmanager
+    async def _scope(self, connection: AsyncConnection, begin: str):
+        await connection.execute(begin)
+        try:
+            yield connection
+        except BaseException:
+            await connection.run(_rollback)
+            raise
+        await connection.execute("COMMIT")
+
+    @asynccontextmanager
+    async def _write_connection(self):
+        if self.write_task and self.write_task is asyncio.current_task():
+            raise RuntimeError("A transaction scope can not be opened inside another transaction scope")
+
+        async with self.write_lock:
+            self.write_task = asyncio.current_task()
+            try:
+                async with self._connection(read_only=False) as connection:
+                    yield connection
+            finally:
+                self.write_task = None
+
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Write transaction. Committed if the block succeeds, else rolled back.
+        """
+        async with self._write_connection() as connection:
+            async with self._scope(connection, "BEGIN IMMEDIATE") as connection:
+                yield connection
+
+    @asynccontextmanager
+    async def autocommit(self):
+        """
+        Write connection outside of a transaction, for statements that can not run in a
+        transaction (checkpoints, VACUUM). Holds the write lock like a transaction.
+        """
+        async with self._write_connection() as connection:
+            yield connection
+
+    async def optimize(self) -> None:
+        """
+        Run PRAGMA optimize on the write connection and the idle read connections. SQLite
+        analyzes the tables that the queries run on a connection would benefit from.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._write_connection() as connection:
+            await connection.run(_optimize, False)
+
+            # Idle read connections are taken out of the pool while they are optimized
+            read_connections, self.read_connections = self.read_connections, []
+            try:
+                for read_connection in read_connections:
+                    await loop.run_in_executor(self.read_executor, _optimize, read_connection, True)
+            finally:
+                self.read_connections.extend(read_connections)
+
+    @asynccontextmanager
+    async def read(self):
+        """
+        Read transaction on a read-only connection. Does not wait for writers.
+        """
+        async with self.read_slots:
+            async with self._connection(read_only=True) as connection:
+                async with self._scope(connection, "BEGIN DEFERRED") as connection:
+                    yield connection
+
+    async def close(self) -> None:
+        connections = self.write_connections + self.read_connections
+        self.write_connections, self.read_connections = [], []
+        for connection in connections:
+            connection.close()
+        self.write_executor.shutdown(wait=False)
+        self.read_executor.shutdown(wait=False)
+
+
+# Pools by event loop and database
+_pools: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict] = weakref.WeakKeyDictionary()
+
+
+def get_pool(database_url) -> ConnectionPool:
+    """
+    Get the pool of a database for the running event loop
+    """
+    loop_pools = _pools.setdefault(asyncio.get_running_loop(), {})
+    key = str(database_url)
+    if key not in loop_pools:
+        loop_pools[key] = ConnectionPool(database_url, DATABASE_POOL_SIZE, DATABASE_PRAGMAS)
+    return loop_pools[key]
+
+
+async def close() -> None:
+    """
+    Close the pools of the running event loop
+    """
+    loop_pools = _pools.pop(asyncio.get_running_loop(), {})
+    for pool in loop_pools.values():
+        await pool.close()
@@ -0,0 +1,44 @@
+"""
+Storage codec for message contents.
+
+Contents longer than MESSAGE_COMPRESSION_THRESHOLD characters are stored compressed with zlib.
+The message table is STRICT with a TEXT content column, so the compressed bytes are stored as
+base64 after a marker. encode() is used when messages are written and decode() when they are
+read. Plain contents that happen to start with the marker are always encoded, so decode() never
+mistakes a plain content for a compressed one.
+
+SQL can not read compressed contents, so the search index is fed the plain text by the app (see
+models/search_model.py).
+
+Existing messages are rewritten with the current threshold with `ollama-client compress-messages`.
+"""
+
+import base64
+import zlib
+import config
+
+# Contents longer than this number of characters are compressed. 0 is off.
+MESSAGE_COMPRESSION_THRESHOLD = getattr(config, "MESSAGE_COMPRESSION_THRESHOLD", 0)
+
+MARKER = "\x1azlib:"
+
+
+def encode(content: str, threshold: int = MESSAGE_COMPRESSION_THRESHOLD) -> str:
+    """
+    Compress content if it is longer than threshold and compression makes it smaller
+    """
+    is_marked = content.startswith(MARKER)
+    if not is_marked and (not threshold or len(content) <= threshold):
+        return content
+
+    data = content.encode()
+    encoded = MARKER + base64.b64encode(zlib.compress(data, 6)).decode("ascii")
+    if is_marked or len(encoded) < len(data):
+        return encoded
+    return content
+
+
+def decode(content: str) -> str:
+    if not content.startswith(MARKER):
+        return content
+    return zlib.decompress(base64.b64decode(content[len(MARKER) :])).decode()
@@ -38,16 +38,17 @@ async with transaction_scope_async() as connection:
 ```
 """
 
-import sqlite3
 import logging
+from itertools import groupby
 
 from ..database.sql_builder import SQLBuilder
+from ..database.connection_pool import AsyncConnection
 
 logger: logging.Logger = logging.getLogger(__name__)
 
 
 class CRUD:
-    def __init__(self, connection: sqlite3.Connection):
+    def __init__(self, connection: AsyncConnection):
         """
         Initialize CRUD with database URL.
         """
@@ -57,8 +58,7 @@ class CRUD:
         """
         Get the last inserted row ID.
         """
-        cursor = self.connection.execute("SELECT last_insert_rowid() as last_insert_id")
-        row = cursor.fetchone()
+        row = await self.connection.fetchone("SELECT last_insert_rowid() as last_insert_id")
         return row["last_insert_id"]
 
     async def insert(self, table: str, insert_values: dict):
@@ -67,24 +67,27 @@ class CRUD:
         """
         sql_builder = SQLBuilder(table)
         query = sql_builder.build_insert(insert_values)
-        self.connection.execute(query, insert_values)
+        await self.connection.execute(query, insert_values)
 
     async def replace(self, table: str, update_insert_values: dict, filters: dict):
         """
-        Replace a single row into the table by using update or insert.
+        Replace a single row into the table by using insert or update on conflict.
+        The filter columns must have a unique index.
         """
-        exists = await self.exists(table, filters)
-        if exists:
-            await self.update(table, update_insert_values, filters)
-        else:
-            await self.insert(table, update_insert_values)
+        sql_builder = SQLBuilder(table)
+        query = sql_builder.build_upsert({**filters, **update_insert_values}, list(filters))
+        await self.connection.execute(query, sql_builder.get_execute_values())
 
     async def insert_many(self, table: str, insert_values_many: list[dict]):
         """
-        Insert multiple rows into the table.
+        Insert multiple rows into the table. Consecutive rows with the same columns
+        are inserted with one executemany.
         """
-        for single_data in insert_values_many:
-            await self.insert(table, single_data)
+        sql_builder = SQLBuilder(table)
+        for _, group in groupby(insert_values_many, key=lambda insert_values: tuple(insert_values)):
+            rows = list(group)
+            query = sql_builder.build_insert(rows[0])
+            await self.connection.executemany(query, rows)
 
     async def select(
         self,
@@ -105,8 +108,7 @@ class CRUD:
             limit_offset=limit_offset,
         )
 
-        cursor = self.connection.execute(query, filters)
-        rows = cursor.fetchall()
+        rows = await self.connection.fetchall(query, filters)
         rows = [dict(row) for row in rows]
         return rows
 
@@ -125,7 +127,7 @@ class CRUD:
         """
         sql_builder = SQLBuilder(table)
         query = sql_builder.build_update(update_values, filters)
-        self.connection.execute(query, sql_builder.get_execute_values())
+        await self.connection.execute(query, sql_builder.get_execute_values())
 
     async def delete(self, table: str, filters: dict):
         """
@@ -133,7 +135,7 @@ class CRUD:
         """
         sql_builder = SQLBuilder(table)
         query = sql_builder.build_delete(filters)
-        self.connection.execute(query, filters)
+        await self.connection.execute(query, filters)
 
     async def exists(self, table: str, filters: dict) -> bool:
         """
@@ -148,8 +150,7 @@ class CRUD:
         """
         sql_builder = SQLBuilder(table)
         query = sql_builder.build_select(columns=[f"COUNT({column}) as num_rows"], filters=filters)
-        cursor = self.connection.execute(query, filters)
-        row = cursor.fetchone()
+        row = await self.connection.fetchone(query, filters)
         return row["num_rows"]
 
     async def query(self, query: str, values: dict):
@@ -157,8 +158,7 @@ class CRUD:
         Execute a custom query and return the rows.
         """
         logger.debug(f"Query: {query} - Values: {values}")
-        cursor = self.connection.execute(query, values)
-        rows = cursor.fetchall()
+        rows = await self.connection.fetchall(query, values)
         rows = [dict(row) for row in rows]
         return rows
 
@@ -166,8 +166,7 @@ class CRUD:
         """
         Execute a custom query and return a single row.
         """
-        cursor = self.connection.execute(query, values)
-        row = cursor.fetchone()
+        row = await self.connection.fetchone(query, values)
         if row:
             return dict(row)
         return row
@@ -3,6 +3,7 @@ This module contains utility functions for working with SQLite databases.
 
 The functions in this module are used to create a transaction scope to ensure that all operations are atomic.
 If a query fails, the transaction is rolled back and an exception is raised. Otherwise, the transaction is committed.
+Pure reads use the read scope, which does not wait for writers.
 
 Example usage:
 
@@ -12,28 +13,31 @@ from ollma_serv.database.utils import DatabaseTransaction
 database_url = "database.db"
 database_transation = DatabaseTransaction(database_url)
 transaction_scope = database_transation.transaction_scope
+read_scope = database_transation.read_scope
 
 # same exmaples but using :placeholders
 async def delete_user(user_id: int):
     async with transaction_scope_async() as connection:
-        connection.execute("DELETE FROM users WHERE id = :user_id", {"user_id": user_id})
-        connection.execute(
+        await connection.execute("DELETE FROM users WHERE id = :user_id", {"user_id": user_id})
+        await connection.execute(
             "INSERT INTO deleted_user_log (user_id, message) VALUES (:user_id, :message)",
             {"user_id": user_id, "message": "User deleted"}
         )
 
 async def get_user(user_id: int):
-    async with transaction_scope_async() as connection:
-        cursor = connection.execute("SELECT * FROM users WHERE id = :user_id", {"user_id": user_id})
-        user = cursor.fetchone()
+    async with read_scope_async() as connection:
+        user = await connection.fetchone("SELECT * FROM users WHERE id = :user_id", {"user_id": user_id})
         return user
 
 ```
 """
 
 import sqlite3
+import time
 from contextlib import asynccontextmanager, contextmanager
 import logging
+from ollama_client.core import metrics
+from ollama_client.database import connection_pool
 
 logger: logging.Logger = logging.getLogger(__name__)
 
@@ -74,33 +78,41 @@ class DatabaseConnection:
         finally:
             connection.close()
 
-    async def get_db_connection_async(self) -> sqlite3.Connection:
+    @asynccontextmanager
+    async def async_transaction_scope(self):
         """
-        Create an asynchronous database connection.
+        Asynchronous transaction scope context manager. Yields a pooled connection
+        whose statements run in the executor thread of the pool.
         """
         if not self.database_url:
             raise ValueError("Database URL was not set")
 
-        connection = sqlite3.connect(self.database_url)
-        connection.row_factory = sqlite3.Row
-        connection.execute("PRAGMA journal_mode=WAL;")
-        return connection
+        started = time.monotonic()
+        status = "error"
+        try:
+            async with connection_pool.get_pool(self.database_url).transaction() as connection:
+                metrics.db_begin_seconds.observe(time.monotonic() - started)
+                yield connection
+            status = "ok"
+        finally:
+            metrics.db_transactions_total.inc(mode="write", status=status)
+            metrics.db_transaction_seconds.observe(time.monotonic() - started, mode="write")
 
     @asynccontextmanager
-    async def async_transaction_scope(self):
+    async def async_read_scope(self):
         """
-        Asynchronous transaction scope context manager.
+        Asynchronous read-only transaction scope context manager. Does not take the write lock,
+        and sees a snapshot of the database. Statements that write raise an error.
         """
-        connection = await self.get_db_connection_async()
+        if not self.database_url:
+            raise ValueError("Database URL was not set")
+
+        started = time.monotonic()
+        status = "error"
         try:
-            connection.execute("BEGIN IMMEDIATE")
-            yield connection
-            connection.commit()
-        except sqlite3.Error:
-            connection.rollback()
-            raise
-        except Exception:
-            connection.rollback()
-            raise
+            async with connection_pool.get_pool(self.database_url).read() as connection:
+                yield connection
+            status = "ok"
         finally:
-            connection.close()
+            metrics.db_transactions_total.inc(mode="read", status=status)
+            metrics.db_transaction_seconds.observe(time.monotonic() - started, mode="read")
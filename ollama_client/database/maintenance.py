@@ -0,0 +1,213 @@
+"""
+Database maintenance jobs. They run in the background of the app and with `ollama-client maintenance`.
+
+Jobs:
+
+- purge: Delete expired login tokens (user_token), password reset and verify tokens (token) and
+  cache rows. At most MAINTENANCE_BATCH_SIZE rows are deleted per transaction, so other writers
+  do not wait long for the write lock.
+- checkpoint: Copy the WAL into the database and truncate the WAL file.
+- optimize: Run PRAGMA optimize on the pooled connections of the worker running the job.
+- vacuum: Free up to MAINTENANCE_VACUUM_PAGES unused pages with PRAGMA incremental_vacuum. Off by
+  default. The database must use auto_vacuum = INCREMENTAL, which is set with
+  `ollama-client maintenance --enable-incremental-vacuum` while the server is stopped.
+
+Each worker checks the jobs every MAINTENANCE_CHECK_INTERVAL seconds. A job is due when it was
+started more than its interval ago. A worker claims a due job by setting its start time in the
+maintenance_job table with one statement, so only one gunicorn worker runs each job.
+
+```
+MAINTENANCE_INTERVALS = {"purge": 3600, "checkpoint": 300, "optimize": 86400, "vacuum": 86400}
+MAINTENANCE_VACUUM_PAGES = 1000
+```
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import Awaitable, Callable
+import arrow
+import config
+from config import DATABASE
+from ollama_client.database import connection_pool
+from ollama_client.database.cache import DatabaseCache
+from ollama_client.database.connection_pool import AsyncConnection
+from ollama_client.database.database_utils import DatabaseConnection
+from ollama_client.models import token_model
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Seconds between the runs of each job
+MAINTENANCE_INTERVALS = getattr(
+    config,
+    "MAINTENANCE_INTERVALS",
+    {"purge": 3600, "checkpoint": 300, "optimize": 86400, "vacuum": 86400},
+)
+
+# Seconds between checks for due jobs
+MAINTENANCE_CHECK_INTERVAL = getattr(config, "MAINTENANCE_CHECK_INTERVAL", 60)
+
+# Max number of rows deleted per transaction
+MAINTENANCE_BATCH_SIZE = getattr(config, "MAINTENANCE_BATCH_SIZE", 1000)
+
+# Max number of pages freed by each run of the vacuum job. 0 is off.
+MAINTENANCE_VACUUM_PAGES = getattr(config, "MAINTENANCE_VACUUM_PAGES", 0)
+
+_PURGE_USER_TOKEN_SQL = """
+DELETE FROM user_token WHERE user_token_id IN
+(SELECT user_token_id FROM user_token WHERE expires <= :now LIMIT :limit)
+"""
+
+_PURGE_TOKEN_SQL = """
+DELETE FROM token WHERE token_id IN
+(SELECT token_id FROM token WHERE created < :created_before LIMIT :limit)
+"""
+
+# Inserts the job or sets its start time if it is due. Changes no rows if it is not due.
+_CLAIM_SQL = """
+INSERT INTO maintenance_job (job, started) VALUES (:job, :now)
+ON CONFLICT (job) DO UPDATE SET started = excluded.started WHERE maintenance_job.started <= :due
+"""
+
+
+async def _delete_in_batches(delete_batch: Callable[[AsyncConnection], Awaitable[int]]) -> int:
+    """
+    Call delete_batch in a new transaction until it deletes less than MAINTENANCE_BATCH_SIZE rows.
+    Returns the number of deleted rows.
+    """
+    num_deleted = 0
+    database_connection = DatabaseConnection(DATABASE)
+    while True:
+        async with database_connection.async_transaction_scope() as connection:
+            num_batch = await delete_batch(connection)
+
+        num_deleted += num_batch
+        if num_batch < MAINTENANCE_BATCH_SIZE:
+            return num_deleted
+
+
+async def purge() -> dict:
+    """
+    Delete expired rows. Returns the number of deleted rows per table.
+    """
+    user_token_values = {"now": int(time.time()), "limit": MAINTENANCE_BATCH_SIZE}
+
+    # Tokens are created with arrow and compared as strings
+    created_before = arrow.utcnow().shift(minutes=-token_model.EXPIRE_TIME_IN_MINUTES)
+    token_values = {"created_before": created_before.format("YYYY-MM-DD HH:mm:ss"), "limit": MAINTENANCE_BATCH_SIZE}
+
+    return {
+        "user_token": await _delete_in_batches(lambda connection: connection.execute(_PURGE_USER_TOKEN_SQL, user_token_values)),
+        "token": await _delete_in_batches(lambda connection: connection.execute(_PURGE_TOKEN_SQL, token_values)),
+        "cache": await _delete_in_batches(lambda connection: DatabaseCache(connection).sweep(MAINTENANCE_BATCH_SIZE)),
+    }
+
+
+def _wal_size() -> int:
+    wal_path = f"{DATABASE}-wal"
+    return os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+
+
+async def checkpoint() -> dict:
+    """
+    Checkpoint the WAL and truncate it. The WAL is only truncated if no reader is using it.
+    Returns busy (1 if the checkpoint could not complete) and the size of the WAL file.
+    """
+    async with connection_pool.get_pool(DATABASE).autocommit() as connection:
+        wal_size_before = _wal_size()
+        row = await connection.fetchone("PRAGMA wal_checkpoint(TRUNCATE)")
+    return {"busy": row[0], "wal_size_before": wal_size_before, "wal_size_after": _wal_size()}
+
+
+async def optimize() -> dict:
+    await connection_pool.get_pool(DATABASE).optimize()
+    return {}
+
+
+def _incremental_vacuum(connection: sqlite3.Connection, pages: int) -> None:
+    # execute() only runs the first step of the pragma, which frees one page
+    connection.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+
+
+async def incremental_vacuum() -> dict:
+    """
+    Free up to MAINTENANCE_VACUUM_PAGES unused pages. Returns the number of freed pages.
+    """
+    if not MAINTENANCE_VACUUM_PAGES:
+        return {"freed_pages": 0}
+
+    async with connection_pool.get_pool(DATABASE).autocommit() as connection:
+        auto_vacuum = await connection.fetchone("PRAGMA auto_vacuum")
+        if auto_vacuum[0] != 2:
+            logger.warning("auto_vacuum is not INCREMENTAL. Run `ollama-client maintenance --enable-incremental-vacuum`")
+            return {"freed_pages": 0}
+
+        freelist_before = await connection.fetchone("PRAGMA freelist_count")
+
+        await connection.run(_incremental_vacuum, MAINTENANCE_VACUUM_PAGES)
+        freelist_after = await connection.fetchone("PRAGMA freelist_count")
+
+    return {"freed_pages": freelist_before[0] - freelist_after[0]}
+
+
+async def enable_incremental_vacuum() -> None:
+    """
+    Set auto_vacuum to INCREMENTAL. This rebuilds the database with VACUUM.
+    """
+    async with connection_pool.get_pool(DATABASE).autocommit() as connection:
+        await connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await connection.execute("VACUUM")
+
+
+JOBS: dict[str, Callable[[], Awaitable[dict]]] = {
+    "purge": purge,
+    "checkpoint": checkpoint,
+    "optimize": optimize,
+    "vacuum": incremental_vacuum,
+}
+
+
+async def _claim(job: str, interval: int) -> bool:
+    """
+    Claim a job if it was started more than interval seconds ago
+    """
+    now = int(time.time())
+    database_connection = DatabaseConnection(DATABASE)
+    async with database_connection.async_transaction_scope() as connection:
+        return await connection.execute(_CLAIM_SQL, {"job": job, "now": now, "due": now - interval}) == 1
+
+
+async def run_job(job: str) -> dict:
+    started = time.monotonic()
+    result = await JOBS[job]()
+    logger.info(f"Maintenance job {job} done in {time.monotonic() - started:.2f}s: {result}")
+    return result
+
+
+async def run_jobs(jobs: list) -> None:
+    """
+    Run jobs now, whether they are due or not
+    """
+    for job in jobs:
+        await _claim(job, 0)
+        await run_job(job)
+
+
+async def run_maintenance() -> None:
+    """
+    Run the due jobs every MAINTENANCE_CHECK_INTERVAL seconds. Started in the lifespan of the app.
+    """
+    while True:
+        await asyncio.sleep(MAINTENANCE_CHECK_INTERVAL)
+        for job, interval in MAINTENANCE_INTERVALS.items():
+            if not interval or job not in JOBS:
+                continue
+
+            try:
+                if await _claim(job, interval):
+                    await run_job(job)
+            except Exception:
+                logger.exception(f"Maintenance job {job} failed")
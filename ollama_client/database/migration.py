@@ -60,9 +60,24 @@ class Migration:
         self.cursor.execute("SELECT 1 FROM migrations WHERE migration_key = ?", (migration_key,))
         return self.cursor.fetchone() is not None
 
+    def _split_statements(self, sql) -> list:
+        # Split on ";" at the end of complete statements only, so triggers are kept whole
+        sql_statements = []
+        statement = ""
+        parts = sql.split(";")
+        for index, part in enumerate(parts):
+            statement += part
+            if index == len(parts) - 1 or sqlite3.complete_statement(statement + ";"):
+                sql_statements.append(statement)
+                statement = ""
+            else:
+                statement += ";"
+
+        return sql_statements
+
     def _apply_migration(self, migration_key, sql):
         # Get all statements from the sql string
-        sql_statements = sql.split(";")
+        sql_statements = self._split_statements(sql)
 
         if not self._has_migration_been_applied(migration_key):
             for statement in sql_statements:
@@ -1,8 +1,73 @@
 """
 SQLBuilder class is used to build SQL queries for CRUD operations.
 Used internally by the CRUD class.
+
+The SQL only depends on the table, the column names and the options, not on the values. It is
+built once per (operation, table, columns) and then served from a cache, which also lets the
+statement cache of sqlite3 reuse the prepared statement.
 """
 
+from functools import lru_cache
+
+SQL_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def _insert_sql(table_name: str, columns: tuple) -> str:
+    columns_part = ", ".join(columns)
+    placeholders = ", ".join([f":{column}" for column in columns])
+    return f"INSERT INTO {table_name} ({columns_part}) VALUES ({placeholders})"
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def _upsert_sql(table_name: str, columns: tuple, conflict_columns: tuple) -> str:
+    update_columns = [column for column in columns if column not in conflict_columns]
+    query = _insert_sql(table_name, columns)
+    query += f" ON CONFLICT ({', '.join(conflict_columns)})"
+    if not update_columns:
+        return query + " DO NOTHING"
+
+    set_clause = ", ".join([f"{column} = excluded.{column}" for column in update_columns])
+    return query + f" DO UPDATE SET {set_clause}"
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def _select_sql(table_name: str, columns: tuple, filter_columns: tuple, order_by: tuple, limit_offset: tuple) -> str:
+    columns_part = ", ".join(columns) if columns else "*"
+    query = f"SELECT {columns_part} FROM {table_name}"
+
+    if filter_columns:
+        where_clause = " AND ".join([f"{key} = :{key}" for key in filter_columns])
+        query += f" WHERE {where_clause}"
+
+    if order_by:
+        order_clause = ", ".join([f"{col} {direction}" for col, direction in order_by])
+        query += f" ORDER BY {order_clause}"
+
+    if limit_offset:
+        limit, offset = limit_offset
+        query += f" LIMIT {limit} OFFSET {offset}"
+
+    return query
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def _update_sql(table_name: str, update_columns: tuple, filter_columns: tuple) -> str:
+    set_clause = ", ".join([f"{key} = :{key}" for key in update_columns])
+    where_clause = " AND ".join([f"{key} = :{key}" for key in filter_columns])
+    return f"UPDATE {table_name} SET {set_clause} WHERE {where_clause}"
+
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def _delete_sql(table_name: str, filter_columns: tuple) -> str:
+    where_clause = " AND ".join([f"{key} = :{key}" for key in filter_columns])
+    return f"DELETE FROM {table_name} WHERE {where_clause}"
+
+
+def clear_cache() -> None:
+    for cached in (_insert_sql, _upsert_sql, _select_sql, _update_sql, _delete_sql):
+        cached.cache_clear()
+
 
 class SQLBuilder:
     def __init__(self, table_name: str = ""):
@@ -14,9 +79,15 @@ class SQLBuilder:
 
     def build_insert(self, insert_values: dict) -> str:
         self.values = insert_values
-        columns = ", ".join(insert_values.keys())
-        placeholders = ", ".join([f":{key}" for key in insert_values.keys()])
-        return f"INSERT INTO {self.table_name} ({columns}) VALUES ({placeholders})"
+        return _insert_sql(self.table_name, tuple(insert_values))
+
+    def build_upsert(self, insert_values: dict, conflict_columns: list) -> str:
+        """
+        Insert a row or update it if it conflicts with a row on conflict_columns.
+        The conflict columns must have a unique index.
+        """
+        self.values = insert_values
+        return _upsert_sql(self.table_name, tuple(insert_values), tuple(conflict_columns))
 
     def build_select(
         self,
@@ -26,34 +97,21 @@ class SQLBuilder:
         limit_offset: tuple = (),
     ) -> str:
         self.values = filters
-
-        columns_part = ", ".join(columns) if columns else "*"
-        query = f"SELECT {columns_part} FROM {self.table_name}"
-
-        if filters:
-            where_clause = " AND ".join([f"{key} = :{key}" for key in filters.keys()])
-            query += f" WHERE {where_clause}"
-
-        if order_by:
-            order_clause = ", ".join([f"{col} {direction}" for col, direction in order_by])
-            query += f" ORDER BY {order_clause}"
-
-        if limit_offset:
-            limit, offset = limit_offset
-            query += f" LIMIT {limit} OFFSET {offset}"
-
-        return query
+        return _select_sql(
+            self.table_name,
+            tuple(columns),
+            tuple(filters),
+            tuple(tuple(order) for order in order_by),
+            tuple(limit_offset),
+        )
 
     def build_update(self, update_values: dict, filters: dict) -> str:
         self.values = {**update_values, **filters}
-        set_clause = ", ".join([f"{key} = :{key}" for key in update_values.keys()])
-        where_clause = " AND ".join([f"{key} = :{key}" for key in filters.keys()])
-        return f"UPDATE {self.table_name} SET {set_clause} WHERE {where_clause}"
+        return _update_sql(self.table_name, tuple(update_values), tuple(filters))
 
     def build_delete(self, filters: dict) -> str:
         self.values = filters
-        where_clause = " AND ".join([f"{key} = :{key}" for key in filters.keys()])
-        return f"DELETE FROM {self.table_name} WHERE {where_clause}"
+        return _delete_sql(self.table_name, tuple(filters))
 
     def get_execute_values(self):
         return self.values
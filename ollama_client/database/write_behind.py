@@ -0,0 +1,167 @@
+"""
+Write-behind queue for inserts the request does not need to wait for.
+
+Rows are put in an in-memory queue, and a writer task inserts them in group commits: all rows
+queued while the previous commit was running are written in one transaction. A burst of chat
+streams finishing at the same time then takes the SQLite write lock once instead of once per
+stream. Rows are written in the order they are queued.
+
+Usage:
+
+```
+from ollama_client.database import write_behind
+
+write_behind.insert("message", {"dialog_id": dialog_id, "role": "user", ...})  # returns at once
+await write_behind.flush()  # wait until all queued rows are committed
+```
+
+Reads that must see the queued rows call flush() first. after_insert() registers a function that
+is called in the transaction that inserts rows into a table, e.g. to index them. The writer task
+is started on first use and close() in the lifespan of the app writes the remaining rows. Queued
+rows are lost if the worker is killed before they are written.
+"""
+
+import asyncio
+import logging
+from itertools import groupby
+from typing import Awaitable, Callable
+import config
+from config import DATABASE
+from ollama_client.database.crud import CRUD
+from ollama_client.database.connection_pool import AsyncConnection
+from ollama_client.database.database_utils import DatabaseConnection
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Max number of rows in one commit
+WRITE_BEHIND_MAX_BATCH = getattr(config, "WRITE_BEHIND_MAX_BATCH", 500)
+
+# Seconds the writer waits for more rows before a commit
+WRITE_BEHIND_DELAY = getattr(config, "WRITE_BEHIND_DELAY", 0.01)
+
+
+class WriteBehindQueue:
+    def __init__(self, database_url, max_batch: int = 500, delay: float = 0.0):
+        self.database_url = database_url
+        self.max_batch = max_batch
+        self.delay = delay
+
+        # Number of rows queued but not yet written
+        self.pending = 0
+
+        # The queue and the writer task belong to the event loop they are created in
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.queue: asyncio.Queue | None = None
+        self.task: asyncio.Task | None = None
+
+        # Called with the connection and the number of inserted rows after rows are inserted into a table
+        self.after_insert: dict[str, Callable[[AsyncConnection, int], Awaitable[None]]] = {}
+
+    def _ensure_writer(self) -> asyncio.Queue:
+        """
+        Get the queue of the running loop and start the writer if it is not running
+        """
+        loop = asyncio.get_running_loop()
+        if self.queue is None or self.loop is not loop:
+            self.loop = loop
+            self.queue = asyncio.Queue()
+            self.task = None
+            self.pending = 0
+
+        if self.task is None or self.task.done():
+            self.task = loop.create_task(self._run(self.queue))
+        return self.queue
+
+    def insert(self, table: str, insert_values: dict) -> None:
+        """
+        Queue a row to be inserted into a table
+        """
+        queue = self._ensure_writer()
+        self.pending += 1
+        queue.put_nowait((table, insert_values))
+
+    async def flush(self) -> None:
+        """
+        Wait until all rows queued before the call are committed (or have failed)
+        """
+        if not self.pending:
+            return
+
+        queue = self._ensure_writer()
+        done = asyncio.get_running_loop().create_future()
+        queue.put_nowait(done)
+        await asyncio.shield(done)
+
+    async def close(self) -> None:
+        """
+        Write the remaining rows and stop the writer
+        """
+        if self.task is None or self.loop is not asyncio.get_running_loop():
+            return
+
+        await self.flush()
+        self.task.cancel()
+        self.task = None
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        while True:
+            batch = [await queue.get()]
+            if self.delay:
+                await asyncio.sleep(self.delay)
+
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            rows = [item for item in batch if not isinstance(item, asyncio.Future)]
+            if rows:
+                await self._write(rows)
+                self.pending -= len(rows)
+
+            for item in batch:
+                if isinstance(item, asyncio.Future) and not item.done():
+                    item.set_result(True)
+
+    async def _write(self, rows: list) -> None:
+        database_connection = DatabaseConnection(self.database_url)
+        try:
+            async with database_connection.async_transaction_scope() as connection:
+                for table, table_rows in groupby(rows, key=lambda row: row[0]):
+                    await self._insert(connection, table, [insert_values for _, insert_values in table_rows])
+
+            logger.debug(f"Wrote {len(rows)} rows in one commit")
+            return
+        except Exception:
+            logger.exception(f"Error writing {len(rows)} rows. Writing the rows one by one")
+
+        # Write the rows one by one, so one bad row does not lose the others
+        for table, insert_values in rows:
+            try:
+                async with database_connection.async_transaction_scope() as connection:
+                    await self._insert(connection, table, [insert_values])
+            except Exception:
+                logger.exception(f"Error writing row to table: {table}")
+
+    async def _insert(self, connection: AsyncConnection, table: str, rows: list) -> None:
+        await CRUD(connection).insert_many(table, rows)
+        if table in self.after_insert:
+            await self.after_insert[table](connection, len(rows))
+
+
+_write_behind_queue = WriteBehindQueue(DATABASE, WRITE_BEHIND_MAX_BATCH, WRITE_BEHIND_DELAY)
+
+
+def after_insert(table: str, function: Callable[[AsyncConnection, int], Awaitable[None]]) -> None:
+    _write_behind_queue.after_insert[table] = function
+
+
+def insert(table: str, insert_values: dict) -> None:
+    _write_behind_queue.insert(table, insert_values)
+
+
+async def flush() -> None:
+    await _write_behind_queue.flush()
+
+
+async def close() -> None:
+    await _write_behind_queue.close()
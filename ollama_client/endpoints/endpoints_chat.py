@@ -2,17 +2,27 @@ from starlette.requests import Request
 from starlette.routing import Route
 from starlette.responses import StreamingResponse, JSONResponse, RedirectResponse
 
-from openai import OpenAI
 from openai import OpenAIError
-import json
+import anyio
+import asyncio
+import time
 from ollama_client.core import base_context
 from ollama_client.core import flash
 import config
 import logging
 from ollama_client.core import session
+from ollama_client.core import providers
+from ollama_client.core import token_budget
+from ollama_client.core import sse
+from ollama_client.core import admission
+from ollama_client.core import model_discovery
+from ollama_client.core import model_warmup
+from ollama_client.core import stream_buffer
+from ollama_client.core import metrics
 from ollama_client.core.templates import get_templates
-from ollama_client.models import chat_model, user_model
+from ollama_client.models import chat_model, user_model, search_model, export_model
 from ollama_client.core.exceptions import UserValidate
+from ollama_client.tools import tool_runner
 
 # Logger
 logger: logging.Logger = logging.getLogger(__name__)
@@ -22,13 +32,21 @@ templates = get_templates()
 API_BASE_URL = getattr(config, "API_BASE_URL", "")
 API_KEY = getattr(config, "API_KEY", "")
 
-MODELS = getattr(config, "MODELS", {})
 PROVIDERS = getattr(config, "PROVIDERS", {})
 
-TOOL_REGISTRY = getattr(config, "TOOL_REGISTRY", {})
 TOOLS = getattr(config, "TOOLS", [])
 TOOL_MODELS = getattr(config, "TOOL_MODELS", [])
 
+# Max number of rounds of tool calls in a single chat response
+MAX_TOOL_ROUNDS = getattr(config, "MAX_TOOL_ROUNDS", 5)
+
+# Coalescing of content deltas in the compact stream format. An interval of 0 sends every delta
+STREAM_COALESCE_INTERVAL = getattr(config, "STREAM_COALESCE_INTERVAL", 0.03)
+STREAM_COALESCE_MAX_CHARS = getattr(config, "STREAM_COALESCE_MAX_CHARS", 1024)
+
+# Seconds between queue position updates while waiting for a model
+QUEUE_STATUS_INTERVAL = 1.0
+
 
 async def chat_page(request: Request):
     """
@@ -53,21 +71,79 @@ async def chat_page(request: Request):
     return templates.TemplateResponse("home/chat.html", context)
 
 
-def _execute_tool(tool_call):
+def _accumulate_tool_calls(tool_calls: dict, deltas: list) -> None:
+    """
+    Add streamed tool call deltas to tool_calls, which is keyed by the index of the call
     """
-    Execute a tool call
+    for position, call in enumerate(deltas):
+        index = call.index if call.index is not None else position
+        if index not in tool_calls:
+            tool_calls[index] = {
+                "id": call.id or f"call_{index}",
+                "type": call.type or "function",
+                "function": {"name": "", "arguments": ""},
+            }
+
+        tool_call = tool_calls[index]
+        if call.function and call.function.name:
+            tool_call["function"]["name"] += call.function.name
+        if call.function and call.function.arguments:
+            tool_call["function"]["arguments"] += call.function.arguments
+
+
+async def _close_response(response) -> None:
     """
-    func_name = tool_call["function"]["name"]
-    args = json.loads(tool_call["function"]["arguments"])
-    logger.info(f"Executing tool: {func_name}({args})")
+    Close an upstream response. This closes the HTTP connection so the provider stops generating.
+    Shielded so it also runs when the stream is being cancelled.
+    """
+    if response is None:
+        return
+
+    with anyio.CancelScope(shield=True):
+        await response.close()
+
+
+def _record_metrics(model_label: str, provider: str, stream_state: dict) -> None:
+    """
+    Record the metrics of a finished chat stream
+    """
+    metrics.chat_requests_total.inc(model=model_label, provider=provider, status=stream_state["status"])
+    if not stream_state["admitted"]:
+        return
+
+    metrics.chat_streams_in_flight.dec(model=model_label)
+
+    now = time.monotonic()
+    metrics.chat_duration_seconds.observe(now - stream_state["admitted"], model=model_label, provider=provider)
+    metrics.chat_output_tokens_total.inc(stream_state["tokens"], model=model_label, provider=provider)
+
+    generation_time = now - stream_state["first_token"]
+    if stream_state["tokens"] > 1 and generation_time > 0:
+        tokens_per_second = (stream_state["tokens"] - 1) / generation_time
+        metrics.chat_tokens_per_second.observe(tokens_per_second, model=model_label, provider=provider)
 
-    if func_name in TOOL_REGISTRY:
-        return TOOL_REGISTRY[func_name](**args)
-    else:
-        return f"Unknown tool: {func_name}"
 
+def _log_cancelled(model: str, stream_state: dict, reason: str) -> None:
+    elapsed = time.monotonic() - stream_state["started"]
+    logger.info(f"Chat stream cancelled: model={model} reason={reason} elapsed={elapsed:.2f}s chunks={stream_state['chunks']}")
 
-async def _chat_response_stream(messages, model, logged_in):
+
+def _save_assistant_reply(logged_in: int, dialog_id: str, content: str) -> None:
+    """
+    Save the assistant reply when the dialog history is kept on the server.
+    The reply is queued without awaiting, so a partial reply is also saved when the stream is aborted.
+    """
+    try:
+        chat_model.add_dialog_message(logged_in, dialog_id, "assistant", content)
+    except Exception:
+        logger.exception("Error saving assistant reply")
+
+
+async def _prepare_messages(messages: list, model: str, logged_in: int) -> tuple[list, int]:
+    """
+    Add the system message from the user profile and fit the messages into the context budget
+    of the model. Returns the messages to send and the estimated number of prompt tokens.
+    """
     profile = await user_model.get_profile(logged_in)
     if "system_message" in profile and profile["system_message"]:
         system_message = profile["system_message"]
@@ -79,88 +155,171 @@ async def _chat_response_stream(messages, model, logged_in):
         }
         messages.insert(0, system_message_dict)
 
-    try:
-
-        provider = MODELS.get(model)
-        provider_info = PROVIDERS.get(provider)
+    return _shape_messages(messages, model)
 
-        client = OpenAI(
-            api_key=provider_info["api_key"],
-            base_url=provider_info["base_url"],
-        )
 
-        chat_args = {
-            "model": model,
-            "messages": messages,
-            "stream": True,
-        }
+def _shape_messages(messages: list, model: str) -> tuple[list, int]:
+    """
+    Fit the messages into the context budget of the model. Returns the messages to send and the
+    estimated number of prompt tokens.
+    """
+    context_budget = providers.get_context_budget(model)
+    if not context_budget:
+        return messages, token_budget.estimate_messages_tokens(messages)
+
+    shaped_messages, prompt_tokens = token_budget.shape_messages(messages, context_budget)
+    if len(shaped_messages) != len(messages) or prompt_tokens > context_budget:
+        logger.info(f"Shaped messages for {model}: {len(messages)} -> {len(shaped_messages)} messages, {prompt_tokens} tokens")
+
+    return shaped_messages, prompt_tokens
+
+
+async def _chat_response_stream(
+    messages,
+    model,
+    logged_in,
+    ticket: admission.Ticket,
+    dialog_id=None,
+    stream_format="verbose",
+):
+    stream_state: dict = {"started": time.monotonic(), "admitted": 0.0, "first_token": 0.0, "chunks": 0, "tokens": 0, "status": "ok"}
+    provider = providers.get_model_provider(model)
+    model_label = metrics.model_label(model)
+    response = None
+    reply_parts: list = []
+    encoder = sse.get_encoder(stream_format, STREAM_COALESCE_INTERVAL, STREAM_COALESCE_MAX_CHARS)
 
-        if model in TOOL_MODELS:
-            chat_args["tools"] = TOOLS
-
-        response = client.chat.completions.create(**chat_args)
-        tool_call: dict = {}
-        for chunk in response:
-            delta = chunk.choices[0].delta
-
-            # Accumulate tool call
-            if delta.tool_calls:
-                call = delta.tool_calls[0]
-                if not tool_call:
-                    tool_call = {
-                        "id": call.id,
-                        "type": call.type,
-                        "function": {"name": "", "arguments": ""},
-                    }
+    try:
 
-                if call.function and call.function.name:
-                    tool_call["function"]["name"] += call.function.name
-                if call.function and call.function.arguments:
-                    tool_call["function"]["arguments"] += call.function.arguments
+        # Wait for a free slot on the model and send the position in the queue meanwhile
+        queue_position = 0
+        while not ticket.admitted:
+            if ticket.position() != queue_position:
+                queue_position = ticket.position()
+                yield encoder.encode_status(queue_position)
 
-            # If assistant finishes with a tool call, break
-            if chunk.choices[0].finish_reason == "tool_calls":
+            if await ticket.wait(QUEUE_STATUS_INTERVAL):
                 break
 
-            model_dict = chunk.model_dump()
-            json_chunk = json.dumps(model_dict)
-            yield f"data: {json_chunk}\n\n"
-
-        if tool_call:
-            result = _execute_tool(tool_call)
+        stream_state["admitted"] = time.monotonic()
+        metrics.chat_queue_wait_seconds.observe(stream_state["admitted"] - stream_state["started"], model=model_label)
+        metrics.chat_streams_in_flight.inc(model=model_label)
+
+        warm = model_warmup.is_warm(model)
+        model_warmup.mark_used(model)
+
+        # Each round streams a response. If the model calls tools, the tools are executed
+        # and the results are sent back in a new round. In the last round tools are not offered.
+        for tool_round in range(MAX_TOOL_ROUNDS + 1):
+            # The tool calls and results of earlier rounds must fit the context budget as well
+            round_messages = messages
+            if tool_round > 0:
+                round_messages, _ = _shape_messages(messages, model)
+
+            chat_args = {
+                "model": model,
+                "messages": round_messages,
+                "stream": True,
+            }
+
+            if model in TOOL_MODELS and tool_round < MAX_TOOL_ROUNDS:
+                chat_args["tools"] = TOOLS
+
+            # Fails over to another endpoint of the provider if no chunk has been received
+            request_started = time.monotonic()
+            response = await providers.stream_chat_completion(provider, chat_args)
+            if tool_round == 0:
+                ttft = time.monotonic() - request_started
+                model_warmup.record_ttft(model, ttft, warm)
+                metrics.chat_ttft_seconds.observe(ttft, model=model_label, provider=provider)
+
+            tool_calls: dict = {}
+            async for chunk in sse.with_flushes(response, encoder):
+                if chunk is None:
+                    # The model paused while content was buffered
+                    frame = encoder.flush()
+                    if frame:
+                        yield frame
+                    continue
+
+                stream_state["chunks"] += 1
+                if not chunk.choices:
+                    continue
+
+                delta = chunk.choices[0].delta
+
+                # Accumulate tool calls by index. Arguments may be split over many chunks
+                if delta.tool_calls:
+                    _accumulate_tool_calls(tool_calls, delta.tool_calls)
+                    if not delta.content:
+                        continue
+
+                # If assistant finishes with tool calls, break
+                if chunk.choices[0].finish_reason and tool_calls:
+                    break
+
+                if delta.content:
+                    reply_parts.append(delta.content)
+                    stream_state["tokens"] += 1
+                    if not stream_state["first_token"]:
+                        stream_state["first_token"] = time.monotonic()
+
+                frame = encoder.encode_chunk(chunk)
+                if frame:
+                    yield frame
+
+            await _close_response(response)
+            response = None
+
+            frame = encoder.flush()
+            if frame:
+                yield frame
+
+            if not tool_calls:
+                break
 
-            # Append assistant tool call and tool response
-            messages.append(
-                {"role": "assistant", "tool_calls": [tool_call]},
-            )
+            calls = [tool_calls[index] for index in sorted(tool_calls)]
+            results = await tool_runner.run_tool_calls(calls)
 
+            # Append assistant tool calls and tool responses
             messages.append(
-                {
-                    "role": "tool",
-                    "tool_call_id": tool_call["id"],
-                    "content": result,
-                }
+                {"role": "assistant", "tool_calls": calls},
             )
 
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                stream=True,
-            )
+            for call, result in zip(calls, results):
+                messages.append(
+                    {
+                        "role": "tool",
+                        "tool_call_id": call["id"],
+                        "content": result,
+                    }
+                )
 
-            for chunk in response:
-                model_dict = chunk.model_dump()
-                json_chunk = json.dumps(model_dict)
-                yield f"data: {json_chunk}\n\n"
+    except (asyncio.CancelledError, GeneratorExit):
+        # The stream is cancelled when no client is attached or the user aborts it
+        stream_state["status"] = "cancelled"
+        _log_cancelled(model, stream_state, "cancelled")
+        raise
 
     except OpenAIError as e:
         # json_error = json.dumps(e)
         logger.exception(f"OpenAI error")
-        yield json.dumps({"error": "An error occured. Please try again later"})
+        stream_state["status"] = "error"
+        yield encoder.encode_error("An error occured. Please try again later")
 
     except Exception:
         logger.exception("Streaming error")
-        yield json.dumps({"error": "Streaming failed"})
+        stream_state["status"] = "error"
+        yield encoder.encode_error("Streaming failed")
+
+    finally:
+        await _close_response(response)
+        _record_metrics(model_label, provider, stream_state)
+        ticket.release()
+        if ticket.admitted:
+            model_warmup.mark_used(model)
+        if dialog_id and reply_parts:
+            _save_assistant_reply(logged_in, dialog_id, "".join(reply_parts))
 
 
 async def chat_response_stream(request: Request):
@@ -169,14 +328,115 @@ async def chat_response_stream(request: Request):
         return JSONResponse({"error": True, "message": "You must be logged in to use the chat"}, status_code=401)
 
     data = await request.json()
-    messages = data["messages"]
-    model = data["model"]
+    model = data.get("model")
+
+    # The model is used as a key of per-model state, so unknown names are rejected before they are stored
+    if model not in await _get_model_names():
+        return JSONResponse({"error": True, "message": f"Unknown model: {model}"}, status_code=400)
+
+    stream_format = data.get("stream_format", "verbose")
+    if stream_format not in sse.STREAM_FORMATS:
+        return JSONResponse({"error": True, "message": f"Unknown stream format: {stream_format}"}, status_code=400)
+
+    # Either the full list of messages is posted, or the dialog_id and only the new user message.
+    # In the latter case the history is read from the database and the reply is saved by the server.
+    dialog_id = data.get("dialog_id")
+    message = data.get("message")
+    if dialog_id and not (isinstance(message, dict) and isinstance(message.get("content"), str)):
+        return JSONResponse({"error": True, "message": "Invalid message"}, status_code=400)
+    if not dialog_id and not isinstance(data.get("messages"), list):
+        return JSONResponse({"error": True, "message": "Invalid messages"}, status_code=400)
+
+    try:
+        stream_buffer.check_running(logged_in)
+    except stream_buffer.TooManyStreams as e:
+        return JSONResponse({"error": True, "message": str(e)}, status_code=429)
+
+    # Get a place in the queue of the model. The ticket is released when the stream ends
+    try:
+        ticket = admission.get_controller(model).enqueue(logged_in)
+    except admission.QueueFull as e:
+        return JSONResponse({"error": True, "message": str(e)}, status_code=503)
+
+    try:
+        if dialog_id:
+            try:
+                messages = await chat_model.get_dialog_history(logged_in, dialog_id)
+            except UserValidate as e:
+                ticket.release()
+                return JSONResponse({"error": True, "message": str(e)}, status_code=400)
+
+            content = message["content"]
+            chat_model.add_dialog_message(logged_in, dialog_id, "user", content)
+            messages.append({"role": "user", "content": content})
+        else:
+            messages = data["messages"]
+
+        messages, prompt_tokens = await _prepare_messages(messages, model, logged_in)
+        logger.debug(f"Prompt tokens for {model}: {prompt_tokens}")
+    except BaseException:
+        ticket.release()
+        raise
+
+    # The response is generated in a task, so the client can reconnect and resume the stream.
+    # The ticket is also released by the task if it is cancelled before the stream has started
+    try:
+        buffer = stream_buffer.create(logged_in)
+    except stream_buffer.TooManyStreams as e:
+        ticket.release()
+        return JSONResponse({"error": True, "message": str(e)}, status_code=429)
+
+    buffer.start(_chat_response_stream(messages, model, logged_in, ticket, dialog_id, stream_format), on_finish=ticket.release)
+
     return StreamingResponse(
-        _chat_response_stream(messages, model, logged_in),
+        buffer.tail(),
         media_type="text/event-stream",
+        headers={"X-Prompt-Tokens": str(prompt_tokens), "X-Stream-ID": buffer.stream_id},
     )
 
 
+async def resume_stream(request: Request):
+    """
+    Resume a chat stream. Frames after the Last-Event-ID header are replayed, followed by the live stream.
+    """
+    logged_in = await session.is_logged_in(request)
+    if not logged_in:
+        return JSONResponse({"error": True, "message": "You must be logged in to use the chat"}, status_code=401)
+
+    buffer = stream_buffer.get(request.path_params["stream_id"], logged_in)
+    if not buffer:
+        return JSONResponse({"error": True, "message": "The stream can not be resumed"}, status_code=404)
+
+    try:
+        last_event_id = int(request.headers.get("last-event-id", 0))
+    except ValueError:
+        last_event_id = -1
+
+    if not 0 <= last_event_id <= buffer.num_frames:
+        return JSONResponse({"error": True, "message": "Invalid Last-Event-ID"}, status_code=400)
+
+    if last_event_id < buffer.dropped:
+        return JSONResponse({"error": True, "message": "The stream can not be resumed"}, status_code=404)
+
+    return StreamingResponse(buffer.tail(last_event_id), media_type="text/event-stream")
+
+
+async def cancel_stream(request: Request):
+    """
+    Cancel a chat stream, e.g. when the user aborts it
+    """
+    logged_in = await session.is_logged_in(request)
+    if not logged_in:
+        return JSONResponse({"error": True, "message": "You must be logged in to use the chat"}, status_code=401)
+
+    buffer = stream_buffer.get(request.path_params["stream_id"], logged_in)
+    if not buffer:
+        return JSONResponse({"error": True, "message": "Stream not found"}, status_code=404)
+
+    buffer.cancel()
+    return JSONResponse({"error": False})
+
+
 async def config_(request: Request):
     """
     Get frontend configuration
@@ -229,12 +489,10 @@ async def json_tools(request: Request):
 
 
 async def _get_model_names():
-
-    models = []
-    for model_name in MODELS.keys():
-        models.append(model_name)
-
-    return models
+    """
+    Get the configured and discovered model names. These are served from memory.
+    """
+    return model_discovery.get_model_names()
 
 
 async def list_models(request: Request):
@@ -243,6 +501,17 @@ async def list_models(request: Request):
     return JSONResponse({"model_names": model_names})
 
 
+async def model_stats(request: Request):
+    """
+    Get the cold and warm time to first token of the models in this worker
+    """
+    logged_in = await session.is_logged_in(request)
+    if not logged_in:
+        return JSONResponse({"error": True, "message": "You must be logged in"}, status_code=401)
+
+    return JSONResponse({"error": False, "models": model_warmup.get_stats()})
+
+
 async def create_dialog(request: Request):
     """
     Save dialog to database
@@ -287,11 +556,11 @@ async def get_dialog(request: Request):
 
 async def get_messages(request: Request):
     """
-    Get messages from database
+    Get a page of messages from database
     """
     try:
-        messages = await chat_model.get_messages(request)
-        return JSONResponse(messages)
+        page = await chat_model.get_messages(request)
+        return JSONResponse({"error": False, **page})
     except UserValidate as e:
         return JSONResponse({"error": True, "message": str(e)})
     except Exception:
@@ -299,6 +568,50 @@ async def get_messages(request: Request):
         return JSONResponse({"error": True, "message": "Error getting messages"})
 
 
+async def search(request: Request):
+    """
+    Search dialogs and messages. Returns a page of dialogs ranked by relevance
+    """
+    try:
+        search_results = await search_model.search_dialogs(request)
+        return JSONResponse({"error": False, **search_results})
+    except UserValidate as e:
+        return JSONResponse({"error": True, "message": str(e)})
+    except Exception:
+        logger.exception("Error searching dialogs")
+        return JSONResponse({"error": True, "message": "Error searching dialogs"})
+
+
+async def export_dialogs(request: Request):
+    """
+    Download the dialogs and messages of the user as NDJSON
+    """
+    user_id = await session.is_logged_in(request)
+    if not user_id:
+        return JSONResponse({"error": True, "message": "You must be logged in to export dialogs"}, status_code=401)
+
+    headers = {"Content-Disposition": 'attachment; filename="dialogs.ndjson"'}
+    return StreamingResponse(export_model.export_dialogs(user_id), media_type="application/x-ndjson", headers=headers)
+
+
+async def import_dialogs(request: Request):
+    """
+    Import dialogs and messages to the user from an NDJSON body made with the export. The body is
+    imported in batches while it is received. Existing dialogs are skipped.
+    """
+    user_id = await session.is_logged_in(request)
+    if not user_id:
+        return JSONResponse({"error": True, "message": "You must be logged in to import dialogs"}, status_code=401)
+
+    try:
+        result = await export_model.import_dialogs(user_id, export_model.read_lines(request.stream()))
+    except ValueError as e:
+        return JSONResponse({"error": True, "message": str(e)}, status_code=400)
+
+    flash.set_success(request, f"Imported {result['dialogs']} dialogs. Skipped {result['skipped_dialogs']} dialogs that already exist")
+    return JSONResponse({"error": False, "redirect": "/user/dialogs", **result})
+
+
 async def delete_dialog(request: Request):
     """
     Delete dialog from database
@@ -316,11 +629,17 @@ async def delete_dialog(request: Request):
 
 routes_chat: list = [
     Route("/", chat_page),
+    Route("/chat/search", search, methods=["GET"]),
+    Route("/chat/export", export_dialogs, methods=["GET"]),
+    Route("/chat/import", import_dialogs, methods=["POST"]),
     Route("/chat/{dialog_id:str}", chat_page),
     Route("/chat", chat_response_stream, methods=["POST"]),
+    Route("/chat/stream/{stream_id:str}", resume_stream, methods=["GET"]),
+    Route("/chat/stream/{stream_id:str}/cancel", cancel_stream, methods=["POST"]),
     Route("/tools/{tool:str}", json_tools, methods=["POST"]),
     Route("/config", config_),
     Route("/list", list_models, methods=["GET"]),
+    Route("/model-stats", model_stats, methods=["GET"]),
     Route("/chat/create-dialog", create_dialog, methods=["POST"]),
     Route("/chat/create-message/{dialog_id}", create_message, methods=["POST"]),
     Route("/chat/delete-dialog/{dialog_id}", delete_dialog, methods=["POST"]),
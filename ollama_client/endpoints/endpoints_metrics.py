@@ -0,0 +1,28 @@
+"""
+Metrics endpoint.
+"""
+
+import secrets
+from starlette.requests import Request
+from starlette.routing import Route
+from starlette.responses import PlainTextResponse
+from ollama_client.core import metrics
+
+
+async def metrics_get(request: Request):
+    """
+    Metrics of all workers in the Prometheus text format. Not served if METRICS_TOKEN is not set.
+    """
+    if not metrics.METRICS_TOKEN:
+        return PlainTextResponse("Not Found\n", status_code=404)
+
+    authorization = request.headers.get("authorization", "")
+    if not secrets.compare_digest(authorization, f"Bearer {metrics.METRICS_TOKEN}"):
+        return PlainTextResponse("Unauthorized\n", status_code=401)
+
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+routes_metrics: list = [
+    Route("/metrics", metrics_get, methods=["GET"]),
+]
@@ -7,7 +7,7 @@ import random
 from captcha.image import ImageCaptcha
 import string
 import io
-from ollama_client.models import user_model, chat_model
+from ollama_client.models import user_model, chat_model, search_model
 from ollama_client.core import flash
 from ollama_client.core.exceptions import UserValidate
 from ollama_client.core import session
@@ -193,14 +193,21 @@ async def new_password_post(request: Request):
 
 async def list_dialogs(request: Request):
     """
-    List dialogs from database
+    List dialogs from database. With the query param "q" the dialogs are searched
     """
 
-    dialogs_info = await chat_model.get_dialogs_info(request)
+    if request.query_params.get("q"):
+        search_results = await search_model.search_dialogs(request)
+        dialogs_info = {}
+    else:
+        search_results = {}
+        dialogs_info = await chat_model.get_dialogs_info(request)
+
     context = {
         "request": request,
         "title": "Search dialogs",
         "dialogs_info": dialogs_info,
+        "search_results": search_results,
     }
 
     context = await get_context(request, context)
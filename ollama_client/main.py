@@ -1,9 +1,11 @@
+import asyncio
 from contextlib import asynccontextmanager
 from starlette.applications import Starlette
 from starlette.routing import Mount
 from ollama_client.endpoints.endpoints_chat import routes_chat
 from ollama_client.endpoints.endpoints_user import routes_user
 from ollama_client.endpoints.endpoints_error import routes_error
+from ollama_client.endpoints.endpoints_metrics import routes_metrics
 from ollama_client.core.exceptions import exception_callbacks
 from ollama_client.core.middleware import middleware
 import logging
@@ -11,6 +13,9 @@ from ollama_client import __version__, __program__
 import config
 from ollama_client.core.templates import get_static_files
 from ollama_client.core.logging import setup_logging
+from ollama_client.core import providers, model_discovery, model_warmup, stream_buffer, metrics
+from ollama_client.tools import tool_runner
+from ollama_client.database import write_behind, connection_pool, maintenance
 
 # Setup logging
 log_level = config.LOG_LEVEL
@@ -25,7 +30,22 @@ static_files = get_static_files()
 @asynccontextmanager
 async def lifespan(app):
     logger.info("Accepting incoming requests")
+    health_check_task = asyncio.create_task(providers.run_health_checks())
+    model_discovery_task = asyncio.create_task(model_discovery.run_model_discovery())
+    keep_warm_task = asyncio.create_task(model_warmup.run_keep_warm())
+    metrics_task = asyncio.create_task(metrics.run_flush())
+    maintenance_task = asyncio.create_task(maintenance.run_maintenance())
     yield
+    maintenance_task.cancel()
+    health_check_task.cancel()
+    model_discovery_task.cancel()
+    keep_warm_task.cancel()
+    await stream_buffer.cancel_all()
+    await write_behind.close()
+    await connection_pool.close()
+    metrics_task.cancel()
+    await providers.close_clients()
+    tool_runner.shutdown()
     logger.info("End of lifespan")
 
 
@@ -36,6 +56,7 @@ all_routes = [
 all_routes.extend(routes_user)
 all_routes.extend(routes_chat)
 all_routes.extend(routes_error)
+all_routes.extend(routes_metrics)
 
 app = Starlette(
     debug=False,
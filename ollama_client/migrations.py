@@ -93,7 +93,196 @@ CREATE INDEX message_user_id ON message(user_id);
 
 """
 
+# The foreign keys of the base install reference user(id), a table that does not exist. They
+# failed every insert when foreign keys were enforced. The tables are rebuilt with foreign keys
+# referencing users(user_id). Rows pointing at missing users or dialogs are removed first.
+fix_foreign_keys = """
+DELETE FROM message WHERE dialog_id NOT IN (SELECT dialog_id FROM dialog);
+DELETE FROM message WHERE user_id NOT IN (SELECT user_id FROM users);
+DELETE FROM dialog WHERE user_id NOT IN (SELECT user_id FROM users);
+DELETE FROM user_token WHERE user_id NOT IN (SELECT user_id FROM users);
+DELETE FROM acl WHERE user_id NOT IN (SELECT user_id FROM users);
+
+CREATE TABLE user_token_new (
+  user_token_id INTEGER PRIMARY KEY,
+  token TEXT NOT NULL,
+  user_id INTEGER NOT NULL,
+  last_login TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP),
+  expires INTEGER DEFAULT 0,
+  FOREIGN KEY (user_id) REFERENCES users(user_id)
+) STRICT;
+INSERT INTO user_token_new SELECT * FROM user_token;
+DROP TABLE user_token;
+ALTER TABLE user_token_new RENAME TO user_token;
+CREATE INDEX idx_user_token_user_id ON user_token(user_id);
+CREATE INDEX idx_user_token_token ON user_token(token);
+
+CREATE TABLE acl_new (
+  acl_id INTEGER PRIMARY KEY,
+  role TEXT NOT NULL,
+  user_id INTEGER NOT NULL,
+  entity_id INTEGER DEFAULT NULL,
+  FOREIGN KEY (user_id) REFERENCES users(user_id)
+) STRICT;
+INSERT INTO acl_new SELECT * FROM acl;
+DROP TABLE acl;
+ALTER TABLE acl_new RENAME TO acl;
+CREATE INDEX idx_acl_user_id ON acl(user_id);
+CREATE INDEX idx_acl_role ON acl(role);
+CREATE INDEX idx_acl_entity_id ON acl(entity_id);
+
+CREATE TABLE dialog_new (
+  dialog_id TEXT PRIMARY KEY,
+  user_id INTEGER NOT NULL,
+  title TEXT NOT NULL,
+  created TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP),
+  public INTEGER DEFAULT 0,
+  FOREIGN KEY (user_id) REFERENCES users(user_id)
+) STRICT;
+INSERT INTO dialog_new SELECT * FROM dialog;
+DROP TABLE dialog;
+ALTER TABLE dialog_new RENAME TO dialog;
+CREATE INDEX dialog_user_id ON dialog(user_id);
+
+CREATE TABLE message_new (
+  message_id INTEGER PRIMARY KEY,
+  dialog_id TEXT NOT NULL,
+  user_id INTEGER NOT NULL,
+  role TEXT NOT NULL,
+  content TEXT NOT NULL,
+  created TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP),
+  FOREIGN KEY (dialog_id) REFERENCES dialog(dialog_id) ON DELETE CASCADE,
+  FOREIGN KEY (user_id) REFERENCES users(user_id)
+) STRICT;
+INSERT INTO message_new SELECT * FROM message;
+DROP TABLE message;
+ALTER TABLE message_new RENAME TO message;
+CREATE INDEX message_dialog_id ON message(dialog_id);
+CREATE INDEX message_user_id ON message(user_id)
+"""
+
+# Dialogs are listed newest first per user with keyset pagination on (user_id, created, dialog_id).
+# The number of dialogs per user is kept in user_dialog_count, so the list does not count them.
+dialog_keyset_pagination = """
+CREATE INDEX dialog_user_id_created ON dialog(user_id, created, dialog_id);
+DROP INDEX dialog_user_id;
+
+CREATE TABLE user_dialog_count (
+  user_id INTEGER PRIMARY KEY,
+  num_dialogs INTEGER NOT NULL DEFAULT 0,
+  FOREIGN KEY (user_id) REFERENCES users(user_id)
+) STRICT;
+
+INSERT INTO user_dialog_count (user_id, num_dialogs) SELECT user_id, COUNT(*) FROM dialog GROUP BY user_id
+"""
+
+# Messages are paged newest first on message_id within a dialog
+message_dialog_pagination = """
+CREATE INDEX message_dialog_id_message_id ON message(dialog_id, message_id);
+DROP INDEX message_dialog_id
+"""
+
+# Full-text search over dialog titles and message contents. The FTS tables keep their own copy
+# of the text, so a row can always be deleted from the index by id. message_fts uses the
+# message_id as rowid. The triggers keep the index in sync. Existing rows are indexed with
+# `ollama-client search-index`.
+search_index = """
+CREATE VIRTUAL TABLE dialog_fts USING fts5(title, dialog_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2');
+CREATE VIRTUAL TABLE message_fts USING fts5(content, tokenize = 'unicode61 remove_diacritics 2');
+
+CREATE TRIGGER dialog_fts_insert AFTER INSERT ON dialog BEGIN
+  INSERT INTO dialog_fts (title, dialog_id) VALUES (new.title, new.dialog_id);
+END;
+
+CREATE TRIGGER dialog_fts_delete AFTER DELETE ON dialog BEGIN
+  DELETE FROM dialog_fts WHERE dialog_id = old.dialog_id;
+END;
+
+CREATE TRIGGER dialog_fts_update AFTER UPDATE OF title ON dialog BEGIN
+  DELETE FROM dialog_fts WHERE dialog_id = old.dialog_id;
+  INSERT INTO dialog_fts (title, dialog_id) VALUES (new.title, new.dialog_id);
+END;
+
+CREATE TRIGGER message_fts_insert AFTER INSERT ON message BEGIN
+  INSERT INTO message_fts (rowid, content) VALUES (new.message_id, new.content);
+END;
+
+CREATE TRIGGER message_fts_delete AFTER DELETE ON message BEGIN
+  DELETE FROM message_fts WHERE rowid = old.message_id;
+END;
+
+CREATE TRIGGER message_fts_update AFTER UPDATE OF content ON message BEGIN
+  DELETE FROM message_fts WHERE rowid = old.message_id;
+  INSERT INTO message_fts (rowid, content) VALUES (new.message_id, new.content);
+END
+"""
+
+# One row per cache key, an expiry time that is indexed for sweeping and a version that is
+# changed on every set. Duplicate keys from the old DELETE + INSERT are removed first.
+cache_unique_key = """
+DELETE FROM cache WHERE cache_id NOT IN (SELECT MAX(cache_id) FROM cache GROUP BY key);
+DROP INDEX idx_cache_key;
+CREATE UNIQUE INDEX cache_key ON cache(key);
+ALTER TABLE cache ADD COLUMN expires INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE cache ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+CREATE INDEX cache_expires ON cache(expires) WHERE expires > 0
+"""
+
+# Indexes for purging expired rows and the last start of each maintenance job. Login tokens from
+# before the expires column was set expire with the session (14 days after the login).
+maintenance = """
+UPDATE user_token SET expires = CAST(strftime('%s', last_login) AS INTEGER) + 1209600 WHERE expires = 0;
+CREATE INDEX user_token_expires ON user_token(expires);
+CREATE INDEX token_created ON token(created);
+CREATE TABLE maintenance_job (
+  job TEXT PRIMARY KEY,
+  started INTEGER NOT NULL DEFAULT 0
+) STRICT
+"""
+
+# Message contents may be stored compressed (see database/content_codec.py). The search index
+# gets the plain text from the SQL function message_text(), which is registered on the pooled
+# connections. A content that is only recompressed is not indexed again.
+message_compression = """
+DROP TRIGGER message_fts_insert;
+DROP TRIGGER message_fts_update;
+
+CREATE TRIGGER message_fts_insert AFTER INSERT ON message BEGIN
+  INSERT INTO message_fts (rowid, content) VALUES (new.message_id, message_text(new.content));
+END;
+
+CREATE TRIGGER message_fts_update AFTER UPDATE OF content ON message
+WHEN message_text(old.content) IS NOT message_text(new.content) BEGIN
+  DELETE FROM message_fts WHERE rowid = old.message_id;
+  INSERT INTO message_fts (rowid, content) VALUES (new.message_id, message_text(new.content));
+END
+"""
+
+# message_fts is contentless, so the message text is not stored twice. The app adds messages to
+# the index with the plain text and removes them with the same text (see models/search_model.py),
+# because the text of compressed messages can not be read in SQL. Plain messages are indexed
+# here. Compressed messages are indexed with `ollama-client search-index`.
+message_fts_contentless = """
+DROP TRIGGER message_fts_insert;
+DROP TRIGGER message_fts_update;
+DROP TRIGGER message_fts_delete;
+DROP TABLE message_fts;
+
+CREATE VIRTUAL TABLE message_fts USING fts5(content, content = '', tokenize = 'unicode61 remove_diacritics 2');
+
+INSERT INTO message_fts (rowid, content)
+SELECT message_id, content FROM message WHERE substr(content, 1, 6) IS NOT char(26) || 'zlib:'
+"""
+
 # List of migrations with keys
 migrations = {
     "create_base_install": create_base_install,
+    "fix_foreign_keys": fix_foreign_keys,
+    "dialog_keyset_pagination": dialog_keyset_pagination,
+    "message_dialog_pagination": message_dialog_pagination,
+    "search_index": search_index,
+    "cache_unique_key": cache_unique_key,
+    "maintenance": maintenance,
+    "message_compression": message_compression,
+    "message_fts_contentless": message_fts_contentless,
 }
@@ -36,15 +36,31 @@ from starlette.requests import Request
 from starlette.responses import JSONResponse
 from ollama_client.database.crud import CRUD
 from ollama_client.database.database_utils import DatabaseConnection
+from ollama_client.database.connection_pool import AsyncConnection
+from ollama_client.database import write_behind, content_codec
 from ollama_client.core.exceptions import UserValidate
 from ollama_client.core import session
+from ollama_client.core.lru_cache import LRUCache
+from ollama_client.models import search_model
 from config import DATABASE
+import config
 import uuid
+import json
+import base64
 import logging
 
 
 logger: logging.Logger = logging.getLogger(__name__)
 
+# Recent dialog histories used when the chat only receives the new turn.
+# Cached entries are extended with the messages added after them, so they stay
+# correct when other workers write to the same dialog.
+DIALOG_HISTORY_CACHE_SIZE = getattr(config, "DIALOG_HISTORY_CACHE_SIZE", 256)
+_dialog_history_cache = LRUCache(DIALOG_HISTORY_CACHE_SIZE)
+
+# Messages written behind are added to the search index in the same transaction
+write_behind.after_insert("message", search_model.index_new_messages)
+
 
 async def create_dialog(request: Request):
     form_data = await request.json()
@@ -65,6 +81,7 @@ async def create_dialog(request: Request):
                 "title": title,
             },
         )
+        await _add_to_dialog_count(connection, user_id, 1)
 
         return dialog_id
 
@@ -90,11 +107,12 @@ async def create_message(request: Request):
             "message",
             {
                 "role": role,
-                "content": content,
+                "content": content_codec.encode(content),
                 "dialog_id": dialog_id,
                 "user_id": user_id,
             },
         )
+        await search_model.index_new_messages(connection, 1)
 
 
 async def get_dialog(request: Request):
@@ -104,7 +122,7 @@ async def get_dialog(request: Request):
         raise UserValidate("You must be logged in to get a dialog")
 
     database_connection = DatabaseConnection(DATABASE)
-    async with database_connection.async_transaction_scope() as connection:
+    async with database_connection.async_read_scope() as connection:
         crud = CRUD(connection)
         dialog = await crud.select_one(
             table="dialog",
@@ -117,28 +135,107 @@ async def get_dialog(request: Request):
         return dialog
 
 
+# Number of messages in a page of a dialog
+MESSAGES_PER_PAGE = getattr(config, "MESSAGES_PER_PAGE", 50)
+
+
 async def get_messages(request: Request):
+    """
+    Get a page of the messages of a dialog, newest first, keyed on message_id. The page holds
+    the messages before the message_id in the query param "before", or the newest messages.
+    The messages of the page are returned oldest first. "before" of the result is the cursor
+    of the next (older) page, or 0 if there are no older messages.
+    """
     dialog_id = request.path_params.get("dialog_id")
     user_id = await session.is_logged_in(request)
     if not user_id:
-        return JSONResponse({"error": "You must be logged in to get messages"})
+        raise UserValidate("You must be logged in to get messages")
+
+    try:
+        before = int(request.query_params.get("before", 0))
+        limit = min(int(request.query_params.get("limit", MESSAGES_PER_PAGE)), MESSAGES_PER_PAGE)
+    except ValueError:
+        raise UserValidate("Invalid page of messages")
+
+    if limit < 1:
+        raise UserValidate("Invalid page of messages")
+
+    # Include messages that are still queued
+    await write_behind.flush()
 
     database_connection = DatabaseConnection(DATABASE)
-    async with database_connection.async_transaction_scope() as connection:
+    async with database_connection.async_read_scope() as connection:
+        crud = CRUD(connection)
+
+        # "+user_id" keeps the planner on the (dialog_id, message_id) index
+        messages = await crud.query(
+            "SELECT message_id, dialog_id, user_id, role, content, created FROM message "
+            "WHERE dialog_id = :dialog_id AND +user_id = :user_id AND message_id < :before "
+            "ORDER BY message_id DESC LIMIT :limit",
+            {"dialog_id": dialog_id, "user_id": user_id, "before": before or 2**63 - 1, "limit": limit + 1},
+        )
+
+    has_more = len(messages) > limit
+    messages = [{**message, "content": content_codec.decode(message["content"])} for message in reversed(messages[:limit])]
+    return {
+        "messages": messages,
+        "before": messages[0]["message_id"] if has_more and messages else 0,
+    }
+
+
+async def get_dialog_history(user_id: int, dialog_id: str) -> list:
+    """
+    Get the messages of a dialog as a list of role and content dicts.
+    Only messages added since the history was cached are read from the database.
+    """
+    await write_behind.flush()
+
+    database_connection = DatabaseConnection(DATABASE)
+    async with database_connection.async_read_scope() as connection:
         crud = CRUD(connection)
-        # check user owns dialog
-        messages = await crud.select(
-            table="message",
+
+        dialog = await crud.select_one(
+            table="dialog",
             filters={
                 "dialog_id": dialog_id,
                 "user_id": user_id,
             },
-            order_by=[("created", "ASC")],
-            # Some kind of hard limit
-            limit_offset=(1000, 0),
         )
 
-        return messages
+        if not dialog:
+            raise UserValidate("Dialog is not connected to user")
+
+        history = _dialog_history_cache.get(dialog_id, {"last_message_id": 0, "messages": []})
+        rows = await crud.query(
+            "SELECT message_id, role, content FROM message "
+            "WHERE dialog_id = :dialog_id AND message_id > :last_message_id ORDER BY message_id",
+            {"dialog_id": dialog_id, "last_message_id": history["last_message_id"]},
+        )
+
+        if rows:
+            new_messages = [{"role": row["role"], "content": content_codec.decode(row["content"])} for row in rows]
+            history = {
+                "last_message_id": rows[-1]["message_id"],
+                "messages": history["messages"] + new_messages,
+            }
+
+        _dialog_history_cache.set(dialog_id, history)
+        return list(history["messages"])
+
+
+def add_dialog_message(user_id: int, dialog_id: str, role: str, content: str) -> None:
+    """
+    Queue a message to be saved to a dialog. The message is written in the background.
+    """
+    write_behind.insert(
+        "message",
+        {
+            "role": role,
+            "content": content_codec.encode(content),
+            "dialog_id": dialog_id,
+            "user_id": user_id,
+        },
+    )
 
 
 async def delete_dialog(request: Request):
@@ -147,6 +244,9 @@ async def delete_dialog(request: Request):
     if not user_id:
         raise UserValidate("You must be logged in to delete a dialog")
 
+    # Queued messages of the dialog must not be written after it is deleted
+    await write_behind.flush()
+
     database_connection = DatabaseConnection(DATABASE)
     async with database_connection.async_transaction_scope() as connection:
         crud = CRUD(connection)
@@ -163,6 +263,7 @@ async def delete_dialog(request: Request):
         if not dialog:
             raise UserValidate("Dialog is not connected to user. You can't delete it")
 
+        await search_model.unindex_dialog_messages(connection, dialog["dialog_id"])
         await crud.delete(
             table="dialog",
             filters={
@@ -170,60 +271,147 @@ async def delete_dialog(request: Request):
                 "user_id": user_id,
             },
         )
+        await _add_to_dialog_count(connection, user_id, -1)
 
+    _dialog_history_cache.delete(dialog_id)
 
-async def _num_dialogs(crud: CRUD, user_id: int) -> int:
-    return await crud.count(
-        table="dialog",
-        filters={
-            "user_id": user_id,
-        },
+
+# Bytes of the database in pages that are in use. Pages freed by updates and deletes are on the freelist.
+_USED_DATABASE_SIZE_SQL = (
+    "SELECT (page_count - freelist_count) * page_size AS size FROM pragma_page_count, pragma_freelist_count, pragma_page_size"
+)
+
+
+async def recompress_messages(batch_size: int = 1000) -> dict:
+    """
+    Rewrite the contents of all messages with the current MESSAGE_COMPRESSION_THRESHOLD, batch_size
+    messages per transaction. Returns the number of rewritten messages and the bytes of the
+    database in use before and after.
+    """
+    database_connection = DatabaseConnection(DATABASE)
+    async with database_connection.async_read_scope() as connection:
+        row = await connection.fetchone(_USED_DATABASE_SIZE_SQL)
+
+    result = {"messages": 0, "size_before": row["size"], "size_after": row["size"]}
+    last_message_id = 0
+    while True:
+        async with database_connection.async_transaction_scope() as connection:
+            rows = await connection.fetchall(
+                "SELECT message_id, content FROM message WHERE message_id > :message_id ORDER BY message_id LIMIT :limit",
+                {"message_id": last_message_id, "limit": batch_size},
+            )
+            if not rows:
+                row = await connection.fetchone(_USED_DATABASE_SIZE_SQL)
+                result["size_after"] = row["size"]
+                return result
+
+            changed = []
+            for row in rows:
+                content = content_codec.encode(content_codec.decode(row["content"]))
+                if content != row["content"]:
+                    changed.append({"message_id": row["message_id"], "content": content})
+
+            await connection.executemany("UPDATE message SET content = :content WHERE message_id = :message_id", changed)
+            result["messages"] += len(changed)
+            last_message_id = rows[-1]["message_id"]
+
+        logger.info(f"Recompressed messages up to message_id {last_message_id}")
+
+
+async def _add_to_dialog_count(connection: AsyncConnection, user_id: int, amount: int) -> None:
+    await connection.execute(
+        "INSERT INTO user_dialog_count (user_id, num_dialogs) VALUES (:user_id, MAX(:amount, 0)) "
+        "ON CONFLICT (user_id) DO UPDATE SET num_dialogs = MAX(num_dialogs + :amount, 0)",
+        {"user_id": user_id, "amount": amount},
     )
 
 
+async def _num_dialogs(crud: CRUD, user_id: int) -> int:
+    row = await crud.select_one("user_dialog_count", columns=["num_dialogs"], filters={"user_id": user_id})
+    return row.get("num_dialogs", 0)
+
+
 DIALOGS_PER_PAGE = 10
 
 
+def _encode_cursor(dialog: dict) -> str:
+    cursor = json.dumps([dialog["created"], dialog["dialog_id"]])
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    """
+    Decode a cursor to (created, dialog_id). An invalid cursor is the start of the list.
+    """
+    try:
+        created, dialog_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(created), str(dialog_id)
+    except (ValueError, TypeError):
+        return ()
+
+
+# Dialogs are listed newest first. "before" and "after" are relative to that order, so the dialogs
+# "before" a cursor are the older ones. The queries use the index on (user_id, created, dialog_id).
+_DIALOGS_BEFORE = (
+    "SELECT * FROM dialog WHERE user_id = :user_id AND (created, dialog_id) < (:created, :dialog_id) "
+    "ORDER BY created DESC, dialog_id DESC LIMIT :limit"
+)
+_DIALOGS_AFTER = (
+    "SELECT * FROM dialog WHERE user_id = :user_id AND (created, dialog_id) > (:created, :dialog_id) "
+    "ORDER BY created ASC, dialog_id ASC LIMIT :limit"
+)
+
+
 async def get_dialogs_info(request: Request):
-    current_page = int(request.query_params.get("page", 1))
+    """
+    Get a page of the dialogs of the user. The page starts after the cursor in the query param
+    "before" (the next page) or ends before the cursor in "after" (the previous page).
+    """
     user_id = await session.is_logged_in(request)
     if not user_id:
         raise UserValidate("You must be logged in to list dialogs")
 
+    before = _decode_cursor(request.query_params.get("before", ""))
+    after = _decode_cursor(request.query_params.get("after", ""))
+
     database_connection = DatabaseConnection(DATABASE)
-    async with database_connection.async_transaction_scope() as connection:
+    async with database_connection.async_read_scope() as connection:
         crud = CRUD(connection)
 
-        dialogs = await crud.select(
-            table="dialog",
-            filters={
-                "user_id": user_id,
-            },
-            order_by=[("created", "DESC")],
-            limit_offset=(DIALOGS_PER_PAGE, (current_page - 1) * DIALOGS_PER_PAGE),
-        )
-
-        num_dialogs = await _num_dialogs(crud, user_id)
-        has_prev = current_page > 1
-        has_next = num_dialogs > current_page * DIALOGS_PER_PAGE
-
-        if has_prev:
-            prev_page = current_page - 1
+        dialogs = []
+        if after:
+            values = {"user_id": user_id, "created": after[0], "dialog_id": after[1], "limit": DIALOGS_PER_PAGE + 1}
+            dialogs = await crud.query(_DIALOGS_AFTER, values)
+            has_prev = len(dialogs) > DIALOGS_PER_PAGE
+            dialogs = list(reversed(dialogs[:DIALOGS_PER_PAGE]))
+
+        # Without a cursor (or no dialogs after it) the page starts with the newest dialog
+        if not dialogs:
+            after = ()
+            created, dialog_id = before or ("\uffff", "")
+            values = {"user_id": user_id, "created": created, "dialog_id": dialog_id, "limit": DIALOGS_PER_PAGE + 1}
+            dialogs = await crud.query(_DIALOGS_BEFORE, values)
+            has_next = len(dialogs) > DIALOGS_PER_PAGE
+            dialogs = dialogs[:DIALOGS_PER_PAGE]
+
+        # Check for dialogs beyond the page in the other direction
+        if after:
+            values = {"user_id": user_id, "created": dialogs[-1]["created"], "dialog_id": dialogs[-1]["dialog_id"], "limit": 1}
+            has_next = bool(await crud.query(_DIALOGS_BEFORE, values))
         else:
-            prev_page = 0
+            has_prev = False
+            if before and dialogs:
+                values = {"user_id": user_id, "created": dialogs[0]["created"], "dialog_id": dialogs[0]["dialog_id"], "limit": 1}
+                has_prev = bool(await crud.query(_DIALOGS_AFTER, values))
 
-        if has_next:
-            next_page = current_page + 1
-        else:
-            next_page = 0
+        num_dialogs = await _num_dialogs(crud, user_id)
 
         return {
-            "current_page": current_page,
             "per_page": DIALOGS_PER_PAGE,
             "has_prev": has_prev,
             "has_next": has_next,
-            "prev_page": prev_page,
-            "next_page": next_page,
+            "prev_cursor": _encode_cursor(dialogs[0]) if has_prev else "",
+            "next_cursor": _encode_cursor(dialogs[-1]) if has_next else "",
             "dialogs": dialogs,
             "num_dialogs": num_dialogs,
         }
@@ -0,0 +1,212 @@
+"""
+Export and import the dialogs of a user as NDJSON, one JSON object per line.
+
+Each dialog is followed by its messages, oldest first:
+
+```
+{"type": "dialog", "dialog_id": "3f1c...", "title": "Fish", "created": "2025-01-02 10:00:00"}
+{"type": "message", "dialog_id": "3f1c...", "role": "user", "content": "Hi", "created": "2025-01-02 10:00:01"}
+```
+
+The export reads EXPORT_BATCH_SIZE rows per read transaction, keyed on (created, dialog_id) and
+message_id, and yields them before the next batch is read. Memory does not grow with the number
+of dialogs, and a slow client does not keep a read transaction open.
+
+The import inserts batch_size rows per transaction with executemany. Dialogs that already exist
+are skipped with their messages, so importing the same file again does not add duplicates. A
+request body is split into lines with read_lines() as it is received.
+"""
+
+import json
+import logging
+from typing import AsyncIterable, AsyncIterator, Iterable
+import config
+from config import DATABASE
+from ollama_client.database.connection_pool import AsyncConnection
+from ollama_client.database.crud import CRUD
+from ollama_client.database.database_utils import DatabaseConnection
+from ollama_client.database import write_behind, content_codec
+from ollama_client.models import chat_model, search_model
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Rows read per read transaction
+EXPORT_BATCH_SIZE = getattr(config, "EXPORT_BATCH_SIZE", 500)
+
+# Max bytes of a line read with read_lines()
+IMPORT_MAX_LINE_SIZE = getattr(config, "IMPORT_MAX_LINE_SIZE", 10 * 1024 * 1024)
+
+_EXPORT_DIALOGS_SQL = (
+    "SELECT dialog_id, title, created FROM dialog WHERE user_id = :user_id AND (created, dialog_id) > (:created, :dialog_id) "
+    "ORDER BY created, dialog_id LIMIT :limit"
+)
+
+_EXPORT_MESSAGES_SQL = (
+    "SELECT message_id, role, content, created FROM message WHERE dialog_id = :dialog_id AND message_id > :message_id "
+    "ORDER BY message_id LIMIT :limit"
+)
+
+
+def _line(item: dict) -> str:
+    return json.dumps(item, ensure_ascii=False) + "\n"
+
+
+async def _read(query: str, values: dict) -> list:
+    database_connection = DatabaseConnection(DATABASE)
+    async with database_connection.async_read_scope() as connection:
+        return await CRUD(connection).query(query, values)
+
+
+async def export_dialogs(user_id: int) -> AsyncIterator[str]:
+    """
+    Export the dialogs and messages of a user. Yields chunks of NDJSON lines.
+    """
+    # Include messages that are still queued
+    await write_behind.flush()
+
+    last_dialog = {"created": "", "dialog_id": ""}
+    while True:
+        dialogs = await _read(_EXPORT_DIALOGS_SQL, {"user_id": user_id, "limit": EXPORT_BATCH_SIZE, **last_dialog})
+        if not dialogs:
+            return
+
+        for dialog in dialogs:
+            yield _line({"type": "dialog", **dialog})
+
+            last_message_id = 0
+            while True:
+                values = {"dialog_id": dialog["dialog_id"], "message_id": last_message_id, "limit": EXPORT_BATCH_SIZE}
+                messages = await _read(_EXPORT_MESSAGES_SQL, values)
+                if not messages:
+                    break
+
+                lines = []
+                for message in messages:
+                    last_message_id = message.pop("message_id")
+                    message["content"] = content_codec.decode(message["content"])
+                    lines.append(_line({"type": "message", "dialog_id": dialog["dialog_id"], **message}))
+                yield "".join(lines)
+
+        last_dialog = {"created": dialogs[-1]["created"], "dialog_id": dialogs[-1]["dialog_id"]}
+
+
+def _parse_line(line_number: int, line: str | bytes) -> tuple[str, dict]:
+    """
+    Parse a line to its type ("dialog" or "message") and the row to insert
+    """
+    try:
+        item = json.loads(line)
+        if item["type"] == "dialog":
+            return "dialog", {"dialog_id": str(item["dialog_id"]), "title": str(item["title"]), "created": str(item["created"])}
+        if item["type"] == "message":
+            return "message", {
+                "dialog_id": str(item["dialog_id"]),
+                "role": str(item["role"]),
+                "content": content_codec.encode(str(item["content"])),
+                "created": str(item["created"]),
+            }
+    except (ValueError, TypeError, KeyError):
+        pass
+    raise ValueError(f"Line {line_number} is not a dialog or a message")
+
+
+async def _existing_dialog_ids(connection: AsyncConnection, dialog_ids: list) -> set:
+    rows = await connection.fetchall(
+        "SELECT dialog_id FROM dialog WHERE dialog_id IN (SELECT value FROM json_each(:dialog_ids))",
+        {"dialog_ids": json.dumps(dialog_ids)},
+    )
+    return {row["dialog_id"] for row in rows}
+
+
+async def _import_batch(user_id: int, dialogs: list, messages: list, skipped_dialog_ids: set) -> tuple[int, int]:
+    """
+    Insert a batch of dialogs and messages in one transaction. Existing dialogs are added to
+    skipped_dialog_ids, and the messages of skipped dialogs are not inserted.
+    Returns the number of inserted dialogs and messages.
+    """
+    database_connection = DatabaseConnection(DATABASE)
+    async with database_connection.async_transaction_scope() as connection:
+        crud = CRUD(connection)
+        skipped_dialog_ids |= await _existing_dialog_ids(connection, [dialog["dialog_id"] for dialog in dialogs])
+
+        new_dialogs = [{**dialog, "user_id": user_id} for dialog in dialogs if dialog["dialog_id"] not in skipped_dialog_ids]
+        new_messages = [{**message, "user_id": user_id} for message in messages if message["dialog_id"] not in skipped_dialog_ids]
+        await crud.insert_many("dialog", new_dialogs)
+        await crud.insert_many("message", new_messages)
+        await search_model.index_new_messages(connection, len(new_messages))
+        await chat_model._add_to_dialog_count(connection, user_id, len(new_dialogs))
+
+    return len(new_dialogs), len(new_messages)
+
+
+async def read_lines(chunks: AsyncIterable[bytes], max_line_size: int = IMPORT_MAX_LINE_SIZE) -> AsyncIterator[bytes]:
+    """
+    Split a stream of bytes, e.g. a request body, into lines
+    """
+    rest = b""
+    async for chunk in chunks:
+        lines = (rest + chunk).split(b"\n")
+        rest = lines.pop()
+        if len(rest) > max_line_size or any(len(line) > max_line_size for line in lines):
+            raise ValueError(f"A line is longer than {max_line_size} bytes")
+        for line in lines:
+            yield line
+
+    if rest:
+        yield rest
+
+
+async def _numbered(lines: Iterable[str | bytes] | AsyncIterable[str | bytes]) -> AsyncIterator[tuple[int, str | bytes]]:
+    if isinstance(lines, AsyncIterable):
+        line_number = 0
+        async for line in lines:
+            line_number += 1
+            yield line_number, line
+    else:
+        for line_number, line in enumerate(lines, 1):
+            yield line_number, line
+
+
+async def import_dialogs(user_id: int, lines: Iterable[str | bytes] | AsyncIterable[str | bytes], batch_size: int = 1000) -> dict:
+    """
+    Import NDJSON lines as dialogs and messages of a user. A message must follow its dialog.
+    Returns the number of imported dialogs and messages and the number of skipped dialogs.
+    """
+    result = {"dialogs": 0, "messages": 0, "skipped_dialogs": 0}
+    dialogs: list = []
+    messages: list = []
+    dialog_id = None
+
+    # Only the dialog that continues in the next batch is kept after a batch
+    skipped_dialog_ids: set = set()
+
+    async def import_batch():
+        num_dialogs, num_messages = await _import_batch(user_id, dialogs, messages, skipped_dialog_ids)
+        result["dialogs"] += num_dialogs
+        result["messages"] += num_messages
+        result["skipped_dialogs"] += len(dialogs) - num_dialogs
+        skipped_dialog_ids.intersection_update({dialog_id})
+        dialogs.clear()
+        messages.clear()
+
+    async for line_number, line in _numbered(lines):
+        if not line.strip():
+            continue
+
+        line_type, row = _parse_line(line_number, line)
+        if line_type == "dialog":
+            dialog_id = row["dialog_id"]
+            dialogs.append(row)
+        elif row["dialog_id"] == dialog_id:
+            messages.append(row)
+        else:
+            raise ValueError(f"Line {line_number} is a message that does not follow its dialog")
+
+        if len(dialogs) + len(messages) >= batch_size:
+            await import_batch()
+
+    if dialogs or messages:
+        await import_batch()
+
+    return result
@@ -0,0 +1,276 @@
+"""
+Full-text search over the dialog titles and message contents of a user.
+
+dialog_fts is kept in sync with the dialog table by triggers (see the search_index migration).
+message_fts is contentless, so it has no copy of the message text (see the message_fts_contentless
+migration). Contents may be stored compressed, which SQL can not read, so the app indexes the plain
+text: index_new_messages() is called in the transactions that insert messages, and
+unindex_dialog_messages() before the messages of a dialog are deleted. Rows that are not indexed
+are indexed with `ollama-client search-index`, which calls index_existing().
+
+Messages deleted outside the app stay in message_fts. `ollama-client search-index --rebuild`
+removes them.
+"""
+
+from ollama_client.database.crud import CRUD
+from ollama_client.database.database_utils import DatabaseConnection
+from ollama_client.database.connection_pool import AsyncConnection
+from ollama_client.database import content_codec
+from ollama_client.core.exceptions import UserValidate
+from ollama_client.core import session
+from starlette.requests import Request
+from config import DATABASE
+from typing import Awaitable, Callable
+import html
+import logging
+import re
+import unicodedata
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+SEARCH_RESULTS_PER_PAGE = 10
+
+# Number of words in the snippet of a message
+SNIPPET_WORDS = 24
+
+# Markers of the matched terms in snippets. Replaced with <mark> after the snippet is escaped
+_MARK_START = "\x02"
+_MARK_END = "\x03"
+
+# Words like the unicode61 tokenizer splits them: letters and digits
+_WORD = re.compile(r"[^\W_]+")
+
+# Best hit per dialog. Hits in titles weigh double. bm25() is lower for better matches.
+# snippet() does not work on the contentless message_fts, so the content of a message hit is
+# returned and the snippet is made from it.
+_SEARCH_SQL = """
+WITH hits AS (
+  SELECT d.dialog_id, d.title, d.created, highlight(dialog_fts, 0, char(2), char(3)) AS snippet,
+    0 AS message_id, bm25(dialog_fts) * 2 AS rank
+  FROM dialog_fts JOIN dialog d ON d.dialog_id = dialog_fts.dialog_id
+  WHERE dialog_fts MATCH :query AND d.user_id = :user_id
+  UNION ALL
+  SELECT d.dialog_id, d.title, d.created, NULL AS snippet, m.message_id, bm25(message_fts) AS rank
+  FROM message_fts JOIN message m ON m.message_id = message_fts.rowid JOIN dialog d ON d.dialog_id = m.dialog_id
+  WHERE message_fts MATCH :query AND m.user_id = :user_id
+),
+best AS (
+  SELECT *, ROW_NUMBER() OVER (PARTITION BY dialog_id ORDER BY rank) AS hit_number FROM hits
+)
+SELECT best.dialog_id, best.title, best.created, best.snippet, best.message_id, best.rank, m.content
+FROM best LEFT JOIN message m ON m.message_id = best.message_id
+WHERE best.hit_number = 1
+ORDER BY best.rank
+LIMIT :limit OFFSET :offset
+"""
+
+
+def _match_query(query: str) -> str:
+    """
+    Turn the words of a user query into an FTS5 query matching all words. The last word also
+    matches as a prefix. FTS5 syntax in the query is matched literally.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return ""
+
+    phrases = ['"' + word + '"' for word in words]
+    phrases[-1] += "*"
+    return " ".join(phrases)
+
+
+def _fold(word: str) -> str:
+    """
+    Fold case and remove diacritics like the tokenizer of the FTS tables
+    """
+    return "".join(char for char in unicodedata.normalize("NFKD", word.casefold()) if not unicodedata.combining(char))
+
+
+def _snippet(content: str, query: str) -> str:
+    """
+    About SNIPPET_WORDS words of a message around the first word matching the query, with the
+    matching words marked. The last word of the query also matches as a prefix.
+    """
+    terms = [_fold(word) for word in _WORD.findall(query)]
+    words = list(_WORD.finditer(content))
+    if not words:
+        return ""
+
+    def is_match(word: str) -> bool:
+        folded = _fold(word)
+        return folded in terms or bool(terms) and folded.startswith(terms[-1])
+
+    matches = [index for index, word in enumerate(words) if is_match(word.group())]
+    first = matches[0] if matches else 0
+    start = max(0, min(first - SNIPPET_WORDS // 4, len(words) - SNIPPET_WORDS))
+    end = min(len(words), start + SNIPPET_WORDS)
+
+    parts = ["…"] if start > 0 else []
+    position = words[start].start()
+    for index in matches:
+        if start <= index < end:
+            word = words[index]
+            parts += [content[position : word.start()], _MARK_START, word.group(), _MARK_END]
+            position = word.end()
+
+    parts.append(content[position : words[end - 1].end()])
+    if end < len(words):
+        parts.append("…")
+    return "".join(parts)
+
+
+def _highlight(snippet: str) -> str:
+    return html.escape(snippet).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+
+async def search(user_id: int, query: str, page: int = 1) -> dict:
+    """
+    Search the dialogs of a user. Returns a page of dialogs ranked by relevance with a
+    highlighted HTML snippet of the best hit in each dialog.
+    """
+    if page < 1:
+        raise UserValidate("Invalid page")
+
+    results: list = []
+    has_next = False
+    match_query = _match_query(query)
+    if match_query:
+        values = {
+            "query": match_query,
+            "user_id": user_id,
+            "limit": SEARCH_RESULTS_PER_PAGE + 1,
+            "offset": (page - 1) * SEARCH_RESULTS_PER_PAGE,
+        }
+
+        database_connection = DatabaseConnection(DATABASE)
+        async with database_connection.async_read_scope() as connection:
+            crud = CRUD(connection)
+            rows = await crud.query(_SEARCH_SQL, values)
+
+        has_next = len(rows) > SEARCH_RESULTS_PER_PAGE
+        for row in rows[:SEARCH_RESULTS_PER_PAGE]:
+            content = row.pop("content")
+            snippet = row["snippet"] if content is None else _snippet(content_codec.decode(content), query)
+            results.append({**row, "snippet": _highlight(snippet)})
+
+    return {
+        "query": query,
+        "page": page,
+        "has_prev": page > 1,
+        "has_next": has_next,
+        "results": results,
+    }
+
+
+async def search_dialogs(request: Request) -> dict:
+    """
+    Search the dialogs of the logged in user with the query params "q" and "page"
+    """
+    user_id = await session.is_logged_in(request)
+    if not user_id:
+        raise UserValidate("You must be logged in to search dialogs")
+
+    try:
+        page = int(request.query_params.get("page", 1))
+    except ValueError:
+        raise UserValidate("Invalid page")
+
+    return await search(user_id, request.query_params.get("q", ""), page)
+
+
+_INDEX_DIALOGS_SQL = """
+INSERT INTO dialog_fts (title, dialog_id)
+SELECT title, dialog_id FROM dialog
+WHERE rowid > :last_id AND rowid <= :end_id AND dialog_id NOT IN (SELECT dialog_id FROM dialog_fts)
+"""
+
+_INDEX_MESSAGE_SQL = "INSERT INTO message_fts (rowid, content) VALUES (:message_id, :content)"
+
+# A row is removed from a contentless table with the text it was indexed with
+_UNINDEX_MESSAGE_SQL = "INSERT INTO message_fts (message_fts, rowid, content) VALUES ('delete', :message_id, :content)"
+
+_IS_INDEXED = "EXISTS (SELECT 1 FROM message_fts WHERE message_fts.rowid = message.message_id)"
+
+
+def _plain_text(rows: list) -> list:
+    return [{"message_id": row["message_id"], "content": content_codec.decode(row["content"])} for row in rows]
+
+
+async def index_new_messages(connection: AsyncConnection, num_messages: int) -> None:
+    """
+    Index the last num_messages inserted messages. Called in the transaction that inserts them,
+    so they are the messages with the highest ids.
+    """
+    rows = await connection.fetchall(
+        "SELECT message_id, content FROM message "
+        f"WHERE message_id IN (SELECT message_id FROM message ORDER BY message_id DESC LIMIT :num_messages) AND NOT {_IS_INDEXED}",
+        {"num_messages": num_messages},
+    )
+    await connection.executemany(_INDEX_MESSAGE_SQL, _plain_text(rows))
+
+
+async def unindex_dialog_messages(connection: AsyncConnection, dialog_id: str) -> None:
+    """
+    Remove the messages of a dialog from the index. Called before the messages are deleted.
+    """
+    rows = await connection.fetchall(
+        f"SELECT message_id, content FROM message WHERE dialog_id = :dialog_id AND {_IS_INDEXED}",
+        {"dialog_id": dialog_id},
+    )
+    await connection.executemany(_UNINDEX_MESSAGE_SQL, _plain_text(rows))
+
+
+async def _index_dialogs(connection: AsyncConnection, last_id: int, end_id: int) -> int:
+    return await connection.execute(_INDEX_DIALOGS_SQL, {"last_id": last_id, "end_id": end_id})
+
+
+async def _index_messages(connection: AsyncConnection, last_id: int, end_id: int) -> int:
+    rows = await connection.fetchall(
+        f"SELECT message_id, content FROM message WHERE message_id > :last_id AND message_id <= :end_id AND NOT {_IS_INDEXED}",
+        {"last_id": last_id, "end_id": end_id},
+    )
+    await connection.executemany(_INDEX_MESSAGE_SQL, _plain_text(rows))
+    return len(rows)
+
+
+async def _index_table(
+    table: str, id_column: str, index_batch: Callable[[AsyncConnection, int, int], Awaitable[int]], batch_size: int
+) -> int:
+    """
+    Index the rows of a table that are not indexed, batch_size rows per transaction
+    """
+    num_indexed = 0
+    last_id = 0
+    database_connection = DatabaseConnection(DATABASE)
+    while True:
+        async with database_connection.async_transaction_scope() as connection:
+            row = await connection.fetchone(
+                f"SELECT MAX(batch_id) AS end_id FROM (SELECT {id_column} AS batch_id FROM {table} "
+                f"WHERE {id_column} > :last_id ORDER BY {id_column} LIMIT :batch_size)",
+                {"last_id": last_id, "batch_size": batch_size},
+            )
+            if row["end_id"] is None:
+                return num_indexed
+
+            num_indexed += await index_batch(connection, last_id, row["end_id"])
+            last_id = row["end_id"]
+
+        logger.info(f"Indexed {num_indexed} rows of {table}")
+
+
+async def index_existing(batch_size: int = 1000, rebuild: bool = False) -> tuple:
+    """
+    Index the dialogs and messages that are not in the search index. With rebuild the message
+    index is emptied first, which removes messages deleted outside the app. Messages are not found
+    until they are indexed again.
+    Returns the number of indexed dialogs and messages.
+    """
+    if rebuild:
+        database_connection = DatabaseConnection(DATABASE)
+        async with database_connection.async_transaction_scope() as connection:
+            await connection.execute("INSERT INTO message_fts (message_fts) VALUES ('delete-all')")
+
+    num_dialogs = await _index_table("dialog", "rowid", _index_dialogs, batch_size)
+    num_messages = await _index_table("message", "message_id", _index_messages, batch_size)
+    return num_dialogs, num_messages
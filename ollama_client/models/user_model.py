@@ -11,6 +11,7 @@ from config import HOSTNAME_WITH_SCHEME, SITE_NAME, DATABASE
 import bcrypt
 import logging
 import secrets
+import time
 import re
 
 
@@ -138,14 +139,14 @@ async def verify_user(request):
 
 
 async def login_user(request: Request):
+    json_data = await request.json()
+    email = json_data.get("email")
+    password = json_data.get("password")
+
     database_connection = DatabaseConnection(DATABASE)
-    async with database_connection.async_transaction_scope() as connection:
+    async with database_connection.async_read_scope() as connection:
         crud = CRUD(connection)
 
-        json_data = await request.json()
-        email = json_data.get("email")
-        password = json_data.get("password")
-
         # Get user
         user_row = await crud.select_one(
             "users",
@@ -154,27 +155,30 @@ async def login_user(request: Request):
             },
         )
 
-        # check password
-        if not user_row:
-            raise UserValidate("User does not exist")
-        if user_row["verified"] == 0:
-            raise UserValidate(
-                "Your account is not verified. In order to verify your account, "
-                "you should reset your password. When this is done, you are verified."
-            )
-        if not _check_password(password, user_row["password_hash"]):
-            raise UserValidate("Invalid password")
-
-        # Get session token
-        session_token = secrets.token_urlsafe(32)
-        insert_values = {
-            "token": session_token,
-            "user_id": user_row["user_id"],
-        }
+    # check password
+    if not user_row:
+        raise UserValidate("User does not exist")
+    if user_row["verified"] == 0:
+        raise UserValidate(
+            "Your account is not verified. In order to verify your account, "
+            "you should reset your password. When this is done, you are verified."
+        )
+    if not _check_password(password, user_row["password_hash"]):
+        raise UserValidate("Invalid password")
+
+    # Get session token
+    session_token = secrets.token_urlsafe(32)
+    insert_values = {
+        "token": session_token,
+        "user_id": user_row["user_id"],
+        "expires": int(time.time()) + session.SESSION_MAX_AGE,
+    }
+    async with database_connection.async_transaction_scope() as connection:
+        crud = CRUD(connection)
         await crud.insert("user_token", insert_values=insert_values)
-        session.set_user_session(request, user_row["user_id"], session_token)
 
-        return user_row
+    session.set_user_session(request, user_row["user_id"], session_token)
+    return user_row
 
 
 async def reset_password(request: Request):
@@ -288,7 +292,7 @@ async def get_profile(user_id: int):
         return {}
 
     database_connection = DatabaseConnection(DATABASE)
-    async with database_connection.async_transaction_scope() as connection:
+    async with database_connection.async_read_scope() as connection:
         cache = DatabaseCache(connection)
 
         cache_key = f"user_{user_id}"
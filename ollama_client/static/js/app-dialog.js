@@ -28,13 +28,14 @@ async function createDialog(title) {
 }
 
 /**
- * Get messages connected to a dialog_id
- * /chat/get-messages/{dialog_id}
+ * Get a page of messages connected to a dialog_id, oldest first
+ * /chat/get-messages/{dialog_id}?before={message_id}
+ * Returns { messages, before }. 'before' is the cursor of the older page, or 0 if there is none
  */
-async function getMessages(dialogID) {
+async function getMessages(dialogID, before = 0) {
 
-    const data = await fetch(`/chat/get-messages/${dialogID}`).then(response => response.json())
-    console.log(data)
+    const params = before ? `?before=${before}` : '';
+    const data = await fetch(`/chat/get-messages/${dialogID}${params}`).then(response => response.json())
 
     if (data.error) {
         throw new Error(data.message);
@@ -1,6 +1,6 @@
 import { Flash } from '/static/js/flash.js';
 import { mdNoHTML } from '/static/js/markdown.js';
-import { createDialog, getMessages, createMessage, getConfig, isLoggedInOrRedirect } from '/static/js/app-dialog.js';
+import { createDialog, getMessages, getConfig, isLoggedInOrRedirect } from '/static/js/app-dialog.js';
 import { responsesElem, messageElem, sendButtonElem, newButtonElem, abortButtonElem, selectModelElem, loadingSpinner } from '/static/js/app-elements.js';
 import { getIsScrolling, setIsScrolling } from '/static/js/app-events.js';
 import { addCopyButtons } from '/static/js/app-copy-buttons.js';
@@ -22,6 +22,10 @@ const checkIcon = `<svg xmlns="http://www.w3.org/2000/svg" height="24px" viewBox
 let isStreaming = false;
 let currentDialogMessages = [];
 let currentDialogID;
+let currentStreamID;
+
+// Number of times a dropped stream is resumed
+const maxResumeAttempts = 3;
 
 // Add event listener to the send button
 sendButtonElem.addEventListener('click', async () => {
@@ -48,6 +52,11 @@ abortButtonElem.addEventListener('click', () => {
     console.log('Aborting request');
     controller.abort();
     controller = new AbortController();
+
+    // Stop the generation on the server
+    if (currentStreamID) {
+        fetch(`/chat/stream/${currentStreamID}/cancel`, { method: 'POST' });
+    }
 });
 
 /**
@@ -124,7 +133,7 @@ function renderCopyMessage(container, message) {
 /**
  * Render user message to the DOM
  */
-function renderStaticUserMessage(message) {
+function renderStaticUserMessage(message, parentElem = responsesElem) {
     const { container, contentElement } = createMessageElement('User');
 
     contentElement.style.whiteSpace = 'pre-wrap';
@@ -133,7 +142,7 @@ function renderStaticUserMessage(message) {
     // Render copy message
     renderCopyMessage(container, message);
 
-    responsesElem.appendChild(container);
+    parentElem.appendChild(container);
 }
 
 /**
@@ -170,11 +179,9 @@ async function sendUserMessage() {
         }
     
         // Push user message to current dialog messages
+        // The server saves the message and keeps the dialog history
         currentDialogMessages.push(message);
     
-        // Save user message and push to all messages
-        await createMessage(currentDialogID, message);
-    
         // Clear the input field
         messageElem.value = '';
 
@@ -191,9 +198,9 @@ async function sendUserMessage() {
 /**
  * Render static assistant message (without streaming)
  */
-async function renderStaticAssistantMessage(message) {
+async function renderStaticAssistantMessage(message, parentElem = responsesElem) {
     const { container, contentElement } = createMessageElement('Assistant');
-    responsesElem.appendChild(container);
+    parentElem.appendChild(container);
 
     // Render copy message
     renderCopyMessage(container, message);
@@ -292,8 +299,11 @@ async function updateContentDiff(contentElement, hiddenContentElem, streamedResp
 
 /**
  * Render assistant message with streaming
+ * Only the new user message is posted. The server reads the history using the dialog ID
+ * If the connection drops, the stream is resumed from the last received frame.
+ * With resumeStreamID an existing stream is replayed from the start, e.g. after a page reload.
  */
-async function renderAssistantMessage() {
+async function renderAssistantMessage(userMessage, resumeStreamID = null) {
 
     // Create container for assistant message and content element
     const { container, contentElement, loader } = createMessageElement('Assistant');
@@ -314,56 +324,68 @@ async function renderAssistantMessage() {
 
     scrollToBottom();
 
+    // ID of the last received frame
+    let lastEventID = 0;
+
     // Stream processing function
+    // A read may hold several frames or part of a frame, so incomplete frames are buffered
+    // Errors are thrown, so a dropped stream can be resumed
     const processStream = async (reader, decoder) => {
-        try {
 
-            while (true) {
+        let buffered = '';
+        while (true) {
 
-                const { done, value } = await reader.read();
+            const { done, value } = await reader.read();
 
-                // If loader is not hidden, hide it
-                if (!loader.classList.contains('hidden')) {
-                    loader.classList.toggle('hidden');
-                }
+            // If loader is not hidden, hide it
+            if (!loader.classList.contains('hidden')) {
+                loader.classList.toggle('hidden');
+            }
 
-                if (done) break;
-                const decoded = decoder.decode(value, { stream: true });
-                let dataElems = decoded.split('data: '); 
+            if (done) break;
+            buffered += decoder.decode(value, { stream: true });
+            const frames = buffered.split('\n\n');
+            buffered = frames.pop();
+
+            frames.forEach((frame) => processFrame(frame));
+        }
+    };
 
-                // Remove empty elements form the array
-                dataElems = dataElems.filter((data) => data.trim() !== '');
-                dataElems.forEach(processChunk);
+    // A frame has an id line and a data line
+    const processFrame = (frame) => {
+        for (const line of frame.split('\n')) {
+            if (line.startsWith('id: ')) {
+                lastEventID = parseInt(line.slice('id: '.length));
+            } else if (line.startsWith('data: ')) {
+                processChunk(line.slice('data: '.length));
             }
-        } catch (error) {
-            loader.classList.add('hidden');
-            clearStreaming();
-            handleStreamError(error);
         }
     };
 
     // Function to handle chunk processing
-    let totalTokenCount = 0;
+    // Frames use the compact stream format: { c: content, f: finish_reason }, { q: queue_position } or { error: message }
     const processChunk = async (dataPart) => {
         
         try {
             
             const data = JSON.parse(dataPart);
-            const messagePart = data.choices[0].delta.content;
-            const finishReason = data.choices[0].finish_reason
+            const messagePart = data.c;
+            const finishReason = data.f;
+            const queuePosition = data.q;
             const error = data.error;
 
             if (error) {
                 throw new Error(error);
             }
 
-            totalTokenCount += 1;
-
-            if (!finishReason) {
-                streamedResponseText += messagePart;
+            // Waiting for the model. The text is replaced when the first content arrives
+            if (queuePosition) {
+                contentElement.innerText = `Waiting for the model. Position in queue: ${queuePosition}`;
+                return;
             }
 
-            if (totalTokenCount % 1 === 0) {
+            if (messagePart) {
+                streamedResponseText += messagePart;
                 updateContentDiff(contentElement, hiddenContentElem, streamedResponseText);
                 scrollToBottom();
             }
@@ -392,42 +414,103 @@ async function renderAssistantMessage() {
         }
     };
 
-    try {
-        const response = await fetch('/chat', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ model: selectModel, messages: currentDialogMessages }),
+    // Post the message, or resume the stream from the last received frame
+    const fetchStream = () => {
+        if (!currentStreamID) {
+            return fetch('/chat', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ model: selectModel, dialog_id: currentDialogID, message: userMessage, stream_format: 'compact' }),
+                signal: controller.signal,
+            });
+        }
+
+        return fetch(`/chat/stream/${currentStreamID}`, {
+            headers: { 'Last-Event-ID': String(lastEventID) },
             signal: controller.signal,
         });
+    };
 
-        if (!response.ok) {
-            throw new Error(`Server returned error: ${response.status} ${response.statusText}`);
-        }
-        if (!response.body) {
-            throw new Error("Response body is empty. Try again later.");
+    currentStreamID = resumeStreamID;
+    for (let attempt = 0; attempt <= maxResumeAttempts; attempt++) {
+        let response;
+        try {
+            response = await fetchStream();
+        } catch (error) {
+            // The server could not be reached. Try to resume the stream
+            if (error.name !== 'AbortError' && currentStreamID && attempt < maxResumeAttempts) {
+                await new Promise((resolve) => setTimeout(resolve, 1000));
+                continue;
+            }
+
+            console.error("Error in renderAssistantMessage:", error);
+            loader.classList.add('hidden');
+            clearStreaming();
+            handleStreamError(error);
+            break;
         }
 
-        // Allow aborting
-        abortButtonElem.removeAttribute('disabled');
+        try {
+            // Too many requests are waiting for the model
+            if (response.status === 503) {
+                const data = await response.json();
+                loader.classList.add('hidden');
+                clearStreaming();
+                Flash.setMessage(data.message, 'error');
+                return;
+            }
 
-        // Process the stream
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
-        await processStream(reader, decoder);
+            // The stream has ended or is served by another worker
+            if (response.status === 404 && currentStreamID) {
+                throw new Error('The stream could not be resumed. Reload the page to see the saved reply.');
+            }
 
+            if (!response.ok) {
+                throw new Error(`Server returned error: ${response.status} ${response.statusText}`);
+            }
+            if (!response.body) {
+                throw new Error("Response body is empty. Try again later.");
+            }
 
-    } catch (error) {
-        console.error("Error in renderAssistantMessage:", error);
-        clearStreaming();
-        Flash.setMessage('An error occurred. Please try again.', 'error');
+            // Keep the stream ID, so the stream can be resumed after a page reload
+            if (!currentStreamID) {
+                currentStreamID = response.headers.get('X-Stream-ID');
+                sessionStorage.setItem(`stream-${currentDialogID}`, currentStreamID);
+            }
+
+            // Allow aborting
+            abortButtonElem.removeAttribute('disabled');
+
+            // Process the stream
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            await processStream(reader, decoder);
+            break;
+
+        } catch (error) {
+            // The connection dropped. Resume the stream from the last received frame
+            if (error.name !== 'AbortError' && error instanceof TypeError && currentStreamID && attempt < maxResumeAttempts) {
+                console.log('Resuming stream after frame', lastEventID);
+                continue;
+            }
+
+            console.error("Error in renderAssistantMessage:", error);
+            loader.classList.add('hidden');
+            clearStreaming();
+            handleStreamError(error);
+            break;
+        }
     }
 
+    sessionStorage.removeItem(`stream-${currentDialogID}`);
+    currentStreamID = null;
+    clearStreaming();
+
     // Enable buttons
     await addCopyButtons(contentElement, config);
 
-    // Save message to the dialog
+    // The server saves the assistant message to the dialog
     let assistantMessage = { role: 'assistant', content: streamedResponseText };
-    await createMessage(currentDialogID, assistantMessage);
 
     // Render copy message
     renderCopyMessage(container, streamedResponseText);
@@ -449,32 +532,93 @@ function scrollToBottom() {
 }
 
 /**
- * Load a saved conversation
+ * Render saved messages into an element
  */
-async function loadDialog(savedMessages) {
-
-    currentDialogMessages = savedMessages.slice();
-    responsesElem.innerHTML = '';
-
-    for (const msg of currentDialogMessages) {
+async function renderStaticMessages(messages, parentElem) {
+    for (const msg of messages) {
         if (msg.role === 'user') {
-            const message = msg.content;
-            renderStaticUserMessage(message);
+            renderStaticUserMessage(msg.content, parentElem);
         } else {
-            const message = msg.content;
-            await renderStaticAssistantMessage(message, 'Assistant');
+            await renderStaticAssistantMessage(msg.content, parentElem);
         }
     }
 }
 
+// Cursor of the next page of older messages. 0 if all messages are loaded
+let olderMessagesCursor = 0;
+let isLoadingOlderMessages = false;
+
+const loadOlderElem = document.createElement('div');
+loadOlderElem.classList.add('load-older', 'hidden');
+loadOlderElem.innerHTML = '<a href="#" class="action-link">Load older messages</a>';
+loadOlderElem.querySelector('a').addEventListener('click', async (e) => {
+    e.preventDefault();
+    await loadOlderMessages();
+});
+
+// Load older messages when the top of the dialog is scrolled into view
+const loadOlderObserver = new IntersectionObserver(async (entries) => {
+    if (entries.some(entry => entry.isIntersecting)) {
+        await loadOlderMessages();
+    }
+}, { root: responsesElem });
+
+/**
+ * Prepend the next page of older messages and keep the scroll position
+ */
+async function loadOlderMessages() {
+    if (!olderMessagesCursor || isLoadingOlderMessages) {
+        return;
+    }
+
+    isLoadingOlderMessages = true;
+    try {
+        const page = await getMessages(currentDialogID, olderMessagesCursor);
+        const fragment = document.createDocumentFragment();
+        await renderStaticMessages(page.messages, fragment);
+
+        const scrollHeight = responsesElem.scrollHeight;
+        loadOlderElem.after(fragment);
+        responsesElem.scrollTop += responsesElem.scrollHeight - scrollHeight;
+
+        currentDialogMessages = page.messages.concat(currentDialogMessages);
+        setOlderMessagesCursor(page.before);
+    } catch (error) {
+        console.error("Error in loadOlderMessages:", error);
+        Flash.setMessage('An error occurred. Please try again.', 'error');
+    } finally {
+        isLoadingOlderMessages = false;
+    }
+}
+
+function setOlderMessagesCursor(cursor) {
+    olderMessagesCursor = cursor;
+    loadOlderElem.classList.toggle('hidden', !cursor);
+}
+
+/**
+ * Load a saved conversation. Only the newest page is rendered, older pages are loaded on scroll
+ */
+async function loadDialog(page) {
+
+    currentDialogMessages = page.messages.slice();
+    responsesElem.innerHTML = '';
+    responsesElem.appendChild(loadOlderElem);
+
+    await renderStaticMessages(currentDialogMessages, responsesElem);
+
+    responsesElem.scrollTop = responsesElem.scrollHeight;
+    setOlderMessagesCursor(page.before);
+    loadOlderObserver.observe(loadOlderElem);
+}
+
 /**
  * Initialize the dialog
  */
 async function initializeDialog(dialogID) {
     try {
-        let allMessages = await getMessages(dialogID);
-        console.log('All messages:', allMessages);
-        await loadDialog(allMessages);
+        const page = await getMessages(dialogID);
+        await loadDialog(page);
     } catch (error) {
         console.error("Error in initializeDialog:", error);
         Flash.setMessage('An error occurred. Please try again.', 'error');
@@ -496,4 +640,15 @@ if (dialogID) {
     await initializeDialog(currentDialogID);
 
     loadingSpinner.classList.add('hidden');
+
+    // Resume a stream that was running when the page was reloaded.
+    // If the last message is from the assistant, the reply has already been saved.
+    const streamID = sessionStorage.getItem(`stream-${currentDialogID}`);
+    const lastMessage = currentDialogMessages[currentDialogMessages.length - 1];
+    if (streamID && lastMessage && lastMessage.role === 'user') {
+        setIsScrolling(true);
+        await renderAssistantMessage(lastMessage, streamID);
+    } else {
+        sessionStorage.removeItem(`stream-${currentDialogID}`);
+    }
 }
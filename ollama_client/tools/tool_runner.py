@@ -0,0 +1,80 @@
+"""
+Run tool calls requested by a model.
+
+The functions in config.TOOL_REGISTRY are called concurrently. Plain functions run in
+a bounded thread pool, so they never block the event loop, and coroutine functions
+are awaited. Every call has a timeout:
+
+```
+TOOL_TIMEOUT = 30  # seconds, default for all tools
+TOOL_TIMEOUTS = {"get_current_time": 5}  # per tool
+TOOL_MAX_WORKERS = 8  # threads per worker process
+```
+"""
+
+import asyncio
+import functools
+import inspect
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import config
+
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+TOOL_REGISTRY = getattr(config, "TOOL_REGISTRY", {})
+TOOL_TIMEOUT = getattr(config, "TOOL_TIMEOUT", 30)
+TOOL_TIMEOUTS = getattr(config, "TOOL_TIMEOUTS", {})
+TOOL_MAX_WORKERS = getattr(config, "TOOL_MAX_WORKERS", 8)
+
+_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="tool")
+
+
+async def run_tool_call(tool_call: dict) -> str:
+    """
+    Execute a single tool call and return the result as a string.
+    Errors and timeouts are returned as a result, so the model can respond to them.
+    """
+    func_name = tool_call["function"]["name"]
+    if func_name not in TOOL_REGISTRY:
+        return f"Unknown tool: {func_name}"
+
+    try:
+        args = json.loads(tool_call["function"]["arguments"] or "{}")
+    except json.JSONDecodeError:
+        return f"Invalid arguments for tool: {func_name}"
+
+    logger.info(f"Executing tool: {func_name}({args})")
+    func = TOOL_REGISTRY[func_name]
+    timeout = TOOL_TIMEOUTS.get(func_name, TOOL_TIMEOUT)
+
+    try:
+        if inspect.iscoroutinefunction(func):
+            result = await asyncio.wait_for(func(**args), timeout)
+        else:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(_executor, functools.partial(func, **args))
+            result = await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        logger.error(f"Tool timed out after {timeout}s: {func_name}")
+        return f"Tool call timed out: {func_name}"
+    except Exception:
+        logger.exception(f"Tool call failed: {func_name}")
+        return f"Tool call failed: {func_name}"
+
+    return str(result)
+
+
+async def run_tool_calls(tool_calls: list) -> list[str]:
+    """
+    Execute tool calls concurrently. Results are returned in the same order as the calls.
+    """
+    return await asyncio.gather(*[run_tool_call(tool_call) for tool_call in tool_calls])
+
+
+def shutdown() -> None:
+    """
+    Stop the thread pool without waiting for running tools
+    """
+    _executor.shutdown(wait=False, cancel_futures=True)
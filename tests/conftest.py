@@ -0,0 +1,64 @@
+import sqlite3
+import time
+from types import SimpleNamespace
+import pytest
+from ollama_client import migrations
+from ollama_client.core import session
+from ollama_client.database.migration import Migration
+
+
+@pytest.fixture
+def create_database():
+    """
+    Create a database at a path with all migrations and the user 1. Returns the path.
+    """
+
+    def create_database(path):
+        migration = Migration(path, migrations.migrations)
+        migration.run_migrations()
+        migration.close()
+
+        connection = sqlite3.connect(path)
+        connection.execute("INSERT INTO users (user_id, password_hash, email, random) VALUES (1, 'hash', 'a@example.com', 'random')")
+        connection.commit()
+        connection.close()
+        return path
+
+    return create_database
+
+
+@pytest.fixture
+def database(create_database, tmp_path):
+    """
+    Path of a database with all migrations and the user 1
+    """
+    return create_database(tmp_path / "test.db")
+
+
+@pytest.fixture
+def logged_in_request(database, monkeypatch):
+    """
+    Make fake requests of the logged in users 1 and 2 of the test database
+    """
+    connection = sqlite3.connect(database)
+    connection.execute("INSERT INTO users (user_id, password_hash, email, random) VALUES (2, 'hash', 'b@example.com', 'random')")
+    for user_id in [1, 2]:
+        connection.execute(
+            "INSERT INTO user_token (user_id, token, expires) VALUES (?, ?, ?)", (user_id, f"token-{user_id}", int(time.time()) + 60)
+        )
+    connection.commit()
+    connection.close()
+    monkeypatch.setattr(session, "DATABASE", database)
+
+    def logged_in_request(user_id: int = 1, path_params: dict | None = None, query_params: dict | None = None, body=None):
+        async def json():
+            return body
+
+        return SimpleNamespace(
+            session={"user_id": {"value": user_id}, "token": {"value": f"token-{user_id}"}},
+            path_params=path_params or {},
+            query_params=query_params or {},
+            json=json,
+        )
+
+    return logged_in_request
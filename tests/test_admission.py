@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from ollama_client.core import admission, providers, stream_buffer
+
+
+def test_concurrency_limit_per_model(monkeypatch):
+    monkeypatch.setattr(providers, "PROVIDERS", {"ollama": {"max_in_flight": 2}})
+    monkeypatch.setattr(providers, "MODELS", {"small": "ollama", "large": {"provider": "ollama", "max_in_flight": 1}})
+    monkeypatch.setattr(admission, "_controllers", {})
+
+    async def run():
+        assert admission.get_controller("small") is admission.get_controller("small")
+        assert admission.get_controller("small").max_in_flight == 2
+        assert admission.get_controller("large").max_in_flight == 1
+
+        small = [admission.get_controller("small").enqueue(user_id) for user_id in [1, 2, 3]]
+        large = [admission.get_controller("large").enqueue(user_id) for user_id in [1, 2]]
+
+        # The models have separate limits
+        assert [ticket.admitted for ticket in small] == [True, True, False]
+        assert [ticket.admitted for ticket in large] == [True, False]
+        assert small[2].position() == 1
+
+        small[0].release()
+        assert await small[2].wait(1)
+        assert admission.get_controller("small").in_flight == 2
+        assert not large[1].admitted
+
+    asyncio.run(run())
+
+
+def test_waiting_requests_are_admitted_round_robin():
+    async def run():
+        controller = admission.AdmissionController(max_in_flight=1)
+        running = controller.enqueue(1)
+        waiting = [controller.enqueue(1), controller.enqueue(1), controller.enqueue(1), controller.enqueue(2), controller.enqueue(2)]
+
+        # User 2 is not behind all the requests of user 1
+        assert [ticket.position() for ticket in waiting] == [1, 3, 5, 2, 4]
+
+        admitted = []
+        ticket = running
+        while True:
+            ticket.release()
+            admitted_now = [ticket for ticket in waiting if ticket.admitted and ticket not in admitted]
+            if not admitted_now:
+                break
+
+            assert len(admitted_now) == 1
+            ticket = admitted_now[0]
+            admitted.append(ticket)
+
+        return [ticket.user_id for ticket in admitted]
+
+    assert asyncio.run(run()) == [1, 2, 1, 2, 1]
+
+
+def test_queue_full():
+    async def run():
+        controller = admission.AdmissionController(max_in_flight=1, max_queue=2)
+        controller.enqueue(1)
+        waiting = [controller.enqueue(1), controller.enqueue(2)]
+
+        with pytest.raises(admission.QueueFull):
+            controller.enqueue(3)
+
+        # A waiting request that gives up makes room in the queue
+        waiting[0].release()
+        assert not controller.enqueue(3).admitted
+        assert controller.num_waiting == 2
+
+    asyncio.run(run())
+
+
+def test_ticket_is_released_when_the_stream_is_cancelled():
+    async def frames(ticket: admission.Ticket):
+        try:
+            await ticket.wait(60)
+            yield "data: {}\n\n"
+        finally:
+            ticket.release()
+
+    async def run():
+        controller = admission.AdmissionController(max_in_flight=1)
+        running = controller.enqueue(1)
+
+        # Cancelled while waiting in the queue
+        waiting = controller.enqueue(2)
+        buffer = stream_buffer.create(2)
+        buffer.start(frames(waiting), on_finish=waiting.release)
+        await asyncio.sleep(0.01)
+        buffer.cancel()
+        await asyncio.sleep(0.01)
+        assert waiting.released
+        assert controller.num_waiting == 0
+
+        # Cancelled before the stream has taken its first step, so the generator never runs
+        running.release()
+        ticket = controller.enqueue(3)
+        assert ticket.admitted
+        buffer = stream_buffer.create(3)
+        buffer.start(frames(ticket), on_finish=ticket.release)
+        buffer.cancel()
+        await asyncio.sleep(0.01)
+        assert buffer.finished
+        assert ticket.released
+        assert controller.in_flight == 0
+
+        # Releasing twice is a no-op
+        ticket.release()
+        assert controller.in_flight == 0
+
+    asyncio.run(run())
@@ -0,0 +1,63 @@
+import gzip
+import sqlite3
+import pytest
+from ollama_client.database import backup
+
+
+def _add_rows(path) -> None:
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("CREATE TABLE test (value TEXT)")
+    connection.executemany("INSERT INTO test (value) VALUES (?)", [("x" * 100,) for _ in range(2000)])
+    connection.commit()
+    connection.close()
+
+
+def _count_rows(path) -> int:
+    connection = sqlite3.connect(path)
+    num_rows = connection.execute("SELECT COUNT(*) FROM test").fetchone()[0]
+    connection.close()
+    return num_rows
+
+
+def test_backup(tmp_path, database):
+    _add_rows(database)
+    result = backup.backup(database, tmp_path / "backups" / "test.db", pages=10, sleep=0)
+
+    assert result["integrity_check"] == "ok"
+    assert result["pages"] > 10
+    assert _count_rows(tmp_path / "backups" / "test.db") == 2000
+    assert [path.name for path in (tmp_path / "backups").iterdir()] == ["test.db"]
+
+
+def test_compressed_backup(tmp_path, database):
+    _add_rows(database)
+    result = backup.backup(database, tmp_path / "test.db.gz", compress=True)
+
+    with gzip.open(tmp_path / "test.db.gz") as gzip_file, open(tmp_path / "restored.db", "wb") as file:
+        file.write(gzip_file.read())
+
+    assert result["size"] == (tmp_path / "test.db.gz").stat().st_size
+    assert _count_rows(tmp_path / "restored.db") == 2000
+    assert not (tmp_path / "test.db.partial").exists()
+
+
+def test_backup_copies_in_one_step_when_restarted_by_writes(tmp_path, database):
+    _add_rows(database)
+    writer = sqlite3.connect(database, isolation_level=None)
+
+    # Write between the steps of the backup, which starts the copy again
+    progress_call = backup._Progress.__call__
+
+    def write_and_progress(self, status, remaining, total):
+        writer.execute("INSERT INTO test (value) VALUES ('y')")
+        progress_call(self, status, remaining, total)
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(backup._Progress, "__call__", write_and_progress)
+        result = backup.backup(database, tmp_path / "copy.db", pages=5, sleep=0, max_restarts=2)
+
+    writer.close()
+    assert result["restarts"] == 3
+    assert result["integrity_check"] == "ok"
+    assert _count_rows(tmp_path / "copy.db") >= 2000
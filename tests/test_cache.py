@@ -0,0 +1,56 @@
+import asyncio
+from ollama_client.core import metrics
+from ollama_client.database import cache, connection_pool
+from ollama_client.database.cache import DatabaseCache
+
+CACHE_TABLE_SQL = """
+CREATE TABLE cache (
+  cache_id INTEGER PRIMARY KEY,
+  key TEXT NOT NULL UNIQUE,
+  value TEXT,
+  unix_timestamp INTEGER DEFAULT 0,
+  expires INTEGER NOT NULL DEFAULT 0,
+  version INTEGER NOT NULL DEFAULT 0
+) STRICT
+"""
+
+
+def _count(result: str) -> float:
+    return metrics.cache_requests_total.values.get((result,), 0)  # type: ignore[return-value]
+
+
+def test_set_get_and_sweep(tmp_path):
+    async def run():
+        pool = connection_pool.ConnectionPool(tmp_path / "test.db", 1, connection_pool.DATABASE_PRAGMAS)
+        async with pool.transaction() as connection:
+            await connection.execute(CACHE_TABLE_SQL)
+            await DatabaseCache(connection).set("a", {"value": 1})
+            await DatabaseCache(connection).set("b", {"value": 2}, ttl=60)
+
+        async with pool.read() as connection:
+            assert await DatabaseCache(connection).get("a") == {"value": 1}
+            assert await DatabaseCache(connection).get("a") == {"value": 1}
+            assert await DatabaseCache(connection).get("missing") is None
+
+        # A set by another process changes the version, so the parsed value in memory is not used
+        async with pool.transaction() as connection:
+            await connection.execute("UPDATE cache SET value = '{\"value\": 3}', version = version + 1 WHERE key = 'a'")
+            await connection.execute("UPDATE cache SET expires = 1 WHERE key = 'b'")
+
+        async with pool.read() as connection:
+            assert await DatabaseCache(connection).get("a") == {"value": 3}
+            assert await DatabaseCache(connection).get("b") is None
+
+        async with pool.transaction() as connection:
+            num_swept = await DatabaseCache(connection).sweep()
+            rows = await connection.fetchall("SELECT key FROM cache")
+
+        await pool.close()
+        return num_swept, [row["key"] for row in rows]
+
+    cache._memory_cache.clear()
+    memory_hits, database_hits = _count("memory_hit"), _count("database_hit")
+
+    assert asyncio.run(run()) == (1, ["a"])
+    assert _count("memory_hit") - memory_hits == 1
+    assert _count("database_hit") - database_hits == 2
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import sqlite3
+import pytest
+from ollama_client.database import connection_pool
+from ollama_client.core import admission
+from ollama_client.endpoints import endpoints_chat
+from ollama_client.models import chat_model
+
+
+@pytest.fixture(autouse=True)
+def chat_database(database, monkeypatch):
+    monkeypatch.setattr(chat_model, "DATABASE", database)
+    monkeypatch.setattr(chat_model, "_dialog_history_cache", chat_model.LRUCache(16))
+
+
+def _add_dialogs(path, num_dialogs: int) -> list:
+    """
+    Add dialogs of the user 1 with tied created times. Returns the dialog ids newest first.
+    """
+    connection = sqlite3.connect(path)
+    dialogs = [(f"dialog-{number:02}", f"2025-01-01 10:00:0{number % 3}") for number in range(num_dialogs)]
+    connection.executemany("INSERT INTO dialog (dialog_id, user_id, title, created) VALUES (?, 1, 'Dialog', ?)", dialogs)
+    connection.execute("INSERT INTO user_dialog_count (user_id, num_dialogs) VALUES (1, ?)", (num_dialogs,))
+    connection.commit()
+    connection.close()
+    return [dialog_id for dialog_id, _ in sorted(dialogs, key=lambda dialog: (dialog[1], dialog[0]), reverse=True)]
+
+
+def _run(coroutine_function):
+    async def run():
+        try:
+            return await coroutine_function()
+        finally:
+            await connection_pool.close()
+
+    return asyncio.run(run())
+
+
+def test_dialog_pages_forward_and_back(database, logged_in_request):
+    dialog_ids = _add_dialogs(database, 35)
+
+    async def walk():
+        forward = [await chat_model.get_dialogs_info(logged_in_request())]
+        while forward[-1]["has_next"]:
+            forward.append(await chat_model.get_dialogs_info(logged_in_request(query_params={"before": forward[-1]["next_cursor"]})))
+
+        back = [forward[-1]]
+        while back[-1]["has_prev"]:
+            back.append(await chat_model.get_dialogs_info(logged_in_request(query_params={"after": back[-1]["prev_cursor"]})))
+
+        invalid = await chat_model.get_dialogs_info(logged_in_request(query_params={"before": "invalid", "after": "invalid"}))
+        other_user = await chat_model.get_dialogs_info(logged_in_request(user_id=2))
+        return forward, back, invalid, other_user
+
+    forward, back, invalid, other_user = _run(walk)
+
+    def ids(page: dict) -> list:
+        return [dialog["dialog_id"] for dialog in page["dialogs"]]
+
+    assert [len(page["dialogs"]) for page in forward] == [10, 10, 10, 5]
+    assert sum([ids(page) for page in forward], []) == dialog_ids
+    assert [(page["has_prev"], page["has_next"]) for page in forward] == [(False, True), (True, True), (True, True), (True, False)]
+    assert [ids(page) for page in back] == [ids(page) for page in reversed(forward)]
+    assert [(page["has_prev"], page["has_next"]) for page in back] == [(True, False), (True, True), (True, True), (False, True)]
+    assert all(page["num_dialogs"] == 35 for page in forward)
+
+    # An invalid cursor is the first page
+    assert ids(invalid) == ids(forward[0])
+    assert other_user["dialogs"] == []
+    assert other_user["num_dialogs"] == 0
+
+
+def test_dialog_count_on_create_and_delete(logged_in_request):
+    async def run():
+        dialog_ids = [await chat_model.create_dialog(logged_in_request(body={"title": f"Dialog {number}"})) for number in range(3)]
+        after_create = await chat_model.get_dialogs_info(logged_in_request())
+
+        await chat_model.delete_dialog(logged_in_request(path_params={"dialog_id": dialog_ids[0]}))
+        after_delete = await chat_model.get_dialogs_info(logged_in_request())
+
+        # Another user can not delete the dialog, and the counts do not change
+        with pytest.raises(chat_model.UserValidate):
+            await chat_model.delete_dialog(logged_in_request(user_id=2, path_params={"dialog_id": dialog_ids[1]}))
+        other_user = await chat_model.get_dialogs_info(logged_in_request(user_id=2))
+        return after_create, after_delete, other_user, await chat_model.get_dialogs_info(logged_in_request())
+
+    after_create, after_delete, other_user, final = _run(run)
+
+    assert after_create["num_dialogs"] == 3
+    assert after_delete["num_dialogs"] == 2
+    assert len(after_delete["dialogs"]) == 2
+    assert other_user["num_dialogs"] == 0
+    assert final["num_dialogs"] == 2
+
+
+def _add_messages(path, dialog_id: str, user_id: int, num_messages: int) -> None:
+    connection = sqlite3.connect(path)
+    connection.execute("INSERT INTO dialog (dialog_id, user_id, title) VALUES (?, ?, 'Dialog')", (dialog_id, user_id))
+    messages = [(dialog_id, user_id, f"Message {number}") for number in range(num_messages)]
+    connection.executemany("INSERT INTO message (dialog_id, user_id, role, content) VALUES (?, ?, 'user', ?)", messages)
+    connection.commit()
+    connection.close()
+
+
+def test_message_pages(database, logged_in_request, monkeypatch):
+    monkeypatch.setattr(chat_model, "MESSAGES_PER_PAGE", 4)
+    _add_messages(database, "dialog-1", 1, 10)
+    _add_messages(database, "dialog-2", 2, 3)
+
+    async def run():
+        pages = [await chat_model.get_messages(logged_in_request(path_params={"dialog_id": "dialog-1"}))]
+        while pages[-1]["before"]:
+            query_params = {"before": pages[-1]["before"]}
+            pages.append(await chat_model.get_messages(logged_in_request(path_params={"dialog_id": "dialog-1"}, query_params=query_params)))
+
+        other_user = await chat_model.get_messages(logged_in_request(path_params={"dialog_id": "dialog-2"}))
+        for limit in ["0", "-1", "x"]:
+            with pytest.raises(chat_model.UserValidate):
+                await chat_model.get_messages(logged_in_request(path_params={"dialog_id": "dialog-1"}, query_params={"limit": limit}))
+        return pages, other_user
+
+    pages, other_user = _run(run)
+
+    # Pages are newest first and the messages of a page oldest first
+    contents = [[message["content"] for message in page["messages"]] for page in pages]
+    assert contents == [[f"Message {number}" for number in numbers] for numbers in [range(6, 10), range(2, 6), range(0, 2)]]
+    assert [page["before"] for page in pages] == [7, 3, 0]
+    assert other_user == {"messages": [], "before": 0}
+
+
+def test_dialog_history_cache(database, logged_in_request):
+    _add_messages(database, "dialog-1", 1, 2)
+
+    async def run():
+        first = await chat_model.get_dialog_history(1, "dialog-1")
+        first.append({"role": "user", "content": "Not saved"})
+
+        # Rows that are cached are not read again, so a changed old row is not seen
+        connection = sqlite3.connect(database)
+        connection.execute("UPDATE message SET content = 'Changed' WHERE message_id = 1")
+        connection.execute("INSERT INTO message (dialog_id, user_id, role, content) VALUES ('dialog-1', 1, 'assistant', 'Reply')")
+        connection.commit()
+        connection.close()
+        second = await chat_model.get_dialog_history(1, "dialog-1")
+
+        with pytest.raises(chat_model.UserValidate):
+            await chat_model.get_dialog_history(2, "dialog-1")
+        return second
+
+    second = _run(run)
+
+    assert second == [
+        {"role": "user", "content": "Message 0"},
+        {"role": "user", "content": "Message 1"},
+        {"role": "assistant", "content": "Reply"},
+    ]
+    assert chat_model._dialog_history_cache.get("dialog-1")["last_message_id"] == 3
+
+
+@pytest.mark.parametrize(
+    "body",
+    [{"dialog_id": "dialog-1"}, {"dialog_id": "dialog-1", "message": "Hi"}, {"dialog_id": "dialog-1", "message": {"content": None}}, {}],
+)
+def test_chat_request_without_valid_messages(database, logged_in_request, monkeypatch, body):
+    _add_messages(database, "dialog-1", 1, 0)
+
+    async def get_model_names():
+        return ["test-model"]
+
+    monkeypatch.setattr(endpoints_chat, "_get_model_names", get_model_names)
+    monkeypatch.setattr(admission, "_controllers", {})
+
+    response = _run(lambda: endpoints_chat.chat_response_stream(logged_in_request(body={**body, "model": "test-model"})))
+
+    assert response.status_code == 400
+    assert json.loads(response.body)["error"]
+    assert admission.get_controller("test-model").in_flight == 0
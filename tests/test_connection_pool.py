@@ -0,0 +1,126 @@
+import asyncio
+import sqlite3
+import pytest
+from ollama_client.database import connection_pool
+
+
+def _create_pool(tmp_path) -> connection_pool.ConnectionPool:
+    return connection_pool.ConnectionPool(tmp_path / "test.db", 2, connection_pool.DATABASE_PRAGMAS)
+
+
+def test_pragmas_are_applied(tmp_path):
+    async def run():
+        pool = _create_pool(tmp_path)
+        async with pool.transaction() as connection:
+            foreign_keys = await connection.fetchone("PRAGMA foreign_keys")
+            journal_mode = await connection.fetchone("PRAGMA journal_mode")
+        await pool.close()
+        return foreign_keys[0], journal_mode[0]
+
+    assert asyncio.run(run()) == (1, "wal")
+
+
+def test_concurrent_transactions_wait_for_each_other(tmp_path):
+    async def write(pool, value: int):
+        async with pool.transaction() as connection:
+            await connection.execute("INSERT INTO test (value) VALUES (:value)", {"value": value})
+            await asyncio.sleep(0.01)
+
+    async def run():
+        pool = _create_pool(tmp_path)
+        async with pool.transaction() as connection:
+            await connection.execute("CREATE TABLE test (value INTEGER)")
+
+        await asyncio.gather(*[write(pool, value) for value in range(10)])
+        async with pool.transaction() as connection:
+            rows = await connection.fetchall("SELECT value FROM test ORDER BY value")
+        await pool.close()
+        return [row["value"] for row in rows]
+
+    assert asyncio.run(run()) == list(range(10))
+
+
+def test_failed_transaction_is_rolled_back(tmp_path):
+    async def run():
+        pool = _create_pool(tmp_path)
+        async with pool.transaction() as connection:
+            await connection.execute("CREATE TABLE test (value INTEGER)")
+
+        with pytest.raises(ValueError):
+            async with pool.transaction() as connection:
+                await connection.execute("INSERT INTO test (value) VALUES (1)")
+                raise ValueError("Fail")
+
+        async with pool.transaction() as connection:
+            row = await connection.fetchone("SELECT COUNT(*) AS num_rows FROM test")
+        num_idle = len(pool.write_connections)
+        await pool.close()
+        return row["num_rows"], num_idle
+
+    # The connection is reused after the rollback
+    assert asyncio.run(run()) == (0, 1)
+
+
+def test_read_does_not_wait_for_writer(tmp_path):
+    async def run():
+        pool = _create_pool(tmp_path)
+        async with pool.transaction() as connection:
+            await connection.execute("CREATE TABLE test (value INTEGER)")
+            await connection.execute("INSERT INTO test (value) VALUES (1)")
+
+        async with pool.transaction() as connection:
+            await connection.execute("INSERT INTO test (value) VALUES (2)")
+
+            # The read sees the last commit and does not wait for the open write transaction
+            async with pool.read() as read_connection:
+                row = await asyncio.wait_for(read_connection.fetchone("SELECT COUNT(*) AS num_rows FROM test"), 1)
+
+        await pool.close()
+        return row["num_rows"]
+
+    assert asyncio.run(run()) == 1
+
+
+def test_read_connection_can_not_write(tmp_path):
+    async def run():
+        pool = _create_pool(tmp_path)
+        async with pool.transaction() as connection:
+            await connection.execute("CREATE TABLE test (value INTEGER)")
+
+        try:
+            with pytest.raises(sqlite3.OperationalError):
+                async with pool.read() as connection:
+                    await connection.execute("INSERT INTO test (value) VALUES (1)")
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def test_optimize_keeps_read_connections_read_only(tmp_path):
+    async def run():
+        pool = _create_pool(tmp_path)
+        async with pool.transaction() as connection:
+            await connection.execute("CREATE TABLE test (value INTEGER)")
+            await connection.execute("CREATE INDEX test_value ON test (value)")
+            await connection.executemany("INSERT INTO test (value) VALUES (?)", [(value % 10,) for value in range(1000)])
+
+        async with pool.read() as connection:
+            await connection.fetchall("SELECT * FROM test WHERE value = 1")
+
+        await pool.optimize()
+        async with pool.autocommit() as connection:
+            checkpoint = await connection.fetchone("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        try:
+            with pytest.raises(sqlite3.OperationalError):
+                async with pool.read() as connection:
+                    await connection.execute("INSERT INTO test (value) VALUES (1)")
+
+            async with pool.read() as connection:
+                stats = await connection.fetchall("SELECT tbl FROM sqlite_stat1")
+        finally:
+            await pool.close()
+        return checkpoint[0], [row["tbl"] for row in stats]
+
+    assert asyncio.run(run()) == (0, ["test"])
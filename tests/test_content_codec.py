@@ -0,0 +1,61 @@
+import asyncio
+import sqlite3
+from ollama_client.database import connection_pool, content_codec
+from ollama_client.endpoints import endpoints_chat  # noqa: F401
+from ollama_client.models import chat_model
+
+
+def test_encode_decode():
+    content = "Hello world. " * 100
+    encoded = content_codec.encode(content, threshold=100)
+
+    assert encoded.startswith(content_codec.MARKER)
+    assert len(encoded) < len(content)
+    assert content_codec.decode(encoded) == content
+
+
+def test_encode_below_threshold():
+    content = "Hello world. " * 100
+
+    assert content_codec.encode(content, threshold=0) == content
+    assert content_codec.encode(content, threshold=len(content)) == content
+    assert content_codec.decode(content) == content
+
+
+def test_encode_incompressible():
+    content = "a1b2c3"
+
+    assert content_codec.encode(content, threshold=1) == content
+
+
+def test_encode_marked_content():
+    content = content_codec.MARKER + "not compressed"
+    encoded = content_codec.encode(content, threshold=0)
+
+    assert encoded != content
+    assert content_codec.decode(encoded) == content
+
+
+def test_recompress_messages(database, monkeypatch):
+    connection = sqlite3.connect(database)
+    connection.execute("INSERT INTO dialog (dialog_id, user_id, title) VALUES ('dialog-1', 1, 'Dialog')")
+    rows = [("Hello world. " * 500,)] * 100 + [("Hi",)]
+    connection.executemany("INSERT INTO message (dialog_id, user_id, role, content) VALUES ('dialog-1', 1, 'user', ?)", rows)
+    connection.commit()
+    connection.close()
+
+    monkeypatch.setattr(chat_model, "DATABASE", database)
+    monkeypatch.setattr(content_codec.encode, "__defaults__", (100,))
+
+    async def run():
+        try:
+            return await chat_model.recompress_messages(batch_size=10)
+        finally:
+            await connection_pool.close()
+
+    result = asyncio.run(run())
+
+    # The sizes are of the database pages in use. Partly filled pages are not freed, so less is saved
+    # than the message contents shrink.
+    assert result["messages"] == 100
+    assert 0 < result["size_before"] - result["size_after"] < 100 * len("Hello world. " * 500)
@@ -0,0 +1,33 @@
+import asyncio
+from ollama_client.database import connection_pool
+from ollama_client.database.crud import CRUD
+from ollama_client.database.sql_builder import SQLBuilder
+
+
+def test_upsert_sql():
+    query = SQLBuilder("cache").build_upsert({"key": "a", "value": "b"}, ["key"])
+    assert query == "INSERT INTO cache (key, value) VALUES (:key, :value) ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+
+
+def test_insert_many_and_replace(tmp_path):
+    async def run():
+        pool = connection_pool.ConnectionPool(tmp_path / "test.db", 1, connection_pool.DATABASE_PRAGMAS)
+        async with pool.transaction() as connection:
+            await connection.execute("CREATE TABLE test (key TEXT NOT NULL UNIQUE, value TEXT)")
+            crud = CRUD(connection)
+
+            # Rows with different columns are kept in order
+            await crud.insert_many("test", [{"key": "a", "value": "1"}, {"key": "b"}, {"key": "c", "value": "3"}])
+            await crud.replace("test", {"value": "2"}, {"key": "b"})
+            await crud.replace("test", {"value": "4"}, {"key": "d"})
+            rows = await crud.select("test", order_by=[("key", "ASC")])
+
+        await pool.close()
+        return rows
+
+    assert asyncio.run(run()) == [
+        {"key": "a", "value": "1"},
+        {"key": "b", "value": "2"},
+        {"key": "c", "value": "3"},
+        {"key": "d", "value": "4"},
+    ]
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import sqlite3
+from types import SimpleNamespace
+from ollama_client.database import connection_pool
+from ollama_client.endpoints import endpoints_chat
+from ollama_client.models import export_model
+
+
+def _add_dialogs(path) -> None:
+    connection = sqlite3.connect(path)
+    for index in range(5):
+        dialog_id = f"dialog-{index}"
+        created = f"2025-01-0{index + 1} 10:00:00"
+        connection.execute(
+            "INSERT INTO dialog (dialog_id, user_id, title, created) VALUES (?, 1, ?, ?)", (dialog_id, f"Dialog {index}", created)
+        )
+        for number in range(index):
+            content = f"Message {number} æøå\nwith a new line"
+            connection.execute(
+                "INSERT INTO message (dialog_id, user_id, role, content, created) VALUES (?, 1, ?, ?, ?)",
+                (dialog_id, "user" if number % 2 else "assistant", content, created),
+            )
+    connection.execute("INSERT INTO user_dialog_count (user_id, num_dialogs) VALUES (1, 5)")
+    connection.commit()
+    connection.close()
+
+
+def _num_dialogs(path) -> int:
+    connection = sqlite3.connect(path)
+    row = connection.execute("SELECT num_dialogs FROM user_dialog_count WHERE user_id = 1").fetchone()
+    connection.close()
+    return row[0]
+
+
+async def _export(monkeypatch, path) -> str:
+    monkeypatch.setattr(export_model, "DATABASE", path)
+    return "".join([chunk async for chunk in export_model.export_dialogs(1)])
+
+
+async def _import(monkeypatch, path, exported: str) -> dict:
+    monkeypatch.setattr(export_model, "DATABASE", path)
+    return await export_model.import_dialogs(1, exported.splitlines(), batch_size=3)
+
+
+def test_export_and_import_round_trip(tmp_path, monkeypatch, create_database):
+    source = create_database(tmp_path / "source.db")
+    target = create_database(tmp_path / "target.db")
+    _add_dialogs(source)
+
+    # Small batches, so dialogs and their messages are split over batches
+    monkeypatch.setattr(export_model, "EXPORT_BATCH_SIZE", 2)
+
+    async def run():
+        try:
+            exported = await _export(monkeypatch, source)
+            result = await _import(monkeypatch, target, exported)
+            reexported = await _export(monkeypatch, target)
+
+            # Importing again adds nothing
+            result_again = await _import(monkeypatch, target, exported)
+
+            # Only a dialog that is missing is imported
+            connection = sqlite3.connect(target)
+            connection.execute("PRAGMA foreign_keys = ON")
+            connection.execute("DELETE FROM dialog WHERE dialog_id = 'dialog-3'")
+            connection.execute("UPDATE user_dialog_count SET num_dialogs = 4")
+            connection.commit()
+            connection.close()
+            result_missing = await _import(monkeypatch, target, exported)
+
+            return exported, reexported, result, result_again, result_missing, await _export(monkeypatch, target)
+        finally:
+            await connection_pool.close()
+
+    exported, reexported, result, result_again, result_missing, final = asyncio.run(run())
+
+    lines = [json.loads(line) for line in exported.splitlines()]
+    assert [line["dialog_id"] for line in lines if line["type"] == "dialog"] == [f"dialog-{index}" for index in range(5)]
+    assert sum(1 for line in lines if line["type"] == "message") == 10
+
+    assert result == {"dialogs": 5, "messages": 10, "skipped_dialogs": 0}
+    assert reexported == exported
+    assert result_again == {"dialogs": 0, "messages": 0, "skipped_dialogs": 5}
+    assert result_missing == {"dialogs": 1, "messages": 3, "skipped_dialogs": 4}
+    assert final == exported
+    assert _num_dialogs(target) == 5
+
+
+def test_export_and_import_require_login():
+    response = asyncio.run(endpoints_chat.export_dialogs(SimpleNamespace(session={})))
+    assert response.status_code == 401
+    response = asyncio.run(endpoints_chat.import_dialogs(SimpleNamespace(session={})))
+    assert response.status_code == 401
+
+
+def test_import_request_body(tmp_path, monkeypatch, create_database, database, logged_in_request):
+    source = create_database(tmp_path / "source.db")
+    _add_dialogs(source)
+
+    def request(body: bytes):
+        async def stream():
+            # Chunks that split lines and multi-byte characters
+            for start in range(0, len(body), 7):
+                yield body[start : start + 7]
+
+        request = logged_in_request()
+        request.stream = stream
+        return request
+
+    async def run():
+        try:
+            exported = await _export(monkeypatch, source)
+            monkeypatch.setattr(export_model, "DATABASE", database)
+            response = await endpoints_chat.import_dialogs(request(exported.encode()))
+            invalid = await endpoints_chat.import_dialogs(request(b'{"type": "message"}\n'))
+
+            monkeypatch.setattr(export_model.read_lines, "__defaults__", (10,))
+            too_long = await endpoints_chat.import_dialogs(request(exported.encode()))
+            return exported, response, invalid, too_long, await _export(monkeypatch, database)
+        finally:
+            await connection_pool.close()
+
+    exported, response, invalid, too_long, imported = asyncio.run(run())
+
+    assert json.loads(response.body) == {
+        "error": False,
+        "redirect": "/user/dialogs",
+        "dialogs": 5,
+        "messages": 10,
+        "skipped_dialogs": 0,
+    }
+    assert imported == exported
+    assert invalid.status_code == 400
+    assert json.loads(invalid.body)["message"] == "Line 1 is not a dialog or a message"
+    assert too_long.status_code == 400
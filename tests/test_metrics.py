@@ -0,0 +1,58 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.testclient import TestClient
+from ollama_client.core import metrics, providers
+from ollama_client.endpoints.endpoints_metrics import routes_metrics
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch, tmp_path):
+    """
+    Register the metrics of a test in a fresh registry, so they are not rendered by other scrapes
+    """
+    monkeypatch.setattr(metrics, "_registry", {})
+    monkeypatch.setattr(metrics, "METRICS_DIR", tmp_path / "metrics")
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_seconds", "Test histogram", ["model"], buckets=(0.1, 1.0))
+    for value in [0.05, 0.5, 0.7, 5.0]:
+        histogram.observe(value, model="a")
+
+    lines = metrics.render().splitlines()
+    assert 'ollama_client_test_seconds_bucket{model="a",le="0.1"} 1' in lines
+    assert 'ollama_client_test_seconds_bucket{model="a",le="1.0"} 3' in lines
+    assert 'ollama_client_test_seconds_bucket{model="a",le="+Inf"} 4' in lines
+    assert 'ollama_client_test_seconds_count{model="a"} 4' in lines
+
+
+def test_counter_labels():
+    counter = metrics.Counter("test_total", "Test counter", ["status"])
+    counter.inc(status="ok")
+    counter.inc(2, status="ok")
+    assert 'ollama_client_test_total{status="ok"} 3' in metrics.render().splitlines()
+
+
+def test_unknown_label_values_are_other(monkeypatch):
+    monkeypatch.setattr(providers, "MODELS", {"llama3.2": "ollama"})
+
+    assert metrics.model_label("llama3.2") == "llama3.2"
+    assert metrics.model_label("made-up-model") == "other"
+    assert metrics.method_label("GET") == "GET"
+    assert metrics.method_label("MADEUP") == "other"
+
+
+def test_metrics_require_token(monkeypatch):
+    metrics.Counter("test_total", "Test counter").inc()
+    client = TestClient(Starlette(routes=routes_metrics))
+
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "")
+    assert client.get("/metrics").status_code == 404
+
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "secret")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+    response = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert "ollama_client_test_total 1" in response.text.splitlines()
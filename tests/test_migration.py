@@ -0,0 +1,16 @@
+from ollama_client.database.migration import Migration
+
+
+def test_split_statements_keeps_triggers_whole(tmp_path):
+    sql = """
+CREATE TABLE a (value TEXT);
+CREATE TRIGGER a_insert AFTER INSERT ON a BEGIN
+  INSERT INTO a (value) VALUES ('x'); SELECT 1;
+END;
+"""
+    statements = [statement.strip() for statement in Migration(tmp_path / "test.db", {})._split_statements(sql)]
+    assert statements == [
+        "CREATE TABLE a (value TEXT)",
+        "CREATE TRIGGER a_insert AFTER INSERT ON a BEGIN\n  INSERT INTO a (value) VALUES ('x'); SELECT 1;\nEND",
+        "",
+    ]
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import time
+import httpx
+import pytest
+from openai import AsyncOpenAI
+from ollama_client.core import providers
+
+
+def _sse_chunk(content: str) -> bytes:
+    data = {
+        "id": "chunk",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "test-model",
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+    }
+    return f"data: {json.dumps(data)}\n\n".encode()
+
+
+class _FakeEndpoint:
+    """
+    Serves chat completions with an httpx MockTransport and counts the requests
+    """
+
+    def __init__(self, status_code: int = 200, fail_after_first_chunk: bool = False, connect_error: bool = False):
+        self.status_code = status_code
+        self.fail_after_first_chunk = fail_after_first_chunk
+        self.connect_error = connect_error
+        self.requests = 0
+
+    async def stream(self):
+        yield _sse_chunk("Hello")
+        if self.fail_after_first_chunk:
+            raise httpx.ReadError("Connection lost")
+        yield _sse_chunk(" world")
+        yield b"data: [DONE]\n\n"
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.connect_error:
+            raise httpx.ConnectError("Connection refused")
+        if self.status_code != 200:
+            return httpx.Response(self.status_code, json={"error": {"message": "Failed"}})
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=self.stream())
+
+    def create(self, name: str, provider_info: dict) -> providers.Endpoint:
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+        client = AsyncOpenAI(api_key="test", base_url=f"http://{name}/v1", http_client=http_client, max_retries=0)
+        return providers.Endpoint("test", f"http://{name}/v1", client, provider_info)
+
+
+@pytest.fixture
+def set_endpoints(monkeypatch):
+    def set_endpoints(fake_endpoints: list, provider_info: dict | None = None) -> list:
+        endpoints = [fake.create(f"gpu-{index}", provider_info or {}) for index, fake in enumerate(fake_endpoints)]
+        monkeypatch.setitem(providers._endpoints, "test", endpoints)
+        return endpoints
+
+    return set_endpoints
+
+
+CHAT_ARGS = {"model": "test-model", "messages": [{"role": "user", "content": "Hi"}], "stream": True}
+
+
+async def _read(stream: providers.ChatStream) -> str:
+    try:
+        return "".join([chunk.choices[0].delta.content async for chunk in stream])
+    finally:
+        await stream.close()
+
+
+def test_least_outstanding_endpoint_is_picked(set_endpoints):
+    fakes = [_FakeEndpoint(), _FakeEndpoint()]
+    endpoints = set_endpoints(fakes)
+    endpoints[0].outstanding = 2
+    endpoints[1].outstanding = 1
+
+    async def run():
+        stream = await providers.stream_chat_completion("test", CHAT_ARGS)
+        assert stream.endpoint is endpoints[1]
+        assert endpoints[1].outstanding == 2
+        assert await _read(stream) == "Hello world"
+
+    asyncio.run(run())
+
+    assert [fake.requests for fake in fakes] == [0, 1]
+    assert endpoints[1].outstanding == 1
+
+    # An endpoint that is down is skipped, unless all endpoints are down
+    endpoints[1].down_until = time.monotonic() + 60
+    assert providers._pick_endpoint(endpoints, []) is endpoints[0]
+    endpoints[0].down_until = time.monotonic() + 60
+    assert providers._pick_endpoint(endpoints, []) is endpoints[1]
+
+
+@pytest.mark.parametrize("failing", [_FakeEndpoint(status_code=500), _FakeEndpoint(connect_error=True)])
+def test_failover_before_first_chunk(set_endpoints, failing):
+    fakes = [failing, _FakeEndpoint()]
+    endpoints = set_endpoints(fakes)
+
+    async def run():
+        stream = await providers.stream_chat_completion("test", CHAT_ARGS)
+        assert stream.endpoint is endpoints[1]
+        assert await _read(stream) == "Hello world"
+
+    asyncio.run(run())
+
+    assert [fake.requests for fake in fakes] == [1, 1]
+    assert endpoints[0].failures == 1
+    assert [endpoint.outstanding for endpoint in endpoints] == [0, 0]
+
+
+def test_all_endpoints_failing(set_endpoints):
+    fakes = [_FakeEndpoint(status_code=500), _FakeEndpoint(status_code=500)]
+    set_endpoints(fakes)
+
+    with pytest.raises(providers.InternalServerError):
+        asyncio.run(providers.stream_chat_completion("test", CHAT_ARGS))
+
+    assert [fake.requests for fake in fakes] == [1, 1]
+
+
+def test_no_failover_after_first_chunk(set_endpoints):
+    fakes = [_FakeEndpoint(fail_after_first_chunk=True), _FakeEndpoint()]
+    endpoints = set_endpoints(fakes)
+    endpoints[1].outstanding = 1
+
+    async def run():
+        stream = await providers.stream_chat_completion("test", CHAT_ARGS)
+        assert stream.endpoint is endpoints[0]
+        with pytest.raises(httpx.ReadError):
+            await _read(stream)
+
+    asyncio.run(run())
+
+    assert [fake.requests for fake in fakes] == [1, 0]
+    assert endpoints[0].outstanding == 0
+
+
+def test_endpoint_is_marked_down_until_cooldown(set_endpoints):
+    fakes = [_FakeEndpoint(status_code=500), _FakeEndpoint()]
+    endpoints = set_endpoints(fakes, {"max_failures": 2, "failure_cooldown": 30})
+
+    async def run() -> providers.Endpoint:
+        stream = await providers.stream_chat_completion("test", CHAT_ARGS)
+        await _read(stream)
+        return stream.endpoint
+
+    # The first failure does not mark the endpoint down
+    assert asyncio.run(run()) is endpoints[1]
+    assert endpoints[0].is_available()
+
+    assert asyncio.run(run()) is endpoints[1]
+    assert not endpoints[0].is_available()
+
+    # While it is down, requests go to the other endpoint without trying it
+    assert asyncio.run(run()) is endpoints[1]
+    assert fakes[0].requests == 2
+
+    # After the cooldown it is tried again, and a success marks it up
+    assert 29 < endpoints[0].down_until - time.monotonic() <= 30
+    endpoints[0].down_until = time.monotonic() - 1
+    assert endpoints[0].is_available()
+
+    fakes[0].status_code = 200
+    assert asyncio.run(run()) is endpoints[0]
+    assert endpoints[0].failures == 0
+    assert endpoints[0].down_until == 0.0
@@ -0,0 +1,101 @@
+import asyncio
+import sqlite3
+from ollama_client.database import connection_pool, content_codec, write_behind
+from ollama_client.database.database_utils import DatabaseConnection
+from ollama_client.endpoints import endpoints_chat  # noqa: F401
+from ollama_client.models import search_model
+
+LONG_CONTENT = "Cooking tips for the weekend. " * 20 + "Fry the fish in butter. " + "Serve it warm with bread. " * 20
+
+
+def _add_dialog(path) -> None:
+    connection = sqlite3.connect(path)
+    connection.execute("INSERT INTO dialog (dialog_id, user_id, title) VALUES ('dialog-1', 1, 'Dinner')")
+    connection.commit()
+    connection.close()
+
+
+def _add_message(path, content: str) -> None:
+    # A connection without any functions of the app
+    connection = sqlite3.connect(path)
+    connection.execute("INSERT INTO message (dialog_id, user_id, role, content) VALUES ('dialog-1', 1, 'user', ?)", (content,))
+    connection.commit()
+    connection.close()
+
+
+def test_snippet():
+    assert search_model._snippet("Ærlig talt, en Café!", "cafe") == "Ærlig talt, en \x02Café\x03"
+    assert search_model._snippet("fish fisher fishing", "fish") == "\x02fish\x03 \x02fisher\x03 \x02fishing\x03"
+    assert search_model._snippet("fish fisher fishing", "fish fisher") == "\x02fish\x03 \x02fisher\x03 fishing"
+    assert search_model._snippet("fisher fish", "fish tank") == "fisher \x02fish\x03"
+
+    # The window starts a few words before the first match
+    snippet = search_model._snippet(LONG_CONTENT, "fish")
+    assert (
+        snippet
+        == "…tips for the weekend. Fry the \x02fish\x03 in butter." + " Serve it warm with bread." * 2 + " Serve it warm with bread…"
+    )
+
+
+def test_messages_are_indexed_by_the_app(database, monkeypatch):
+    _add_dialog(database)
+    monkeypatch.setattr(search_model, "DATABASE", database)
+    monkeypatch.setattr(write_behind._write_behind_queue, "database_url", database)
+
+    async def run():
+        try:
+            write_behind.insert("message", {"dialog_id": "dialog-1", "user_id": 1, "role": "user", "content": "Fish for dinner"})
+            write_behind.insert(
+                "message", {"dialog_id": "dialog-1", "user_id": 1, "role": "user", "content": content_codec.encode(LONG_CONTENT, 100)}
+            )
+            await write_behind.flush()
+            found = await search_model.search(1, "butter")
+            not_found = await search_model.search(1, "cooking dinner")
+
+            database_connection = DatabaseConnection(database)
+            async with database_connection.async_transaction_scope() as connection:
+                await search_model.unindex_dialog_messages(connection, "dialog-1")
+                await connection.execute("DELETE FROM message")
+                await connection.execute("INSERT INTO message_fts (message_fts) VALUES ('integrity-check')")
+
+            return found, not_found, await search_model.search(1, "fish")
+        finally:
+            await write_behind.close()
+            await connection_pool.close()
+
+    found, not_found, after_delete = asyncio.run(run())
+
+    assert [result["message_id"] for result in found["results"]] == [2]
+    assert "Fry the fish in <mark>butter</mark>." in found["results"][0]["snippet"]
+    assert not_found["results"] == []
+    assert after_delete["results"] == []
+
+
+def test_index_existing_messages(database, monkeypatch):
+    _add_dialog(database)
+    _add_message(database, "Fish for dinner")
+    _add_message(database, content_codec.encode(LONG_CONTENT, 100))
+    monkeypatch.setattr(search_model, "DATABASE", database)
+
+    async def run():
+        try:
+            before = await search_model.search(1, "fish")
+            indexed = await search_model.index_existing(batch_size=1)
+            after = await search_model.search(1, "butter")
+
+            # Messages deleted outside the app are removed from the index by a rebuild
+            connection = sqlite3.connect(database)
+            connection.execute("DELETE FROM message WHERE message_id = 2")
+            connection.commit()
+            connection.close()
+            rebuilt = await search_model.index_existing(rebuild=True)
+            return before, indexed, after, rebuilt
+        finally:
+            await connection_pool.close()
+
+    before, indexed, after, rebuilt = asyncio.run(run())
+
+    assert before["results"] == []
+    assert indexed == (0, 2)
+    assert [result["message_id"] for result in after["results"]] == [2]
+    assert rebuilt == (0, 1)
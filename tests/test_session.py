@@ -0,0 +1,32 @@
+import asyncio
+import sqlite3
+import time
+from types import SimpleNamespace
+from ollama_client.core import session
+from ollama_client.database import connection_pool
+
+
+def test_expired_token_is_not_logged_in(tmp_path, monkeypatch):
+    database = tmp_path / "test.db"
+    connection = sqlite3.connect(database)
+    connection.execute("CREATE TABLE user_token (user_token_id INTEGER PRIMARY KEY, user_id INTEGER, token TEXT, expires INTEGER)")
+    connection.execute("INSERT INTO user_token (user_id, token, expires) VALUES (1, 'valid', ?)", (int(time.time()) + 60,))
+    connection.execute("INSERT INTO user_token (user_id, token, expires) VALUES (2, 'expired', ?)", (int(time.time()) - 60,))
+    connection.commit()
+    connection.close()
+    monkeypatch.setattr(session, "DATABASE", database)
+
+    def request(user_id: int, token: str):
+        return SimpleNamespace(session={"user_id": {"value": user_id}, "token": {"value": token}})
+
+    async def run():
+        try:
+            return [
+                await session.is_logged_in(request(1, "valid")),
+                await session.is_logged_in(request(2, "expired")),
+                await session.is_logged_in(request(2, "valid")),
+            ]
+        finally:
+            await connection_pool.close()
+
+    assert asyncio.run(run()) == [1, 0, 0]
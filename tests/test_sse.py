@@ -0,0 +1,70 @@
+import asyncio
+import json
+from openai.types.chat import ChatCompletionChunk
+from ollama_client.core import sse
+
+
+def _chunk(content=None, finish_reason=None) -> ChatCompletionChunk:
+    return ChatCompletionChunk(
+        id="chunk",
+        object="chat.completion.chunk",
+        created=0,
+        model="model",
+        choices=[{"index": 0, "delta": {"content": content}, "finish_reason": finish_reason}],
+    )
+
+
+def _frames_data(frames: list) -> list:
+    return [json.loads(frame[len("data: ") :]) for frame in frames if frame]
+
+
+def test_compact_frames_without_coalescing():
+    encoder = sse.get_encoder("compact")
+    frames = [encoder.encode_chunk(_chunk("Hello")), encoder.encode_chunk(_chunk(" world", "stop"))]
+    assert _frames_data(frames) == [{"c": "Hello"}, {"c": " world", "f": "stop"}]
+
+
+def test_compact_frames_are_coalesced():
+    encoder = sse.get_encoder("compact", interval=60, max_chars=10)
+    frames = [encoder.encode_chunk(_chunk(token)) for token in ["a", "b", "c", "0123456789", "d"]]
+    frames.append(encoder.encode_chunk(_chunk(None, "stop")))
+    assert _frames_data(frames) == [{"c": "abc0123456789"}, {"c": "d", "f": "stop"}]
+
+
+def test_compact_error_flushes_content():
+    encoder = sse.get_encoder("compact", interval=60)
+    assert encoder.encode_chunk(_chunk("a")) == ""
+    assert _frames_data(encoder.encode_error("failed").split("\n\n")) == [{"c": "a"}, {"error": "failed"}]
+
+
+def test_verbose_frames():
+    encoder = sse.get_encoder("verbose")
+    data = _frames_data([encoder.encode_chunk(_chunk("Hello"))])[0]
+    assert data["choices"][0]["delta"]["content"] == "Hello"
+
+
+def test_buffered_content_is_flushed_when_the_model_pauses():
+    async def chunks():
+        yield _chunk("a")
+        await asyncio.sleep(0.2)
+        yield _chunk("b", "stop")
+
+    async def run():
+        encoder = sse.get_encoder("compact", interval=0.05)
+        frames = []
+        async for chunk in sse.with_flushes(chunks(), encoder):
+            frames.append(encoder.flush() if chunk is None else encoder.encode_chunk(chunk))
+        return frames
+
+    assert _frames_data(asyncio.run(run())) == [{"c": "a"}, {"c": "b", "f": "stop"}]
+
+
+def test_with_flushes_without_buffered_content():
+    async def chunks():
+        for token in ["a", "b"]:
+            yield _chunk(token)
+
+    async def run():
+        return [chunk async for chunk in sse.with_flushes(chunks(), sse.get_encoder("verbose"))]
+
+    assert [chunk.choices[0].delta.content for chunk in asyncio.run(run())] == ["a", "b"]
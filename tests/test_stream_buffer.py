@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+from ollama_client.core import stream_buffer
+
+
+async def _frames(num_frames: int, delay: float = 0.0):
+    for index in range(num_frames):
+        await asyncio.sleep(delay)
+        yield f"data: {index}\n\n"
+
+
+async def _collect(tail, limit: int = 0) -> list:
+    frames = []
+    async for frame in tail:
+        frames.append(frame)
+        if limit and len(frames) >= limit:
+            break
+    return frames
+
+
+def test_resume_replays_missed_frames():
+    async def run():
+        buffer = stream_buffer.create(1)
+        buffer.start(_frames(5, 0.01))
+
+        first = await _collect(buffer.tail(), limit=2)
+        rest = await _collect(buffer.tail(2))
+        return first, rest
+
+    first, rest = asyncio.run(run())
+    assert first == ["id: 1\ndata: 0\n\n", "id: 2\ndata: 1\n\n"]
+    assert rest == ["id: 3\ndata: 2\n\n", "id: 4\ndata: 3\n\n", "id: 5\ndata: 4\n\n"]
+
+
+def test_stream_of_other_user_is_not_found():
+    async def run():
+        buffer = stream_buffer.create(1)
+        return stream_buffer.get(buffer.stream_id, 2), stream_buffer.get(buffer.stream_id, 1)
+
+    other, owner = asyncio.run(run())
+    assert other is None
+    assert owner is not None
+
+
+def test_abandoned_stream_is_cancelled():
+    async def run():
+        buffer = stream_buffer.StreamBuffer("stream", 1, grace=0.05)
+        buffer.start(_frames(100, 0.01))
+        await _collect(buffer.tail(), limit=1)
+        await asyncio.sleep(0.2)
+        return buffer
+
+    buffer = asyncio.run(run())
+    assert buffer.finished
+    assert buffer.task.cancelled()
+    assert len(buffer.frames) < 100
+
+
+def test_oldest_frames_are_dropped_above_max_bytes():
+    async def run():
+        buffer = stream_buffer.StreamBuffer("stream", 1, grace=60, max_bytes=100)
+        buffer.start(_frames(100))
+        await buffer.task
+        return buffer, await _collect(buffer.tail(buffer.dropped)), await _collect(buffer.tail())
+
+    buffer, kept, behind = asyncio.run(run())
+    assert buffer.num_bytes <= 100
+    assert buffer.num_frames == 100
+    assert buffer.dropped > 0
+    assert kept[-1] == "id: 100\ndata: 99\n\n"
+    assert len(kept) == len(buffer.frames)
+
+    # A tail from a dropped frame ends at once instead of skipping frames
+    assert behind == []
+
+
+def test_running_streams_per_user_are_limited(monkeypatch):
+    monkeypatch.setattr(stream_buffer, "STREAM_MAX_RUNNING_PER_USER", 2)
+    monkeypatch.setattr(stream_buffer, "_buffers", stream_buffer.OrderedDict())
+
+    async def run():
+        buffers = [stream_buffer.create(1), stream_buffer.create(1)]
+        for buffer in buffers:
+            buffer.start(_frames(100, 0.01))
+
+        with pytest.raises(stream_buffer.TooManyStreams):
+            stream_buffer.create(1)
+
+        # Other users are not limited, and a finished stream frees a place
+        stream_buffer.create(2)
+        buffers[0].cancel()
+        await asyncio.sleep(0.01)
+        stream_buffer.create(1)
+        await stream_buffer.cancel_all()
+
+    asyncio.run(run())
@@ -0,0 +1,100 @@
+from ollama_client.core import token_budget
+
+
+def _message(role: str, num_words: int) -> dict:
+    return {"role": role, "content": " ".join(["word"] * num_words)}
+
+
+def test_estimate_tokens():
+    assert token_budget.estimate_tokens("") == 0
+    assert token_budget.estimate_tokens("hello world") == 3
+    assert token_budget.estimate_tokens("print(a, b)") == 6
+
+
+def test_token_counts_are_not_keyed_on_text():
+    text = "a long pasted text " * 1000
+    assert token_budget.estimate_tokens(text) == token_budget.estimate_tokens(text)
+    assert text not in token_budget._token_counts
+    assert all(len(key) == 16 for key in token_budget._token_counts._entries)
+
+
+def test_messages_within_budget_are_unchanged():
+    messages = [_message("system", 10), _message("user", 10), _message("assistant", 10)]
+    shaped, num_tokens = token_budget.shape_messages(messages, 1000)
+    assert shaped == messages
+    assert num_tokens == token_budget.estimate_messages_tokens(messages)
+
+
+def test_old_turns_are_left_out():
+    messages = [_message("system", 10)]
+    for _ in range(10):
+        messages.append(_message("user", 50))
+        messages.append(_message("assistant", 50))
+    messages.append(_message("user", 50))
+
+    shaped, num_tokens = token_budget.shape_messages(messages, 300)
+
+    assert num_tokens <= 300
+    assert shaped[0] == messages[0]
+    assert shaped[1]["role"] == "system"
+    assert "earlier messages were left out" in shaped[1]["content"]
+    assert shaped[-1] == messages[-1]
+
+
+def test_newest_message_is_truncated():
+    messages = [_message("user", 1000)]
+    shaped, num_tokens = token_budget.shape_messages(messages, 100)
+
+    assert len(shaped) == 1
+    assert token_budget.TRUNCATION_MARKER in shaped[0]["content"]
+    assert num_tokens <= 100
+
+
+def test_large_system_message_leaves_room_for_the_newest_message():
+    messages = [_message("system", 1000), _message("user", 10), _message("assistant", 10), _message("user", 200)]
+    shaped, num_tokens = token_budget.shape_messages(messages, 300)
+
+    assert num_tokens <= 300
+    assert shaped[0]["role"] == "system"
+    assert token_budget.TRUNCATION_MARKER in shaped[0]["content"]
+    assert "earlier messages were left out" in shaped[1]["content"]
+
+    # The newest message gets half the budget, so it is cut but not down to the marker
+    assert shaped[-1]["role"] == "user"
+    assert token_budget.estimate_message_tokens(shaped[-1]) >= 100
+
+
+def test_tool_results_are_kept_with_their_call():
+    tool_call = {"id": "call_0", "type": "function", "function": {"name": "search", "arguments": "{}"}}
+    messages = [
+        _message("user", 100),
+        _message("assistant", 100),
+        _message("user", 10),
+        {"role": "assistant", "tool_calls": [tool_call]},
+        {**_message("tool", 1000), "tool_call_id": "call_0"},
+    ]
+    shaped, num_tokens = token_budget.shape_messages(messages, 300)
+
+    assert num_tokens <= 300
+    assert [message["role"] for message in shaped] == ["system", "assistant", "tool"]
+    assert shaped[1] == messages[3]
+    assert shaped[2]["tool_call_id"] == "call_0"
+    assert token_budget.TRUNCATION_MARKER in shaped[2]["content"]
+
+
+def test_shaping_again_keeps_one_note():
+    messages = [_message("system", 10)]
+    for _ in range(10):
+        messages.append(_message("user", 50))
+        messages.append(_message("assistant", 50))
+    messages.append(_message("user", 50))
+
+    shaped, _ = token_budget.shape_messages(messages, 300)
+    num_left_out = len(messages) - len(shaped) + 1
+    shaped += [_message("assistant", 50), _message("user", 50)]
+    reshaped, num_tokens = token_budget.shape_messages(shaped, 300)
+
+    assert num_tokens <= 300
+    assert [message["role"] for message in reshaped[:3]] == ["system", "system", "user"]
+    assert reshaped[1]["content"] == token_budget.LEFT_OUT_NOTE.format(num_left_out + 2)
+    assert reshaped[-2:] == shaped[-2:]
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from openai.types.chat import ChatCompletionChunk
+from ollama_client.core import admission, token_budget
+from ollama_client.endpoints import endpoints_chat
+from ollama_client.tools import tool_runner
+
+
+def _tool_call(name: str, arguments: str = "{}") -> dict:
+    return {"id": "call_0", "type": "function", "function": {"name": name, "arguments": arguments}}
+
+
+def _sleep(seconds: float) -> str:
+    time.sleep(seconds)
+    return "slept"
+
+
+async def _async_sleep(seconds: float) -> str:
+    await asyncio.sleep(seconds)
+    return "slept"
+
+
+def _fail() -> str:
+    raise RuntimeError("boom")
+
+
+def test_run_tool_call(monkeypatch):
+    monkeypatch.setattr(tool_runner, "TOOL_REGISTRY", {"add": lambda a, b: a + b})
+
+    results = asyncio.run(tool_runner.run_tool_calls([_tool_call("add", '{"a": 1, "b": 2}'), _tool_call("missing")]))
+
+    assert results == ["3", "Unknown tool: missing"]
+    assert asyncio.run(tool_runner.run_tool_call(_tool_call("add", "{"))) == "Invalid arguments for tool: add"
+
+
+def test_tool_timeouts(monkeypatch):
+    monkeypatch.setattr(tool_runner, "TOOL_REGISTRY", {"sleep": _sleep, "async_sleep": _async_sleep})
+    monkeypatch.setattr(tool_runner, "TOOL_TIMEOUT", 0.05)
+    monkeypatch.setattr(tool_runner, "TOOL_TIMEOUTS", {"sleep": 1})
+
+    calls = [_tool_call("sleep", '{"seconds": 0.1}'), _tool_call("async_sleep", '{"seconds": 0.1}')]
+    results = asyncio.run(tool_runner.run_tool_calls(calls))
+
+    # The per-tool timeout of sleep is used instead of the default
+    assert results == ["slept", "Tool call timed out: async_sleep"]
+
+
+def test_tool_error_is_returned_to_the_model(monkeypatch):
+    monkeypatch.setattr(tool_runner, "TOOL_REGISTRY", {"fail": _fail})
+
+    assert asyncio.run(tool_runner.run_tool_call(_tool_call("fail"))) == "Tool call failed: fail"
+
+
+def _chunk(delta: dict, finish_reason=None) -> ChatCompletionChunk:
+    return ChatCompletionChunk.model_validate(
+        {
+            "id": "chunk",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "test-model",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+    )
+
+
+class _FakeResponse:
+    def __init__(self, chunks: list):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def close(self) -> None:
+        pass
+
+
+def test_tool_rounds_end_after_max_tool_rounds(monkeypatch):
+    requests: list = []
+
+    async def stream_chat_completion(provider: str, chat_args: dict):
+        requests.append(chat_args)
+
+        # The model calls a tool whenever tools are offered
+        if "tools" in chat_args:
+            tool_call = {"index": 0, "id": "call_0", "type": "function", "function": {"name": "add", "arguments": '{"a": 1, "b": 2}'}}
+            return _FakeResponse([_chunk({"tool_calls": [tool_call]}), _chunk({}, "tool_calls")])
+        return _FakeResponse([_chunk({"content": "Done"}), _chunk({}, "stop")])
+
+    monkeypatch.setattr(endpoints_chat.providers, "stream_chat_completion", stream_chat_completion)
+    monkeypatch.setattr(endpoints_chat.providers, "get_model_provider", lambda model: "test")
+    monkeypatch.setattr(endpoints_chat, "MAX_TOOL_ROUNDS", 2)
+    monkeypatch.setattr(endpoints_chat, "TOOL_MODELS", ["test-model"])
+    monkeypatch.setattr(endpoints_chat, "TOOLS", [{"type": "function", "function": {"name": "add"}}])
+    monkeypatch.setattr(tool_runner, "TOOL_REGISTRY", {"add": lambda a, b: a + b})
+
+    async def run():
+        ticket = admission.AdmissionController().enqueue(1)
+        messages = [{"role": "user", "content": "Add 1 and 2"}]
+        frames = [frame async for frame in endpoints_chat._chat_response_stream(messages, "test-model", 1, ticket)]
+        return messages, frames
+
+    messages, frames = asyncio.run(run())
+
+    # Two rounds with tools and a last round without them
+    assert ["tools" in chat_args for chat_args in requests] == [True, True, False]
+    assert [message["role"] for message in messages] == ["user", "assistant", "tool", "assistant", "tool"]
+    assert messages[2]["content"] == "3"
+    assert any("Done" in frame for frame in frames)
+
+
+def test_tool_rounds_fit_the_context_budget(monkeypatch):
+    prompts: list = []
+
+    async def stream_chat_completion(provider: str, chat_args: dict):
+        prompts.append(list(chat_args["messages"]))
+        if "tools" in chat_args:
+            tool_call = {"index": 0, "id": f"call_{len(prompts)}", "type": "function", "function": {"name": "read", "arguments": "{}"}}
+            return _FakeResponse([_chunk({"tool_calls": [tool_call]}), _chunk({}, "tool_calls")])
+        return _FakeResponse([_chunk({"content": "Done"}), _chunk({}, "stop")])
+
+    monkeypatch.setattr(endpoints_chat.providers, "stream_chat_completion", stream_chat_completion)
+    monkeypatch.setattr(endpoints_chat.providers, "get_model_provider", lambda model: "test")
+    monkeypatch.setattr(endpoints_chat.providers, "get_context_budget", lambda model: 500)
+    monkeypatch.setattr(endpoints_chat, "MAX_TOOL_ROUNDS", 2)
+    monkeypatch.setattr(endpoints_chat, "TOOL_MODELS", ["test-model"])
+    monkeypatch.setattr(endpoints_chat, "TOOLS", [{"type": "function", "function": {"name": "read"}}])
+
+    # Each tool result alone takes most of the budget
+    monkeypatch.setattr(tool_runner, "TOOL_REGISTRY", {"read": lambda: "word " * 400})
+
+    async def run():
+        ticket = admission.AdmissionController().enqueue(1)
+        messages = [{"role": "system", "content": "Be brief"}, {"role": "user", "content": "Read it"}]
+        return [frame async for frame in endpoints_chat._chat_response_stream(messages, "test-model", 1, ticket)]
+
+    frames = asyncio.run(run())
+
+    assert len(prompts) == 3
+    assert any("Done" in frame for frame in frames)
+    for prompt in prompts[1:]:
+        assert token_budget.estimate_messages_tokens(prompt) <= 500
+        assert prompt[0] == {"role": "system", "content": "Be brief"}
+        assert [message["role"] for message in prompt[-2:]] == ["assistant", "tool"]
+        assert prompt[-1]["tool_call_id"] == prompt[-2]["tool_calls"][0]["id"]
+
+    # The results of the first round are left out of the last round
+    assert "earlier messages were left out" in prompts[2][1]["content"]
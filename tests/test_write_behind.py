@@ -0,0 +1,117 @@
+import asyncio
+import sqlite3
+import pytest
+from ollama_client.database import connection_pool, write_behind
+from ollama_client.database.database_utils import DatabaseConnection
+
+
+def _message(content: str, role: str | None = "user") -> dict:
+    return {"dialog_id": "dialog-1", "user_id": 1, "role": role, "content": content}
+
+
+def _contents(path) -> list:
+    connection = sqlite3.connect(path)
+    rows = connection.execute("SELECT content FROM message ORDER BY message_id").fetchall()
+    connection.close()
+    return [row[0] for row in rows]
+
+
+@pytest.fixture
+def queue(database, monkeypatch):
+    """
+    A write-behind queue on the test database. queue.transactions counts the write transactions
+    and queue.inserted records the row counts passed to the after_insert hook of message.
+    """
+    connection = sqlite3.connect(database)
+    connection.execute("INSERT INTO dialog (dialog_id, user_id, title) VALUES ('dialog-1', 1, 'Dialog')")
+    connection.commit()
+    connection.close()
+
+    queue = write_behind.WriteBehindQueue(database, max_batch=500, delay=0.01)
+    queue.transactions = 0
+    queue.inserted = []
+
+    class CountingConnection(DatabaseConnection):
+        def async_transaction_scope(self):
+            queue.transactions += 1
+            return super().async_transaction_scope()
+
+    async def after_insert(connection, num_rows: int) -> None:
+        queue.inserted.append(num_rows)
+
+    monkeypatch.setattr(write_behind, "DatabaseConnection", CountingConnection)
+    queue.after_insert["message"] = after_insert
+    return queue
+
+
+def test_queued_rows_are_written_in_one_commit(database, queue):
+    async def run():
+        try:
+            for number in range(5):
+                queue.insert("message", _message(f"Message {number}"))
+            await queue.flush()
+        finally:
+            await queue.close()
+            await connection_pool.close()
+
+    asyncio.run(run())
+
+    assert _contents(database) == [f"Message {number}" for number in range(5)]
+    assert queue.transactions == 1
+    assert queue.inserted == [5]
+    assert queue.pending == 0
+
+
+def test_flush_waits_for_rows_queued_before(database, queue):
+    async def run():
+        try:
+            queue.insert("message", _message("First"))
+            queue.insert("message", _message("Second"))
+            before_flush = _contents(database)
+            await queue.flush()
+            return before_flush, _contents(database)
+        finally:
+            await queue.close()
+            await connection_pool.close()
+
+    before_flush, after_flush = asyncio.run(run())
+
+    assert before_flush == []
+    assert after_flush == ["First", "Second"]
+
+
+def test_bad_row_is_written_row_by_row(database, queue):
+    async def run():
+        try:
+            queue.insert("message", _message("First"))
+            queue.insert("message", _message("Bad", role=None))
+            queue.insert("message", _message("Last"))
+            await queue.flush()
+        finally:
+            await queue.close()
+            await connection_pool.close()
+
+    asyncio.run(run())
+
+    # The failed batch is rolled back, then each row is written in its own transaction
+    assert _contents(database) == ["First", "Last"]
+    assert queue.transactions == 4
+    assert queue.inserted == [1, 1]
+    assert queue.pending == 0
+
+
+def test_close_writes_remaining_rows(database, queue):
+    async def write(content: str):
+        try:
+            queue.insert("message", _message(content))
+            await queue.close()
+        finally:
+            await connection_pool.close()
+
+    asyncio.run(write("First"))
+    assert _contents(database) == ["First"]
+    assert queue.task is None
+
+    # A new event loop gets its own queue and writer
+    asyncio.run(write("Second"))
+    assert _contents(database) == ["First", "Second"]